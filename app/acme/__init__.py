@@ -1,7 +1,8 @@
 import asyncio
 from typing import Any
 
-from fastapi import APIRouter
+import orjson
+from fastapi import APIRouter, Depends
 from fastapi.responses import JSONResponse
 
 from .account import router as account_router
@@ -12,17 +13,26 @@ from .challenge import router as challenge_router
 from .directory import router as directory_router
 from .nonce import cronjob as nonce_cronjob
 from .nonce import router as nonce_router
+from .order import cronjob as order_cronjob
 from .order import router as order_router
+from .ratelimit import cronjob as ratelimit_cronjob
+from .ratelimit import service as ratelimit_service
+from .renewal_info import router as renewal_info_router
 
 
 class ACMEResponse(JSONResponse):
+    """
+    The handlers annotate their return type (`dict[str, Any]`), so FastAPI converts the result (e.g. datetimes) with pydantic-core
+    instead of its much slower `jsonable_encoder`. The result is serialized with orjson.
+    """
+
     def render(self, content: dict[str, Any] | None) -> bytes:
-        return super().render(  # remove null fields from responses
+        return orjson.dumps(  # remove null fields from responses
             {k: v for k, v in content.items() if v is not None} if content is not None else None
         )
 
 
-router = APIRouter(prefix='/acme', default_response_class=ACMEResponse)
+router = APIRouter(prefix='/acme', default_response_class=ACMEResponse, dependencies=[Depends(ratelimit_service.limit_ip)])
 router.include_router(account_router.api)
 router.include_router(authorization_router.api)
 router.include_router(certificate_router.api)
@@ -30,10 +40,21 @@ router.include_router(challenge_router.api)
 router.include_router(directory_router.api)
 router.include_router(nonce_router.api)
 router.include_router(order_router.api)
+router.include_router(renewal_info_router.api)
 
 
 async def start_cronjobs():
+    """the cronjobs working on the database, they run in one worker only"""
     await asyncio.gather(
         certificate_cronjob.start(),
         nonce_cronjob.start(),
+        order_cronjob.start(),
+    )
+
+
+async def start_worker_cronjobs():
+    """the cronjobs working on the state of a worker process (e.g. in-memory rate limits), they run in every worker"""
+    await asyncio.gather(
+        nonce_cronjob.start_reservoir(),
+        ratelimit_cronjob.start(),
     )
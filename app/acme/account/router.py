@@ -1,5 +1,5 @@
 import secrets
-from typing import Annotated, Literal
+from typing import Annotated, Any, Literal
 
 import db
 import mail
@@ -10,6 +10,7 @@ from pydantic import BaseModel, conlist, constr
 
 from ..exceptions import ACMEException
 from ..middleware import RequestData, SignedRequest
+from ..urls import ACCOUNTS_URL, ORDERS_URL
 
 tosAgreedType = Literal[True] if settings.acme.terms_of_service_url else (bool | None)
 contactType = conlist(
@@ -53,14 +54,14 @@ api = APIRouter(tags=['acme:account'])
 async def create_or_view_account(
     response: Response,
     data: Annotated[RequestData[NewOrViewAccountPayload], Depends(SignedRequest(NewOrViewAccountPayload, allow_new_account=True))],
-):
+) -> dict[str, Any]:
     """
     https://www.rfc-editor.org/rfc/rfc8555.html#section-7.3
     """
-    jwk_json: dict = data.key.export(as_dict=True)
+    jwk_thumbprint = data.key.thumbprint()
 
     async with db.transaction() as sql:
-        result = await sql.record("""select id, mail, status from accounts where jwk=$1 and (id=$2 or $2::text is null)""", jwk_json, data.account_id)
+        result = await sql.record("""select id, mail, status from accounts where jwk_thumbprint=$1 and (id=$2 or $2::text is null)""", jwk_thumbprint, data.account_id)
     account_exists = bool(result)
 
     if account_exists:
@@ -75,10 +76,11 @@ async def create_or_view_account(
             account_id = secrets.token_urlsafe(16)
             async with db.transaction() as sql:
                 account_status = await sql.value(
-                    """insert into accounts (id, mail, jwk) values ($1, $2, $3) returning status""",
+                    """insert into accounts (id, mail, jwk, jwk_thumbprint) values ($1, $2, $3, $4) returning status""",
                     account_id,
                     mail_addr,
-                    jwk_json,
+                    data.key.export(as_dict=True),
+                    jwk_thumbprint,
                 )
             if mail_addr:
                 try:
@@ -87,11 +89,11 @@ async def create_or_view_account(
                     logger.error('could not send new account mail to "%s"', mail_addr, exc_info=True)
 
     response.status_code = 200 if account_exists else 201
-    response.headers['Location'] = f'{settings.external_url}acme/accounts/{account_id}'
+    response.headers['Location'] = f'{ACCOUNTS_URL}{account_id}'
     return {
         'status': account_status,
         'contact': ['mailto:' + mail_addr] if mail_addr else [],
-        'orders': f'{settings.external_url}acme/accounts/{account_id}/orders',
+        'orders': f'{ACCOUNTS_URL}{account_id}/orders',
     }
 
 
@@ -105,7 +107,7 @@ async def change_key(data: Annotated[RequestData, Depends(SignedRequest())]):
 async def view_or_update_account(
     acc_id: str,
     data: Annotated[RequestData[UpdateAccountPayload], Depends(SignedRequest(UpdateAccountPayload, allow_blocked_account=True))],
-):
+) -> dict[str, Any]:
     if acc_id != data.account_id:
         raise ACMEException(status_code=status.HTTP_403_FORBIDDEN, exctype='unauthorized', detail='wrong kid', new_nonce=data.new_nonce)
 
@@ -136,16 +138,43 @@ async def view_or_update_account(
     return {
         'status': account_status,
         'contact': ['mailto:' + mail_addr] if mail_addr else [],
-        'orders': f'{settings.external_url}acme/accounts/{acc_id}/orders',
+        'orders': f'{ACCOUNTS_URL}{acc_id}/orders',
     }
 
 
 @api.post('/accounts/{acc_id}/orders', tags=['acme:order'])
-async def view_orders(acc_id: str, data: Annotated[RequestData, Depends(SignedRequest())]):
+async def view_orders(acc_id: str, response: Response, data: Annotated[RequestData, Depends(SignedRequest())], cursor: str | None = None) -> dict[str, Any]:
+    """
+    https://www.rfc-editor.org/rfc/rfc8555#section-7.1.2.1
+    orders are listed oldest first, `cursor` is the last order id of the previous page
+    """
     if acc_id != data.account_id:
         raise ACMEException(status_code=status.HTTP_403_FORBIDDEN, exctype='unauthorized', detail='wrong account id provided', new_nonce=data.new_nonce)
     async with db.transaction(readonly=True) as sql:
-        orders = [order_id async for order_id, *_ in sql("""select id from orders where account_id = $1 and status <> 'invalid'""", acc_id)]
+        cursor_created_at = None
+        if cursor is not None:
+            cursor_created_at = await sql.value("""select created_at from orders where id = $1 and account_id = $2""", cursor, acc_id)
+            if cursor_created_at is None:  # e.g. purged by the retention job, an empty page would silently end the listing
+                raise ACMEException(exctype='malformed', detail='Unknown order list cursor, restart listing without cursor.', new_nonce=data.new_nonce)
+        orders = [
+            order_id
+            async for order_id, *_ in sql(
+                """
+                select id from orders
+                where account_id = $1 and status <> 'invalid'
+                    and ($2::timestamptz is null or (created_at, id) > ($2::timestamptz, $3::text))
+                order by created_at, id
+                limit $4
+                """,
+                acc_id,
+                cursor_created_at,
+                cursor,
+                settings.acme.orders_page_size + 1,  # one more row to know whether there is a next page
+            )
+        ]
+    if len(orders) > settings.acme.orders_page_size:
+        orders = orders[:-1]
+        response.headers.append('Link', f'<{ACCOUNTS_URL}{acc_id}/orders?cursor={orders[-1]}>;rel="next"')
     return {
-        'orders': [f'{settings.external_url}acme/orders/{order_id}' for order_id in orders],
+        'orders': [ORDERS_URL + order_id for order_id in orders],
     }
@@ -1,12 +1,12 @@
-from typing import Annotated, Literal, Optional
+from typing import Annotated, Any, Literal, Optional
 
 import db
-from config import settings
 from fastapi import APIRouter, Depends, status
 from pydantic import BaseModel
 
 from ..exceptions import ACMEException
 from ..middleware import RequestData, SignedRequest
+from ..urls import CHALLENGES_URL
 
 
 class UpdateAuthzPayload(BaseModel):
@@ -20,7 +20,7 @@ api = APIRouter(tags=['acme:authorization'])
 async def view_or_update_authorization(
     authz_id: str,
     data: Annotated[RequestData[Optional[UpdateAuthzPayload]], Depends(SignedRequest(Optional[UpdateAuthzPayload]))],
-):
+) -> dict[str, Any]:
     async with db.transaction(readonly=True) as sql:
         record = await sql.record(
             """
@@ -48,7 +48,7 @@ async def view_or_update_authorization(
                     authz_status = await sql.value("""update authorizations set status = 'deactivated' where id = $1 returning status""", authz_id)
         chal = {
             'type': 'http-01',
-            'url': f'{settings.external_url}acme/challenges/{chal_id}',
+            'url': CHALLENGES_URL + chal_id,
             'token': chal_token,
             'status': chal_status,
             'validated': chal_validated_at,
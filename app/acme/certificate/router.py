@@ -8,7 +8,7 @@ from pydantic import BaseModel, constr
 
 from ..exceptions import ACMEException
 from ..middleware import RequestData, SignedRequest
-from .service import SerialNumberConverter, parse_cert
+from .service import SerialNumberConverter, load_chain, parse_cert
 
 
 class RevokeCertPayload(BaseModel):
@@ -28,19 +28,10 @@ async def download_cert(
         default='*/*', pattern=r'(application/pem\-certificate\-chain|\*/\*)', description='Certificates are only supported as "application/pem-certificate-chain"'
     ),
 ):
-    async with db.transaction(readonly=True) as sql:
-        pem_chain = await sql.value(
-            """
-            select cert.chain_pem from certificates cert
-            join orders ord on cert.order_id = ord.id
-            where cert.serial_number = $1 and ord.account_id = $2
-            """,
-            serial_number,
-            data.account_id,
-        )
-    if not pem_chain:
+    chain = await load_chain(serial_number)
+    if not chain or chain.account_id != data.account_id:
         raise ACMEException(status_code=status.HTTP_404_NOT_FOUND, exctype='malformed', detail='specified certificate not found for current account', new_nonce=data.new_nonce)
-    return Response(content=pem_chain, headers=response.headers, media_type='application/pem-certificate-chain')
+    return Response(content=chain.pem, headers=response.headers, media_type='application/pem-certificate-chain')
 
 
 @api.post('/revoke-cert', response_class=Response)
@@ -49,7 +40,6 @@ async def revoke_cert(data: Annotated[RequestData[RevokeCertPayload], Depends(Si
     https://www.rfc-editor.org/rfc/rfc8555#section-7.6
     """
     # this request might use account id or the account public key
-    jwk_json: dict = data.key.export(as_dict=True)
     cert_bytes = base64url_decode(data.payload.certificate)
     cert = await parse_cert(cert_bytes)
     serial_number = SerialNumberConverter.int2hex(cert.serial_number)
@@ -62,11 +52,11 @@ async def revoke_cert(data: Annotated[RequestData[RevokeCertPayload], Depends(Si
                 join accounts a on a.id = o.account_id
             where
                 c.serial_number = $1 and c.revoked_at is null and
-                ($2::text is null or (a.id = $2::text and a.status='valid')) and a.jwk=$3
+                ($2::text is null or (a.id = $2::text and a.status='valid')) and a.jwk_thumbprint=$3
             """,
             serial_number,
             data.account_id,
-            jwk_json,
+            data.key.thumbprint(),
         )
     if not ok:
         raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='alreadyRevoked', detail='cert already revoked or not accessible', new_nonce=data.new_nonce)
@@ -1,11 +1,32 @@
 import asyncio
+import gzip
+import ssl
+from collections import OrderedDict
+from typing import Any, NamedTuple
 
+import db
+import metrics
+from config import settings
 from cryptography import x509
 from cryptography.hazmat.primitives import serialization
 from fastapi import status
+from logger import logger
 
 from ..exceptions import ACMEException
 
+# the chain of an issuer never changes, so it is cached once loaded (there are only a few issuers)
+_issuer_chains: dict[str, str] = {}
+
+
+class CachedChain(NamedTuple):
+    account_id: str | None
+    pem: bytes
+    pem_gzip: bytes
+
+
+# recently issued or downloaded chains by serial number (LRU), certificates never change so entries are never invalidated
+_chain_cache: OrderedDict[str, CachedChain] = OrderedDict()
+
 
 class SerialNumberConverter:
     @staticmethod
@@ -22,7 +43,6 @@ async def check_csr(csr_der: bytes, ordered_domains: list[str], new_nonce: str |
     check csr and return contained values
     """
     csr = await asyncio.to_thread(x509.load_der_x509_csr, csr_der)
-    csr_pem_job = asyncio.to_thread(csr.public_bytes, serialization.Encoding.PEM)
 
     if not csr.is_signature_valid:
         raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='badCSR', detail='invalid signature', new_nonce=new_nonce)
@@ -41,10 +61,154 @@ async def check_csr(csr_der: bytes, ordered_domains: list[str], new_nonce: str |
     if csr_domains != set(ordered_domains):
         raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='badCSR', detail='domains in CSR does not match validated domains in ACME order', new_nonce=new_nonce)
 
-    csr_pem: str = (await csr_pem_job).decode()
-    return csr, csr_pem, subject_domain, csr_domains
+    return csr, subject_domain, csr_domains
 
 
 async def parse_cert(cert_der: bytes):
     cert = await asyncio.to_thread(x509.load_der_x509_certificate, cert_der)
     return cert
+
+
+def split_chain(chain_pem: str) -> tuple[bytes, str | None, str]:
+    """
+    splits a PEM chain into the leaf cert (DER), the serial number of the issuing cert and the issuer chain (PEM).
+    The serial number is None if the chain contains only the leaf cert
+    """
+    leaf_pem, marker, issuer_chain_pem = chain_pem.partition('-----END CERTIFICATE-----')
+    leaf_der = x509.load_pem_x509_certificate((leaf_pem + marker).encode()).public_bytes(serialization.Encoding.DER)
+    issuer_chain_pem = issuer_chain_pem.lstrip()
+    if not issuer_chain_pem:
+        return leaf_der, None, ''
+    issuer_serial_number = SerialNumberConverter.int2hex(x509.load_pem_x509_certificate(issuer_chain_pem.encode()).serial_number)
+    return leaf_der, issuer_serial_number, issuer_chain_pem
+
+
+_INSERT_ISSUER = """insert into issuers (serial_number, chain_pem) values ($1, $2) on conflict do nothing"""
+
+
+async def store_issuer(serial_number: str | None, chain_pem: str):
+    """
+    stores the chain of an issuing CA once per process. It is committed in its own transaction before it is cached,
+    so a rolled back certificate transaction cannot leave a cached issuer which is missing in the database
+    """
+    if serial_number is not None and serial_number not in _issuer_chains:
+        async with db.transaction() as sql:
+            await sql.exec(_INSERT_ISSUER, serial_number, chain_pem)
+        _issuer_chains[serial_number] = chain_pem
+
+
+async def assemble_chain(record: Any) -> str:
+    """
+    the PEM chain of a certificate row (columns cert_der, issuer_serial_number and chain_pem), the issuer chain might be loaded,
+    so this should be called after the transaction which fetched the row is closed
+    """
+    if record['cert_der'] is None:  # not converted yet
+        return record['chain_pem']
+    if (serial_number := record['issuer_serial_number']) is None:
+        return join_chain(record['cert_der'], '')
+    if serial_number not in _issuer_chains:
+        async with db.transaction(readonly=True) as sql:
+            _issuer_chains[serial_number] = await sql.value("""select chain_pem from issuers where serial_number = $1""", serial_number)
+    return join_chain(record['cert_der'], _issuer_chains[serial_number])
+
+
+def join_chain(cert_der: bytes, issuer_chain_pem: str) -> str:
+    return ssl.DER_cert_to_PEM_cert(cert_der) + issuer_chain_pem
+
+
+def cache_chain(serial_number: str, account_id: str | None, chain_pem: str) -> CachedChain:
+    """caches the chain (also gzip compressed for downloads) and returns the entry"""
+    pem = chain_pem.encode()
+    entry = CachedChain(account_id, pem, gzip.compress(pem, mtime=0))
+    if settings.acme.certificate_cache_size:
+        _chain_cache[serial_number] = entry
+        _chain_cache.move_to_end(serial_number)
+        while len(_chain_cache) > settings.acme.certificate_cache_size:
+            _chain_cache.popitem(last=False)
+    return entry
+
+
+async def load_chain(serial_number: str) -> CachedChain | None:
+    """the chain of a certificate and the account which ordered it, from the cache or the database"""
+    if (entry := _chain_cache.get(serial_number)) is not None:
+        _chain_cache.move_to_end(serial_number)
+        metrics.certificate_cache.labels('hit').inc()
+        return entry
+    metrics.certificate_cache.labels('miss').inc()
+    async with db.transaction(readonly=True) as sql:
+        record = await sql.record(
+            """
+            select cert.cert_der, cert.issuer_serial_number, cert.chain_pem, ord.account_id from certificates cert
+            join orders ord on cert.order_id = ord.id
+            where cert.serial_number = $1
+            """,
+            serial_number,
+        )
+    if not record:
+        return None
+    return cache_chain(serial_number, record['account_id'], await assemble_chain(record))
+
+
+def leaf_cert(record: Any) -> x509.Certificate:
+    """the leaf cert of a certificate row (columns cert_der and chain_pem)"""
+    if record['cert_der'] is None:  # not converted yet
+        return x509.load_pem_x509_certificate(record['chain_pem'].encode())
+    return x509.load_der_x509_certificate(record['cert_der'])
+
+
+def _convert_sync(records: list[Any]) -> list[tuple[str, bytes, str | None, str, bytes | None]]:
+    converted = []
+    for serial_number, chain_pem, csr_pem in records:
+        try:
+            cert_der, issuer_serial_number, issuer_chain_pem = split_chain(chain_pem)
+        except ValueError:
+            logger.warning('Could not convert certificate %s, it is kept as PEM', serial_number)
+            continue
+        try:
+            csr_der = x509.load_pem_x509_csr(csr_pem.encode()).public_bytes(serialization.Encoding.DER) if csr_pem else None
+        except ValueError:
+            csr_der = None
+        converted.append((serial_number, cert_der, issuer_serial_number, issuer_chain_pem, csr_der))
+    return converted
+
+
+async def convert_pem_certificates(batch_size: int = 1000) -> int:
+    """
+    converts certificates stored as PEM (before migration 009) to DER and moves their issuer chain into the issuers table.
+    Runs in batches, so the table is never locked as a whole (the migrations run in a single transaction). Returns the number of converted rows
+    """
+    count = 0
+    after = ''
+    while True:
+        async with db.transaction() as sql:
+            records = [
+                record
+                async for record in sql(
+                    """
+                    select serial_number, chain_pem, csr_pem from certificates
+                    where cert_der is null and serial_number > $1::text
+                    order by serial_number limit $2
+                    for update skip locked
+                    """,
+                    after,
+                    batch_size,
+                )
+            ]
+            if not records:
+                break
+            after = records[-1]['serial_number']
+            converted = await asyncio.to_thread(_convert_sync, records)
+            for issuer_serial_number, issuer_chain_pem in {(issuer_sn, issuer_chain) for _, _, issuer_sn, issuer_chain, _ in converted}:
+                if issuer_serial_number is not None:
+                    await sql.exec(_INSERT_ISSUER, issuer_serial_number, issuer_chain_pem)
+            await sql.execmany(
+                """
+                update certificates set cert_der = $2, issuer_serial_number = $3, csr_der = $4, chain_pem = null, csr_pem = null
+                where serial_number = $1 and cert_der is null
+                """,
+                *[(serial_number, cert_der, issuer_sn, csr_der) for serial_number, cert_der, issuer_sn, _, csr_der in converted],
+            )
+        count += len(converted)
+    if count:
+        logger.info('Converted %s certificates from PEM to DER', count)
+    return count
@@ -1,5 +1,6 @@
-from typing import Annotated, Literal
+from typing import Annotated, Any, Literal
 
+import admission
 import db
 from config import settings
 from fastapi import APIRouter, Depends, Response, status
@@ -7,13 +8,15 @@ from logger import logger
 
 from ..exceptions import ACMEException
 from ..middleware import RequestData, SignedRequest
+from ..singleflight import SingleFlight
+from ..urls import CHALLENGES_URL
 from . import service
 
 api = APIRouter(tags=['acme:challenge'])
 
 
-@api.post('/challenges/{chal_id}')
-async def verify_challenge(response: Response, chal_id: str, data: Annotated[RequestData, Depends(SignedRequest())]):
+async def validate(chal_id: str, data: RequestData) -> tuple[str, dict[str, Any]]:
+    """the challenge (validated if it is pending) and the id of its authorization"""
     must_solve_challenge = False
     async with db.transaction() as sql:
         record = await sql.record(
@@ -46,8 +49,9 @@ async def verify_challenge(response: Response, chal_id: str, data: Annotated[Req
             chal_status = 'invalid'
         if chal_status == 'pending' and order_status == 'pending':
             if authz_status == 'pending':
-                must_solve_challenge = True
-                chal_status = await sql.value("""update challenges set status = 'processing' where id = $1 returning status""", chal_id)
+                # only one request (of all processes) may validate the challenge, concurrent requests of other processes answer with processing
+                must_solve_challenge = await sql.value("""update challenges set status = 'processing' where id = $1 and status = 'pending' returning true""", chal_id)
+                chal_status = 'processing'
             else:
                 await sql.value(
                     """
@@ -62,19 +66,21 @@ async def verify_challenge(response: Response, chal_id: str, data: Annotated[Req
     else:
         acme_error = None
 
-    # use append because there can be multiple Link-Headers with different rel targets
-    response.headers.append('Link', f'<{settings.external_url}authorization/{authz_id}>;rel="up"')
-
     if must_solve_challenge:
         err: Literal[False] | ACMEException
         try:
             await service.check_challenge_is_fulfilled(domain=domain, token=token, jwk=data.key, new_nonce=data.new_nonce)
             err = False
+        except admission.Overloaded:
+            async with db.transaction() as sql:  # the challenge was not validated, so it can be retried
+                await sql.exec("""update challenges set status = 'pending' where id = $1 and status = 'processing'""", chal_id)
+            raise
         except ACMEException as e:
             err = e
+            logger.info('challenge failed for %s (account: %s): %s', domain, data.account_id, e.detail, extra={'category': 'challenge_failed'})
         except Exception as e:
             err = ACMEException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, exctype='serverInternal', detail=str(e), new_nonce=data.new_nonce)
-            logger.warning('challenge failed for %s (account: %s)', domain, data.account_id, exc_info=True)
+            logger.warning('challenge failed for %s (account: %s)', domain, data.account_id, exc_info=True, extra={'category': 'challenge_failed'})
         if err is False:
             async with db.transaction() as sql:
                 chal_status, chal_validated_at = await sql.record(
@@ -110,11 +116,23 @@ async def verify_challenge(response: Response, chal_id: str, data: Annotated[Req
                     order_id,
                 )
 
-    return {
+    return authz_id, {
         'type': 'http-01',
-        'url': f'{settings.external_url}acme/challenges/{chal_id}',
+        'url': CHALLENGES_URL + chal_id,
         'status': chal_status,
         'validated': chal_validated_at,
         'token': token,
         'error': acme_error.value if acme_error else None,
     }
+
+
+# retries of an impatient client share the running validation instead of validating the challenge again
+validations: SingleFlight[tuple[str, dict[str, Any]]] = SingleFlight('challenge')
+
+
+@api.post('/challenges/{chal_id}')
+async def verify_challenge(response: Response, chal_id: str, data: Annotated[RequestData, Depends(SignedRequest())]) -> dict[str, Any]:
+    authz_id, result = await validations.run((data.account_id, chal_id), lambda: validate(chal_id, data), new_nonce=data.new_nonce)
+    # use append because there can be multiple Link-Headers with different rel targets
+    response.headers.append('Link', f'<{settings.external_url}authorization/{authz_id}>;rel="up"')
+    return result
@@ -1,14 +1,30 @@
 import asyncio
+import time
 from typing import Literal
 
+import admission
 import httpx
 import jwcrypto.jwk
+import metrics
+import timing
 from fastapi import status
 
 from ..exceptions import ACMEException
 
 
 async def check_challenge_is_fulfilled(*, domain: str, token: str, jwk: jwcrypto.jwk.JWK, new_nonce: str | None = None):
+    started_at = time.perf_counter()
+    try:
+        await _check_challenge_is_fulfilled(domain=domain, token=token, jwk=jwk, new_nonce=new_nonce)
+    except ACMEException as exc:
+        metrics.challenge_validation_duration.labels(exc.exc_type).observe(time.perf_counter() - started_at)
+        raise
+    finally:
+        timing.record('challenge', time.perf_counter() - started_at)
+    metrics.challenge_validation_duration.labels('valid').observe(time.perf_counter() - started_at)
+
+
+async def _check_challenge_is_fulfilled(*, domain: str, token: str, jwk: jwcrypto.jwk.JWK, new_nonce: str | None = None):
     for _ in range(3):  # 3x retry
         err: Literal[False] | ACMEException
         try:
@@ -22,7 +38,8 @@ async def check_challenge_is_fulfilled(*, domain: str, token: str, jwk: jwcrypto
                 follow_redirects=False,
                 trust_env=False,  # do not load proxy information from env vars
             ) as client:
-                res = await client.get(f'http://{domain}:80/.well-known/acme-challenge/{token}')
+                async with admission.challenge.slot():
+                    res = await client.get(f'http://{domain}:80/.well-known/acme-challenge/{token}')
                 if res.status_code == 200 and res.text.rstrip() == f'{token}.{jwk.thumbprint()}':
                     err = False
                 else:
@@ -32,6 +49,8 @@ async def check_challenge_is_fulfilled(*, domain: str, token: str, jwk: jwcrypto
                         detail='presented token does not match challenge',
                         new_nonce=new_nonce,
                     )
+        except admission.Overloaded:
+            raise
         except httpx.ConnectTimeout:
             err = ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='connection', detail='timeout', new_nonce=new_nonce)
         except httpx.ConnectError:
@@ -1,24 +1,44 @@
+import hashlib
+from functools import lru_cache
+
+import orjson
 from config import settings
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response, status
+from headers import etag_matches
+from pydantic import AnyHttpUrl
+
+from ..urls import BASE_URL
 
 api = APIRouter(tags=['acme:directory'])
 
 
-@api.get('/directory')
-async def get_directory():
+@lru_cache(maxsize=1)
+def render_directory(terms_of_service_url: AnyHttpUrl | None) -> tuple[bytes, str]:
+    """the directory as JSON and its ETag, only the terms of service can differ (e.g. in tests)"""
+    meta = {'website': str(settings.external_url)}
+    if terms_of_service_url:
+        meta['termsOfService'] = str(terms_of_service_url)
+    body = orjson.dumps(
+        {
+            'newNonce': f'{BASE_URL}new-nonce',
+            'newAccount': f'{BASE_URL}new-account',
+            'newOrder': f'{BASE_URL}new-order',
+            'revokeCert': f'{BASE_URL}revoke-cert',
+            'keyChange': f'{BASE_URL}key-change',
+            'renewalInfo': f'{BASE_URL}renewal-info',
+            # newAuthz: is not supported
+            'meta': meta,
+        }
+    )
+    return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+@api.get('/directory', response_class=Response, responses={200: {'content': {'application/json': {}}}})
+async def get_directory(request: Request):
     """
     See RFC 8555 7.1.1 "Directory" <https://www.rfc-editor.org/rfc/rfc8555#section-7.1.1>
     """
-
-    meta = {'website': settings.external_url}
-    if settings.acme.terms_of_service_url:
-        meta['termsOfService'] = settings.acme.terms_of_service_url
-    return {
-        'newNonce': f'{settings.external_url}acme/new-nonce',
-        'newAccount': f'{settings.external_url}acme/new-account',
-        'newOrder': f'{settings.external_url}acme/new-order',
-        'revokeCert': f'{settings.external_url}acme/revoke-cert',
-        'keyChange': f'{settings.external_url}acme/key-change',
-        # newAuthz: is not supported
-        'meta': meta,
-    }
+    body, etag = render_directory(settings.acme.terms_of_service_url)
+    if etag_matches(request.headers.get('If-None-Match', ''), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return Response(content=body, media_type='application/json', headers={'ETag': etag})
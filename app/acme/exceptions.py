@@ -1,11 +1,13 @@
 from typing import Literal
 
-from config import settings
 from fastapi import status
 from fastapi.responses import JSONResponse
 
+from .urls import INDEX_LINK
+
 AcmeExceptionTypes = Literal[
     'accountDoesNotExist',
+    'alreadyReplaced',
     'alreadyRevoked',
     'badCSR',
     'badNonce',
@@ -46,8 +48,9 @@ class ACMEException(Exception):
         detail: str = '',
         status_code: int = status.HTTP_400_BAD_REQUEST,
         new_nonce: str | None = None,
+        headers: dict[str, str] | None = None,
     ) -> None:
-        self.headers = {'Link': f'<{settings.external_url}acme/directory>;rel="index"'}
+        self.headers = {'Link': INDEX_LINK, **(headers or {})}
         # when a new nonce is already created it should also be used in the exception case
         # however if there is none yet, a new one gets generated in as_response()
         self.new_nonce = new_nonce
@@ -62,14 +65,16 @@ class ACMEException(Exception):
         return {'type': 'urn:ietf:params:acme:error:' + self.exc_type, 'detail': self.detail}
 
     async def as_response(self):
-        if not self.new_nonce:
+        # rate limited or shed requests (with Retry-After) are rejected without database access,
+        # so they get no new nonce (it is only recommended by RFC 8555)
+        if not self.new_nonce and 'Retry-After' not in self.headers:
             from .nonce.service import generate as generate_nonce  # import here to prevent circular import  # pylint: disable=import-outside-toplevel
 
             self.new_nonce = await generate_nonce()
         return JSONResponse(
             status_code=self.status_code,
             content=self.value,
-            headers=dict(self.headers, **{'Replay-Nonce': self.new_nonce}),
+            headers=dict(self.headers, **{'Replay-Nonce': self.new_nonce}) if self.new_nonce else self.headers,
             media_type='application/problem+json',
         )
 
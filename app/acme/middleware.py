@@ -1,16 +1,22 @@
-import json
-from typing import Generic, Literal, TypeVar
+import binascii
+import time
+from typing import Any, Generic, Literal, TypeVar, get_args
 
 import db
+import jwcrypto.jwa
 import jwcrypto.jwk
-import jwcrypto.jws
+import metrics
+import timing
 from config import settings
+from cryptography.exceptions import InvalidSignature
 from fastapi import Body, Header, Request, Response, status
-from jwcrypto.common import base64url_decode
-from pydantic import AnyHttpUrl, BaseModel, ConfigDict, constr, model_validator
+from jwcrypto.common import JWException, base64url_decode
+from pydantic import AnyHttpUrl, BaseModel, ConfigDict, TypeAdapter, constr, model_validator
 
 from .exceptions import ACMEException
 from .nonce import service as nonce_service
+from .ratelimit import service as ratelimit_service
+from .urls import ACCOUNTS_URL, INDEX_LINK
 
 
 class RsaJwk(BaseModel):
@@ -38,13 +44,27 @@ class RequestData(BaseModel, Generic[PayloadT]):
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
 
+JwsAlgorithm = Literal['RS256', 'RS384', 'RS512', 'ES256', 'ES384', 'ES512']
+
+# the signature check of each algorithm, the JWS is verified with them directly to not decode and parse it again in jwcrypto
+_SIGNING_ALGS = {alg: jwcrypto.jwa.JWA.signing_alg(alg) for alg in get_args(JwsAlgorithm)}
+
+
+class FlattenedJws(BaseModel):
+    # see https://www.rfc-editor.org/rfc/rfc8555#section-6.2
+    protected: constr(min_length=1)  # type: ignore[valid-type]
+    payload: constr(min_length=0)  # type: ignore[valid-type]
+    signature: constr(min_length=1)  # type: ignore[valid-type]
+
+
 class Protected(BaseModel):
     # see https://www.rfc-editor.org/rfc/rfc8555#section-6.2
-    alg: Literal['RS256', 'RS384', 'RS512', 'ES256', 'ES384', 'ES512']
+    alg: JwsAlgorithm
     jwk: RsaJwk | EcJwk | None = None  # new user
     kid: str | None = None  # existing user
     nonce: constr(min_length=1)  # type: ignore[valid-type]
     url: AnyHttpUrl
+    crit: list[str] | None = None
 
     @model_validator(mode='after')
     def valid_check(self) -> 'Protected':
@@ -52,9 +72,18 @@ class Protected(BaseModel):
             raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='malformed', detail='either jwk or kid must be set')
         if self.jwk and self.kid:
             raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='malformed', detail='the fields jwk and kid are mutually exclusive')
+        if self.crit:  # ACME defines no header extensions, unknown critical ones must be rejected (RFC 7515 section 4.1.11)
+            raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='malformed', detail='unsupported critical header parameters')
         return self
 
 
+def _decode(value: str, part: str) -> bytes:
+    try:
+        return base64url_decode(value)
+    except (binascii.Error, ValueError) as exc:
+        raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='malformed', detail=f'JWS invalid: {part} is not base64url encoded') from exc
+
+
 class SignedRequest:  # pylint: disable=too-few-public-methods
     def __init__(
         self,
@@ -66,6 +95,9 @@ class SignedRequest:  # pylint: disable=too-few-public-methods
         self.allow_new_account = allow_new_account
         self.allow_blocked_account = allow_blocked_account
         self.payload_model = payload_model
+        # built once per route instead of on every request
+        self.payload_adapter: TypeAdapter[Any] | None = TypeAdapter(payload_model) if payload_model else None
+        self.request_data_type = RequestData[payload_model]  # type: ignore[valid-type]
 
     @staticmethod
     def _schemeless_url(url: str):
@@ -75,35 +107,35 @@ class SignedRequest:  # pylint: disable=too-few-public-methods
             return url.removeprefix('http://')
         return url
 
+    async def _load_account_key(self, account_id: str) -> dict | None:
+        if not account_id:
+            return None
+        async with db.transaction(readonly=True) as sql:
+            if self.allow_blocked_account:
+                return await sql.value("""select jwk from accounts where id = $1""", account_id)
+            else:
+                return await sql.value("""select jwk from accounts where id = $1 and status = 'valid'""", account_id)
+
     async def __call__(  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
         self,
         request: Request,
         response: Response,
         content_type: str = Header(..., pattern=r'^application/jose\+json$', description='Content Type must be "application/jose+json"'),
-        protected: constr(min_length=1) = Body(...),  # type: ignore[valid-type]
-        signature: constr(min_length=1) = Body(...),  # type: ignore[valid-type]
-        payload: constr(min_length=0) = Body(...),  # type: ignore[valid-type]
+        jws: FlattenedJws = Body(...),
     ):
-        protected_data = Protected(**json.loads(base64url_decode(protected)))
+        protected_data = Protected.model_validate_json(_decode(jws.protected, 'protected header'))
 
         # Scheme might be different because of reverse proxy forwarding
         if self._schemeless_url(str(protected_data.url)) != self._schemeless_url(str(request.url)):
             raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='unauthorized', detail='Requested URL does not match with actually called URL')
 
         if protected_data.kid:  # account exists
-            base_url = f'{settings.external_url}acme/accounts/'
-            if not protected_data.kid.startswith(base_url):
-                raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='malformed', detail=f'JWS invalid: kid must start with: "{base_url}"')
+            if not protected_data.kid.startswith(ACCOUNTS_URL):
+                raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='malformed', detail=f'JWS invalid: kid must start with: "{ACCOUNTS_URL}"')
 
             account_id = protected_data.kid.split('/')[-1]
-            if account_id:
-                async with db.transaction(readonly=True) as sql:
-                    if self.allow_blocked_account:
-                        key_data = await sql.value("""select jwk from accounts where id = $1""", account_id)
-                    else:
-                        key_data = await sql.value("""select jwk from accounts where id = $1 and status = 'valid'""", account_id)
-            else:
-                key_data = None
+            with timing.measure('account'):
+                key_data = await self._load_account_key(account_id)
             if not key_data:
                 raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='accountDoesNotExist', detail='unknown, deactivated or revoked account')
             key = jwcrypto.jwk.JWK()
@@ -117,24 +149,31 @@ class SignedRequest:  # pylint: disable=too-few-public-methods
         else:
             raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='accountDoesNotExist', detail='unknown account. not accepting new accounts')
 
-        jws = jwcrypto.jws.JWS()
-        if 'none' in jws.allowed_algs:
-            raise ValueError('"none" is a forbidden JWS algorithm!')
+        signature = _decode(jws.signature, 'signature')
+        verification_started_at = time.perf_counter()
         try:
-            # signature is checked here
-            jws.deserialize(await request.body(), key)
-        except jwcrypto.jws.InvalidJWSSignature as exc:
+            # signature is checked here, the signing input are the encoded header and payload as sent ("none" is not an allowed alg)
+            _SIGNING_ALGS[protected_data.alg].verify(key, f'{jws.protected}.{jws.payload}'.encode(), signature)
+        except (InvalidSignature, JWException, TypeError, ValueError) as exc:  # TypeError: key type does not match alg
             raise ACMEException(status_code=status.HTTP_403_FORBIDDEN, exctype='unauthorized', detail='signature check failed') from exc
+        finally:
+            verification_duration = time.perf_counter() - verification_started_at
+            metrics.jws_verification_duration.observe(verification_duration)
+            timing.record('jws', verification_duration)
+
+        if account_id:  # only after the signature check, an unverified kid must not drain the bucket of someone else's account
+            await ratelimit_service.consume('account', account_id, settings.ratelimit.per_account)
 
-        if self.payload_model and payload:
-            payload_data = self.payload_model(**json.loads(base64url_decode(payload)))  # type: ignore[operator]
+        if self.payload_adapter and jws.payload:
+            payload_data = self.payload_adapter.validate_json(_decode(jws.payload, 'payload'))
         else:
             payload_data = None
 
-        new_nonce = await nonce_service.refresh(protected_data.nonce)
+        with timing.measure('nonce'):
+            new_nonce = await nonce_service.refresh(protected_data.nonce)
 
         response.headers['Replay-Nonce'] = new_nonce
         # use append because there can be multiple Link-Headers with different rel targets
-        response.headers.append('Link', f'<{settings.external_url}acme/directory>;rel="index"')
+        response.headers.append('Link', INDEX_LINK)
 
-        return RequestData[self.payload_model](payload=payload_data, key=key, account_id=account_id, new_nonce=new_nonce)  # type: ignore[name-defined]
+        return self.request_data_type(payload=payload_data, key=key, account_id=account_id, new_nonce=new_nonce)
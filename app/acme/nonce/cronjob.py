@@ -1,8 +1,11 @@
 import asyncio
 
 import db
+from config import settings
 from logger import logger
 
+from . import service
+
 
 async def start():
     async def run():
@@ -16,3 +19,24 @@ async def start():
                 await asyncio.sleep(1 * 60 * 60)
 
     asyncio.create_task(run())
+
+
+async def start_reservoir():
+    async def fill_reservoir():
+        while True:
+            service.refill_needed.clear()
+            try:
+                await service.refill()
+            except Exception:
+                logger.error('could not refill the nonce reservoir', exc_info=True)
+                await asyncio.sleep(5)  # requests fall back to storing single nonces meanwhile
+            try:  # refill early when running low, otherwise replace the nonces which got too old to be handed out
+                await asyncio.wait_for(service.refill_needed.wait(), timeout=service.RESERVOIR_MAX_AGE / 2)
+            except asyncio.TimeoutError:
+                pass
+            except Exception:
+                logger.error('could not wait for the nonce reservoir to run low', exc_info=True)
+                await asyncio.sleep(5)
+
+    if settings.acme.nonce_reservoir_size:
+        asyncio.create_task(fill_reservoir())
@@ -1,6 +1,6 @@
-from config import settings
 from fastapi import APIRouter, Response, status
 
+from ..urls import INDEX_LINK
 from .service import generate
 
 api = APIRouter(tags=['acme:nonce'])
@@ -14,4 +14,4 @@ async def get_nonce(response: Response):
     """
     response.headers['Replay-Nonce'] = await generate()
     response.headers['Cache-Control'] = 'no-store'
-    response.headers['Link'] = f'<{settings.external_url}acme/directory>;rel="index"'
+    response.headers['Link'] = INDEX_LINK
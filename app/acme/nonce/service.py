@@ -1,23 +1,75 @@
+import asyncio
 import secrets
+import time
+from collections import deque
 
 import db
+import metrics
+from config import settings
 from fastapi import status
+from logger import logger
 
 from ..exceptions import ACMEException
 
+# a reserved nonce is valid for 30 minutes since it was minted, so it is handed out for at most 5 minutes to be still valid for at least 25 minutes
+RESERVOIR_MAX_AGE = 5 * 60
 
-async def generate() -> str:
-    nonce = secrets.token_urlsafe(32)
+_reservoir: deque[tuple[str, float]] = deque()  # (nonce, minted at) of nonces which are already stored, oldest first
+refill_needed = asyncio.Event()  # set when the reservoir runs low
+
+metrics.nonce_reservoir_size.set_function(lambda: len(_reservoir))
+
+
+def _take() -> str | None:
+    """a stored nonce from the reservoir (no database roundtrip), None if it is empty or disabled"""
+    while _reservoir:
+        nonce, minted_at = _reservoir.popleft()
+        if time.monotonic() - minted_at < RESERVOIR_MAX_AGE:
+            if len(_reservoir) < settings.acme.nonce_reservoir_size // 2:
+                refill_needed.set()
+            return nonce
+    if settings.acme.nonce_reservoir_size:
+        refill_needed.set()
+    return None
+
+
+async def refill() -> int:
+    """mint nonces until the reservoir is full, they are stored with a single insert. Returns the number of minted nonces."""
+    while _reservoir and time.monotonic() - _reservoir[0][1] >= RESERVOIR_MAX_AGE:
+        _reservoir.popleft()  # it expires in the database on its own
+    count = settings.acme.nonce_reservoir_size - len(_reservoir)
+    if count <= 0:
+        return 0
+    nonces = [secrets.token_urlsafe(32) for _ in range(count)]
+    minted_at = time.monotonic()
     async with db.transaction() as sql:
-        await sql.exec("""insert into nonces (id) values ($1)""", nonce)
+        await sql.exec("""insert into nonces (id) select unnest($1::text[])""", nonces)
+    _reservoir.extend((nonce, minted_at) for nonce in nonces)
+    metrics.nonce_reservoir_refilled.inc(count)
+    return count
+
+
+async def generate() -> str:
+    nonce = _take()
+    if nonce is None:
+        nonce = secrets.token_urlsafe(32)
+        async with db.transaction() as sql:
+            await sql.exec("""insert into nonces (id) values ($1)""", nonce)
+    metrics.nonces.labels('issued').inc()
     return nonce
 
 
 async def refresh(nonce: str) -> str:
-    new_nonce = secrets.token_urlsafe(32)
+    new_nonce = _take()
     async with db.transaction() as sql:
         old_nonce_ok = await sql.exec("""delete from nonces where id = $1""", nonce) == 'DELETE 1'
-        await sql.exec("""insert into nonces (id) values ($1)""", new_nonce)
+        if new_nonce is None:
+            new_nonce = secrets.token_urlsafe(32)
+            await sql.exec("""insert into nonces (id) values ($1)""", new_nonce)
+    metrics.nonces.labels('issued').inc()
     if not old_nonce_ok:
+        metrics.nonces.labels('rejected').inc()
+        logger.info('rejected a nonce which is unknown, used or expired', extra={'category': 'nonce_rejected'})
         raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='badNonce', detail='old nonce is wrong', new_nonce=new_nonce)
+    metrics.nonces.labels('consumed').inc()
     return new_nonce
@@ -0,0 +1,30 @@
+import asyncio
+
+from config import settings
+from logger import logger
+
+from . import service
+
+
+async def start():
+    async def run():
+        while True:
+            try:
+                expired = await service.expire_orders(batch_size=settings.retention.batch_size)
+                if expired:
+                    logger.info('Marked %s expired orders as invalid', expired)
+                if settings.retention.enabled:
+                    purged = await service.purge_orders(
+                        older_than=settings.retention.period,
+                        batch_size=settings.retention.batch_size,
+                        archive=settings.retention.archive,
+                        archive_dir=settings.retention.archive_dir,
+                    )
+                    if purged:
+                        logger.info('Purged %s orders older than %s', purged, settings.retention.period)
+            except Exception:
+                logger.error('could not clean up old orders', exc_info=True)
+            finally:
+                await asyncio.sleep(1 * 60 * 60)
+
+    asyncio.create_task(run())
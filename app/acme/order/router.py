@@ -1,9 +1,12 @@
 import asyncio
 import secrets
 from datetime import datetime
-from typing import Annotated, Literal, Optional
+from typing import Annotated, Any, Literal, Optional
 
+import admission
 import db
+import metrics
+import timing
 from ca import service as ca_service
 from config import settings
 from fastapi import APIRouter, Depends, Response, status
@@ -11,9 +14,13 @@ from jwcrypto.common import base64url_decode
 from logger import logger
 from pydantic import BaseModel, conlist, constr
 
-from ..certificate.service import SerialNumberConverter, check_csr
+from ..certificate.service import SerialNumberConverter, cache_chain, check_csr, join_chain, leaf_cert, split_chain, store_issuer
 from ..exceptions import ACMEException
 from ..middleware import RequestData, SignedRequest
+from ..ratelimit import service as ratelimit_service
+from ..renewal_info.service import issued_by, parse_cert_id
+from ..singleflight import SingleFlight
+from ..urls import AUTHORIZATIONS_URL, CERTIFICATES_URL, ORDERS_URL
 
 
 class NewOrderDomain(BaseModel):
@@ -25,6 +32,7 @@ class NewOrderPayload(BaseModel):
     identifiers: conlist(NewOrderDomain, min_length=1)  # type: ignore[valid-type]
     notBefore: Optional[datetime] = None
     notAfter: Optional[datetime] = None
+    replaces: Optional[str] = None  # ARI certificate identifier, see RFC 9773 section 5
 
 
 class FinalizeOrderPayload(BaseModel):
@@ -42,25 +50,50 @@ def order_response(
     not_valid_before: Optional[datetime] = None,
     not_valid_after: Optional[datetime] = None,
     cert_serial_number: Optional[str] = None,
-):
+) -> dict[str, Any]:
     return {
         'status': status,
         'expires': expires_at,
         'identifiers': [{'type': 'dns', 'value': domain} for domain in domains],
-        'authorizations': [f'{settings.external_url}acme/authorizations/{authz_id}' for authz_id in authz_ids],
-        'finalize': f'{settings.external_url}acme/orders/{order_id}/finalize',
+        'authorizations': [AUTHORIZATIONS_URL + authz_id for authz_id in authz_ids],
+        'finalize': f'{ORDERS_URL}{order_id}/finalize',
         'error': error.value if error else None,
         'notBefore': not_valid_before,
         'notAfter': not_valid_after,
-        'certificate': f'{settings.external_url}acme/certificates/{cert_serial_number}' if cert_serial_number else None,
+        'certificate': CERTIFICATES_URL + cert_serial_number if cert_serial_number else None,
     }
 
 
+async def check_replaced_cert(  # pylint: disable=too-many-arguments
+    sql: db.transaction, *, aki: bytes, serial_number: str, account_id: Optional[str], domains: list[str], new_nonce: Optional[str]
+):
+    """the replaced certificate must belong to the account, share an identifier with the new order and must not be replaced already"""
+    record = await sql.record(
+        """
+        select c.cert_der, c.chain_pem from certificates c
+        join orders ord on ord.id = c.order_id
+        where c.serial_number = $1 and ord.account_id = $2
+            and exists (select from authorizations authz where authz.order_id = ord.id and authz.domain = any($3::text[]))
+        """,
+        serial_number,
+        account_id,
+        domains,
+    )
+    if not record or not issued_by(leaf_cert(record), aki):
+        raise ACMEException(exctype='malformed', detail='The replaced certificate is unknown or has no identifier in common with this order.', new_nonce=new_nonce)
+    already_replaced = await sql.value(
+        """select exists (select from orders where replaces = $1 and status in ('processing', 'valid'))""",
+        serial_number,
+    )
+    if already_replaced:
+        raise ACMEException(status_code=status.HTTP_409_CONFLICT, exctype='alreadyReplaced', detail='The certificate has already been replaced.', new_nonce=new_nonce)
+
+
 api = APIRouter(tags=['acme:order'])
 
 
 @api.post('/new-order', status_code=status.HTTP_201_CREATED)
-async def submit_order(response: Response, data: Annotated[RequestData[NewOrderPayload], Depends(SignedRequest(NewOrderPayload))]):
+async def submit_order(response: Response, data: Annotated[RequestData[NewOrderPayload], Depends(SignedRequest(NewOrderPayload))]) -> dict[str, Any]:
     if data.payload.notBefore is not None or data.payload.notAfter is not None:
         raise ACMEException(
             exctype='malformed',
@@ -69,6 +102,15 @@ async def submit_order(response: Response, data: Annotated[RequestData[NewOrderP
         )
 
     domains: list[str] = list({identifier.value for identifier in data.payload.identifiers})  # deduplicate domains
+    for registered_domain in {ratelimit_service.registered_domain(domain) for domain in domains}:
+        await ratelimit_service.consume('domain', registered_domain, settings.ratelimit.per_domain, data.new_nonce)
+
+    replaces: Optional[str] = None
+    if data.payload.replaces is not None:
+        try:
+            replaces_aki, replaces = parse_cert_id(data.payload.replaces)
+        except ValueError as exc:
+            raise ACMEException(exctype='malformed', detail=f'Parameter replaces is invalid: {exc}', new_nonce=data.new_nonce) from exc
 
     def generate_tokens_sync(domains):
         order_id = secrets.token_urlsafe(16)
@@ -80,10 +122,13 @@ async def submit_order(response: Response, data: Annotated[RequestData[NewOrderP
     order_id, authz_ids, chal_ids, chal_tkns = await asyncio.to_thread(generate_tokens_sync, domains)
 
     async with db.transaction() as sql:
+        if replaces is not None:
+            await check_replaced_cert(sql, aki=replaces_aki, serial_number=replaces, account_id=data.account_id, domains=domains, new_nonce=data.new_nonce)
         order_status, expires_at = await sql.record(
-            """insert into orders (id, account_id) values ($1, $2) returning status, expires_at""",
+            """insert into orders (id, account_id, replaces) values ($1, $2, $3) returning status, expires_at""",
             order_id,
             data.account_id,
+            replaces,
         )
         await sql.execmany(
             """insert into authorizations (id, order_id, domain) values ($1, $2, $3)""",
@@ -94,7 +139,7 @@ async def submit_order(response: Response, data: Annotated[RequestData[NewOrderP
             *[(chal_ids[domain], authz_ids[domain], chal_tkns[domain]) for domain in domains],
         )
 
-    response.headers['Location'] = f'{settings.external_url}acme/orders/{order_id}'
+    response.headers['Location'] = ORDERS_URL + order_id
     return order_response(
         status=order_status,
         expires_at=expires_at,
@@ -105,7 +150,7 @@ async def submit_order(response: Response, data: Annotated[RequestData[NewOrderP
 
 
 @api.post('/orders/{order_id}')
-async def view_order(response: Response, order_id: str, data: Annotated[RequestData, Depends(SignedRequest())]):
+async def view_order(response: Response, order_id: str, data: Annotated[RequestData, Depends(SignedRequest())]) -> dict[str, Any]:
     async with db.transaction(readonly=True) as sql:
         record = await sql.record(
             """select status, expires_at, error from orders where id = $1 and account_id = $2""",
@@ -124,7 +169,7 @@ async def view_order(response: Response, order_id: str, data: Annotated[RequestD
     else:
         acme_error = None
 
-    response.headers['Location'] = f'{settings.external_url}acme/orders/{order_id}'  # see #139
+    response.headers['Location'] = ORDERS_URL + order_id  # see #139
     return order_response(
         status=order_status,
         expires_at=expires_at,
@@ -138,8 +183,7 @@ async def view_order(response: Response, order_id: str, data: Annotated[RequestD
     )
 
 
-@api.post('/orders/{order_id}/finalize')
-async def finalize_order(response: Response, order_id: str, data: Annotated[RequestData[FinalizeOrderPayload], Depends(SignedRequest(FinalizeOrderPayload))]):
+async def finalize(order_id: str, data: RequestData[FinalizeOrderPayload]) -> dict[str, Any]:
     async with db.transaction(readonly=True) as sql:
         record = await sql.record(
             """
@@ -165,9 +209,11 @@ async def finalize_order(response: Response, order_id: str, data: Annotated[Requ
             )
             await sql.exec("""update authorizations set status='expired' where order_id = $1""", order_id)
         raise ACMEException(status_code=status.HTTP_403_FORBIDDEN, exctype='orderNotReady', detail='order expired', new_nonce=data.new_nonce)
-    else:
-        async with db.transaction() as sql:
-            await sql.exec("""update orders set status='processing' where id = $1 and status = 'ready'""", order_id)
+    async with db.transaction() as sql:
+        # only one request (of all processes) may sign the csr, concurrent requests of other processes fail here
+        processing = await sql.value("""update orders set status='processing' where id = $1 and status = 'ready' returning true""", order_id)
+    if not processing:
+        raise ACMEException(status_code=status.HTTP_403_FORBIDDEN, exctype='orderNotReady', detail='order is already being finalized', new_nonce=data.new_nonce)
 
     async with db.transaction(readonly=True) as sql:
         records = [(authz_id, domain) async for authz_id, domain, *_ in sql("""select id, domain from authorizations where order_id = $1 and status = 'valid'""", order_id)]
@@ -176,13 +222,20 @@ async def finalize_order(response: Response, order_id: str, data: Annotated[Requ
 
     csr_bytes = base64url_decode(data.payload.csr)
 
-    csr, csr_pem, subject_domain, san_domains = await check_csr(csr_bytes, ordered_domains=domains, new_nonce=data.new_nonce)
+    with timing.measure('csr'):
+        csr, subject_domain, san_domains = await check_csr(csr_bytes, ordered_domains=domains, new_nonce=data.new_nonce)
 
     err: None | ACMEException
 
     try:
-        signed_cert = await ca_service.sign_csr(csr, subject_domain, san_domains)
+        async with admission.signing.slot():
+            with metrics.ca_sign_csr_duration.time(), timing.measure('sign'):
+                signed_cert = await ca_service.sign_csr(csr, subject_domain, san_domains)
         err = None
+    except admission.Overloaded:
+        async with db.transaction() as sql:  # the csr was not signed, so the order can be finalized again
+            await sql.exec("""update orders set status='ready' where id = $1 and status = 'processing'""", order_id)
+        raise
     except ACMEException as e:
         err = e
     except Exception as e:
@@ -191,16 +244,19 @@ async def finalize_order(response: Response, order_id: str, data: Annotated[Requ
 
     if err is None:
         cert_sn = SerialNumberConverter.int2hex(signed_cert.cert.serial_number)
+        cert_der, issuer_sn, issuer_chain_pem = await asyncio.to_thread(split_chain, signed_cert.cert_chain_pem)
 
+        await store_issuer(issuer_sn, issuer_chain_pem)
         async with db.transaction() as sql:
             not_valid_before, not_valid_after = await sql.record(
                 """
-                insert into certificates (serial_number, csr_pem, chain_pem, order_id, not_valid_before, not_valid_after)
-                values ($1, $2, $3, $4, $5, $6) returning not_valid_before, not_valid_after
+                insert into certificates (serial_number, cert_der, issuer_serial_number, csr_der, order_id, not_valid_before, not_valid_after)
+                values ($1, $2, $3, $4, $5, $6, $7) returning not_valid_before, not_valid_after
                 """,
                 cert_sn,
-                csr_pem,
-                signed_cert.cert_chain_pem,
+                cert_der,
+                issuer_sn,
+                csr_bytes,
                 order_id,
                 signed_cert.cert.not_valid_before_utc,
                 signed_cert.cert.not_valid_after_utc,
@@ -209,6 +265,7 @@ async def finalize_order(response: Response, order_id: str, data: Annotated[Requ
                 """update orders set status='valid' where id = $1 and status='processing' returning status""",
                 order_id,
             )
+        cache_chain(cert_sn, data.account_id, join_chain(cert_der, issuer_chain_pem))
     else:
         cert_sn = not_valid_before = not_valid_after = None
         async with db.transaction() as sql:
@@ -219,7 +276,6 @@ async def finalize_order(response: Response, order_id: str, data: Annotated[Requ
                 err.detail,
             )
 
-    response.headers['Location'] = f'{settings.external_url}acme/orders/{order_id}'  # see #139
     return order_response(
         status=order_status,
         expires_at=expires_at,
@@ -231,3 +287,14 @@ async def finalize_order(response: Response, order_id: str, data: Annotated[Requ
         cert_serial_number=cert_sn,
         error=err,
     )
+
+
+# retries of an impatient client share the running finalization instead of getting the order rejected as not ready
+finalizations: SingleFlight[dict[str, Any]] = SingleFlight('finalize')
+
+
+@api.post('/orders/{order_id}/finalize')
+async def finalize_order(response: Response, order_id: str, data: Annotated[RequestData[FinalizeOrderPayload], Depends(SignedRequest(FinalizeOrderPayload))]) -> dict[str, Any]:
+    result = await finalizations.run((data.account_id, order_id, data.payload.csr), lambda: finalize(order_id, data), new_nonce=data.new_nonce)
+    response.headers['Location'] = ORDERS_URL + order_id  # see #139
+    return result
@@ -0,0 +1,114 @@
+import asyncio
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Literal
+
+import db
+
+
+async def expire_orders(*, batch_size: int) -> int:
+    """
+    move pending and ready orders whose lifetime is over into their terminal state, returns the number of expired orders
+    """
+    total = 0
+    while True:
+        async with db.transaction() as sql:
+            count = await sql.value(
+                """
+                with
+                    expired_orders as (
+                        update orders set status='invalid', error=row('unauthorized','order expired')
+                        where id in (
+                            select id from orders
+                            where status in ('pending', 'ready') and expires_at < now()
+                            limit $1 for update skip locked
+                        )
+                        returning id
+                    ),
+                    expired_authzs as (
+                        update authorizations set status='expired'
+                        where order_id in (select id from expired_orders) and status in ('pending', 'valid')
+                        returning id
+                    ),
+                    invalid_challenges as (
+                        update challenges set status='invalid', error=row('unauthorized','order expired')
+                        where authz_id in (select id from expired_authzs) and status in ('pending', 'processing')
+                    )
+                select count(*) from expired_orders
+                """,
+                batch_size,
+            )
+        total += count
+        if count < batch_size:
+            return total
+
+
+async def purge_orders(*, older_than: timedelta, batch_size: int, archive: Literal['none', 'file', 'table'], archive_dir: Path) -> int:
+    """
+    delete orders (including their authorizations and challenges) which expired before `older_than` and never got a certificate.
+    orders with a certificate are kept, so certificates stay linked to their domains and accounts.
+    returns the number of purged orders
+    """
+    archive_file = archive_dir / f'orders-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.ndjson.gz'
+    total = 0
+    while True:
+        async with db.transaction() as sql:
+            docs = await sql.value(
+                """
+                with
+                    purged_orders as (
+                        delete from orders where id in (
+                            select id from orders ord
+                            where ord.expires_at < now() - $1::interval
+                                and not exists (select from certificates cert where cert.order_id = ord.id)
+                            limit $2 for update skip locked
+                        )
+                        returning *
+                    ),
+                    purged_authzs as (
+                        delete from authorizations where order_id in (select id from purged_orders) returning *
+                    ),
+                    purged_chals as (
+                        delete from challenges where authz_id in (select id from purged_authzs) returning *
+                    ),
+                    docs as (
+                        select ord.id, ord.account_id, jsonb_build_object(
+                            'id', ord.id,
+                            'account_id', ord.account_id,
+                            'status', ord.status,
+                            'error', to_jsonb(ord.error),
+                            'expires_at', ord.expires_at,
+                            'authorizations', coalesce((
+                                select jsonb_agg(jsonb_build_object(
+                                    'id', authz.id, 'domain', authz.domain, 'status', authz.status,
+                                    'challenge', (select to_jsonb(chal) - 'authz_id' from purged_chals chal where chal.authz_id = authz.id)
+                                ))
+                                from purged_authzs authz where authz.order_id = ord.id
+                            ), '[]'::jsonb)
+                        ) as data
+                        from purged_orders ord
+                    ),
+                    archived as (
+                        insert into archived_orders (id, account_id, data) select id, account_id, data from docs where $3
+                    )
+                select coalesce(jsonb_agg(data), '[]'::jsonb) from docs
+                """,
+                older_than,
+                batch_size,
+                archive == 'table',
+            )
+            if docs and archive == 'file':
+                # written before commit, so nothing gets deleted if the archive cannot be written
+                await asyncio.to_thread(_append_archive_sync, archive_file, docs)
+        total += len(docs)
+        if len(docs) < batch_size:
+            return total
+
+
+def _append_archive_sync(archive_file: Path, docs: list[dict]):
+    archive_file.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(archive_file, 'at', encoding='utf-8') as f:
+        for doc in docs:
+            f.write(json.dumps(doc) + '\n')
@@ -0,0 +1,28 @@
+import asyncio
+
+import db
+from config import settings
+from logger import logger
+
+from . import service
+
+
+async def start():
+    async def run():
+        while True:
+            try:
+                if settings.ratelimit.backend == 'postgres':
+                    limits = (settings.ratelimit.per_ip, settings.ratelimit.per_account, settings.ratelimit.per_domain)
+                    longest_period = max((limit.period for limit in limits if limit), default=None)
+                    if longest_period:
+                        async with db.transaction() as sql:
+                            # every bucket is refilled completely after its period
+                            await sql.exec("""delete from rate_limits where updated_at < now() - $1::interval""", longest_period)
+                else:
+                    service.purge_full_buckets()
+            except Exception:
+                logger.error('could not purge rate limit buckets', exc_info=True)
+            finally:
+                await asyncio.sleep(5 * 60)
+
+    asyncio.create_task(run())
@@ -0,0 +1,100 @@
+import math
+import time
+from typing import Literal
+
+import db
+import metrics
+from config import RateLimit, settings
+from fastapi import Request, status
+
+from ..exceptions import ACMEException
+
+Scope = Literal['ip', 'account', 'domain']
+
+# token buckets of the memory backend: key -> (tokens, last update as monotonic time)
+_buckets: dict[str, tuple[float, float]] = {}
+
+
+def _consume_memory(key: str, limit: RateLimit) -> float:
+    """takes one token from the bucket, returns 0 if allowed, else the seconds until the next token is available"""
+    rate = limit.requests / limit.period.total_seconds()
+    now = time.monotonic()
+    tokens, updated_at = _buckets.get(key, (limit.requests, now))
+    tokens = min(limit.requests, tokens + (now - updated_at) * rate)
+    if tokens >= 1:
+        _buckets[key] = (tokens - 1, now)
+        return 0
+    _buckets[key] = (tokens, now)
+    return (1 - tokens) / rate
+
+
+async def _consume_postgres(key: str, limit: RateLimit) -> float:
+    """same as _consume_memory but the buckets are shared by all replicas"""
+    rate = limit.requests / limit.period.total_seconds()
+    async with db.transaction() as sql:
+        tokens, allowed = await sql.record(
+            """
+            insert into rate_limits as rl (key, tokens, allowed) values ($1, $2::float8 - 1, true)
+            on conflict (key) do update set
+                tokens = least($2, rl.tokens + extract(epoch from now() - rl.updated_at) * $3)
+                    - case when least($2, rl.tokens + extract(epoch from now() - rl.updated_at) * $3) >= 1 then 1 else 0 end,
+                allowed = least($2, rl.tokens + extract(epoch from now() - rl.updated_at) * $3) >= 1,
+                updated_at = now()
+            returning tokens, allowed
+            """,
+            key,
+            limit.requests,
+            rate,
+        )
+    return 0 if allowed else (1 - tokens) / rate
+
+
+async def consume(scope: Scope, value: str, limit: RateLimit | None, new_nonce: str | None = None) -> None:
+    """raises rateLimited if the token bucket of the scope value is empty"""
+    if limit is None:
+        return
+    key = f'{scope}:{value}'
+    if settings.ratelimit.backend == 'postgres':
+        retry_after = await _consume_postgres(key, limit)
+    else:
+        retry_after = _consume_memory(key, limit)
+    if retry_after:
+        metrics.rate_limited.labels(scope).inc()
+        raise ACMEException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            exctype='rateLimited',
+            detail=f'Too many requests per {scope}, at most {limit.requests} per {limit.period} are allowed',
+            headers={'Retry-After': str(math.ceil(retry_after))},
+            new_nonce=new_nonce,
+        )
+
+
+def registered_domain(domain: str) -> str:
+    """
+    approximation of the public suffix list: the last two labels (host.example.org -> example.org)
+    or three labels below a configured multi-label suffix (host.example.co.uk -> example.co.uk)
+    """
+    labels = domain.lower().rstrip('.').split('.')
+    for suffix_length in range(len(labels) - 1, 1, -1):  # longest matching suffix wins
+        suffix = '.'.join(labels[-suffix_length:])
+        if suffix in settings.ratelimit.public_suffixes:
+            return f'{labels[-suffix_length - 1]}.{suffix}'
+    return '.'.join(labels[-2:])
+
+
+async def limit_ip(request: Request) -> None:
+    """router dependency: runs before the request body is parsed and before any database access"""
+    if request.client:
+        await consume('ip', request.client.host, settings.ratelimit.per_ip)
+
+
+def purge_full_buckets() -> int:
+    """drop buckets of the memory backend which are refilled completely, they are equal to a new bucket"""
+    now = time.monotonic()
+    purged = 0
+    for key, (tokens, updated_at) in list(_buckets.items()):
+        limit = getattr(settings.ratelimit, f'per_{key.partition(":")[0]}')
+        if limit is None or tokens + (now - updated_at) * limit.requests / limit.period.total_seconds() >= limit.requests:
+            del _buckets[key]
+            purged += 1
+    return purged
@@ -0,0 +1,33 @@
+from typing import Any
+
+import db
+from fastapi import APIRouter, Response, status
+
+from ..certificate.service import leaf_cert
+from ..exceptions import ACMEException
+from .service import issued_by, parse_cert_id, suggested_window
+
+api = APIRouter(tags=['acme:renewal-info'])
+
+RETRY_AFTER_SECONDS = 6 * 60 * 60
+
+
+@api.get('/renewal-info/{cert_id}')
+async def get_renewal_info(cert_id: str, response: Response) -> dict[str, Any]:
+    """
+    See RFC 9773 "ACME Renewal Information (ARI) Extension" <https://www.rfc-editor.org/rfc/rfc9773#section-4.2>
+    """
+    try:
+        aki, serial_number = parse_cert_id(cert_id)
+    except ValueError as exc:
+        raise ACMEException(status_code=status.HTTP_400_BAD_REQUEST, exctype='malformed', detail=str(exc)) from exc
+    async with db.transaction(readonly=True) as sql:
+        record = await sql.record("""select cert_der, chain_pem, not_valid_before, not_valid_after, revoked_at from certificates where serial_number = $1""", serial_number)
+    if not record or not issued_by(leaf_cert(record), aki):
+        raise ACMEException(status_code=status.HTTP_404_NOT_FOUND, exctype='malformed', detail='unknown certificate')
+    start, end = suggested_window(
+        serial_number=serial_number, not_valid_before=record['not_valid_before'], not_valid_after=record['not_valid_after'], revoked_at=record['revoked_at']
+    )
+    response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+    response.headers['Cache-Control'] = f'public, max-age={RETRY_AFTER_SECONDS}'
+    return {'suggestedWindow': {'start': start, 'end': end}}
@@ -0,0 +1,55 @@
+import hashlib
+from datetime import datetime, timedelta
+
+from cryptography import x509
+from jwcrypto.common import base64url_decode, base64url_encode
+
+from ..certificate.service import SerialNumberConverter
+
+
+def cert_id(cert: x509.Certificate) -> str:
+    """
+    ARI certificate identifier: base64url encoded authority key identifier and serial number (DER encoded integer content)
+    https://www.rfc-editor.org/rfc/rfc9773#section-4.1
+    """
+    aki = cert.extensions.get_extension_for_class(x509.AuthorityKeyIdentifier).value.key_identifier
+    serial_bytes = cert.serial_number.to_bytes(cert.serial_number.bit_length() // 8 + 1, 'big')  # the leading bit is the sign bit in DER
+    return f'{base64url_encode(aki)}.{base64url_encode(serial_bytes)}'
+
+
+def parse_cert_id(value: str) -> tuple[bytes, str]:
+    """returns the authority key identifier and the hex serial number of an ARI certificate identifier, raises ValueError if malformed"""
+    aki_b64, _, serial_b64 = value.partition('.')
+    if not aki_b64 or not serial_b64 or '=' in value:
+        raise ValueError('certificate identifier must be "<base64url authority key identifier>.<base64url serial number>"')
+    try:
+        aki = base64url_decode(aki_b64)
+        serial_bytes = base64url_decode(serial_b64)
+    except Exception as exc:
+        raise ValueError('certificate identifier is not base64url encoded') from exc
+    if not serial_bytes or serial_bytes[0] & 0x80:
+        raise ValueError('serial number must be positive')
+    return aki, SerialNumberConverter.int2hex(int.from_bytes(serial_bytes, 'big'))
+
+
+def issued_by(cert: x509.Certificate, aki: bytes) -> bool:
+    """whether the certificate names the authority key identifier, the serial number alone is only unique per issuer (e.g. after CA rollover)"""
+    try:
+        return cert.extensions.get_extension_for_class(x509.AuthorityKeyIdentifier).value.key_identifier == aki
+    except x509.ExtensionNotFound:
+        return False
+
+
+def suggested_window(*, serial_number: str, not_valid_before: datetime, not_valid_after: datetime, revoked_at: datetime | None) -> tuple[datetime, datetime]:
+    """
+    the renewal window lies in the second half of the certificate lifetime. Its position is derived from the serial number,
+    so certificates issued at the same time get spread out renewal windows instead of causing a renewal spike.
+    revoked certificates should be renewed immediately, so their window lies in the past
+    """
+    if revoked_at:
+        return revoked_at - timedelta(hours=1), revoked_at
+    half_lifetime = (not_valid_after - not_valid_before) / 2
+    width = half_lifetime / 5  # leaves the last width of the lifetime as buffer for failing renewals
+    position = int.from_bytes(hashlib.sha256(serial_number.encode()).digest()[:8], 'big') / 2**64  # deterministic, uniform in [0, 1)
+    start = not_valid_before + half_lifetime + (half_lifetime - 2 * width) * position
+    return start, start + width
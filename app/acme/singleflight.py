@@ -0,0 +1,39 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Generic, TypeVar
+
+import metrics
+
+from .exceptions import ACMEException
+
+T = TypeVar('T')
+
+
+class SingleFlight(Generic[T]):  # pylint: disable=too-few-public-methods
+    """
+    coalesces concurrent identical requests (same key) within this process: the first request starts the execution,
+    requests arriving while it runs share its result or error instead of executing it again.
+    The execution runs as a task, so it completes even if the request which started it is cancelled (e.g. the client disconnected)
+    """
+
+    def __init__(self, handler: str) -> None:
+        self.handler = handler
+        self._flights: dict[Hashable, asyncio.Task[T]] = {}
+
+    async def run(self, key: Hashable, execute: Callable[[], Awaitable[T]], *, new_nonce: str | None) -> T:
+        if (flight := self._flights.get(key)) is None:
+            flight = asyncio.ensure_future(execute())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda _: self._done(key))
+            return await asyncio.shield(flight)
+
+        metrics.coalesced_requests.labels(self.handler).inc()
+        try:
+            return await asyncio.shield(flight)
+        except ACMEException as exc:  # every request must answer with its own nonce
+            raise ACMEException(exctype=exc.exc_type, detail=exc.detail, status_code=exc.status_code, new_nonce=new_nonce, headers=exc.headers) from exc
+
+    def _done(self, key: Hashable) -> None:
+        flight = self._flights.pop(key)
+        if not flight.cancelled():
+            flight.exception()  # the error was raised to the waiting requests, if there are any left
@@ -0,0 +1,11 @@
+"""URL prefixes of the ACME resources, built once as the external url cannot change at runtime"""
+
+from config import settings
+
+BASE_URL = f'{settings.external_url}acme/'
+INDEX_LINK = f'<{BASE_URL}directory>;rel="index"'
+ACCOUNTS_URL = f'{BASE_URL}accounts/'
+AUTHORIZATIONS_URL = f'{BASE_URL}authorizations/'
+CERTIFICATES_URL = f'{BASE_URL}certificates/'
+CHALLENGES_URL = f'{BASE_URL}challenges/'
+ORDERS_URL = f'{BASE_URL}orders/'
@@ -0,0 +1,128 @@
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+import metrics
+from config import settings
+
+# stages the current request (or task) was already admitted to: it waits without budget there, so only new work is shed,
+# never a request which already changed state (e.g. a signed certificate which could not be stored)
+_admitted: ContextVar[frozenset[str]] = ContextVar('admitted', default=frozenset())
+
+
+class Overloaded(Exception):
+    """a stage could not be entered within the wait budget, the request should be retried later"""
+
+    def __init__(self, stage: str, retry_after: int) -> None:
+        self.stage = stage
+        self.retry_after = retry_after
+        super().__init__(f'Server is overloaded ({stage}), retry in {retry_after}s')
+
+
+class AdaptiveLimiter:  # pylint: disable=too-many-instance-attributes
+    """
+    limits the concurrency of an expensive stage: requests wait at most the wait budget for a free slot, otherwise Overloaded is raised.
+    If adaptive, the limit follows the latency of the stage (AIMD): it shrinks by 10% (at most once per latency period) when the latency
+    exceeds the tolerated multiple of the baseline (the lowest recent latency) and grows again while the stage is saturated at normal latency.
+    """
+
+    def __init__(self, stage: str, *, max_limit: int, wait_budget: float, adaptive: bool, tolerance: float, enabled: bool = True) -> None:  # pylint: disable=too-many-arguments
+        self.stage = stage
+        self.enabled = enabled
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.wait_budget = wait_budget
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._baseline = math.inf  # lowest latency of the previous and the current window
+        self._window_min = math.inf
+        self._window_samples = 0
+        self._decreased_at = 0.0
+        metrics.admission_limit.labels(stage).set_function(lambda: self.limit)
+        metrics.admission_in_flight.labels(stage).set_function(lambda: self.in_flight)
+
+    async def acquire(self) -> None:
+        if not self.enabled:
+            return
+        admitted = _admitted.get()
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            _admitted.set(admitted | {self.stage})
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started_at = time.perf_counter()
+        acquired = False
+        try:
+            # the slot is handed over by release()
+            await asyncio.wait_for(waiter, None if self.stage in admitted else self.wait_budget)
+            acquired = True
+        except asyncio.TimeoutError as exc:
+            metrics.admission_rejected.labels(self.stage).inc()
+            raise Overloaded(self.stage, retry_after=max(1, math.ceil(self.wait_budget))) from exc
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif not acquired and waiter.done() and not waiter.cancelled():
+                self.release(None)  # the slot was handed over just when the wait ended (timeout, cancellation), pass it on
+            metrics.admission_wait_duration.labels(self.stage).observe(time.perf_counter() - started_at)
+        _admitted.set(admitted | {self.stage})
+
+    def release(self, latency: float | None) -> None:
+        """frees the slot, the latency (seconds) of the stage adapts the limit unless it is None (e.g. the stage failed early)"""
+        if not self.enabled:
+            return
+        self.in_flight -= 1
+        if self.adaptive and latency is not None:
+            self._adapt(latency)
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _adapt(self, latency: float) -> None:
+        self._window_min = min(self._window_min, latency)
+        self._window_samples += 1
+        if self._window_samples >= 100:  # forget old baselines, e.g. after the database got slower permanently
+            self._baseline, self._window_min, self._window_samples = self._window_min, math.inf, 0
+        baseline = min(self._baseline, self._window_min)
+
+        now = time.monotonic()
+        if latency > baseline * self.tolerance:
+            if now - self._decreased_at > latency:
+                self.limit = max(1.0, self.limit * 0.9)
+                self._decreased_at = now
+        elif self.in_flight + 1 >= int(self.limit):
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started_at)
+
+
+def _limiter(stage: str, max_limit: int) -> AdaptiveLimiter:
+    return AdaptiveLimiter(
+        stage,
+        max_limit=max(1, max_limit // settings.workers),  # the limits are shared by all workers
+        wait_budget=settings.admission.wait_budget.total_seconds(),
+        adaptive=settings.admission.adaptive,
+        tolerance=settings.admission.latency_tolerance,
+        enabled=settings.admission.enabled,
+    )
+
+
+database = _limiter('database', settings.admission.database_limit)
+signing = _limiter('signing', settings.admission.signing_limit)
+challenge = _limiter('challenge', settings.admission.challenge_limit)
@@ -4,7 +4,7 @@ import db
 from acme.certificate.service import SerialNumberConverter
 from config import settings
 from cryptography import x509
-from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives import hashes, serialization
 from fastapi import APIRouter, HTTPException, Response, status
 from logger import logger
 from pydantic import constr
@@ -28,22 +28,28 @@ if settings.ca.enabled:
 
     async def init():
         if (settings.ca.import_dir / 'ca.pem').is_file() and (settings.ca.import_dir / 'ca.key').is_file():
-            with open(settings.ca.import_dir / 'ca.key', 'rb') as f:
-                ca_key_bytes = f.read()
-            ca_key = serialization.load_pem_private_key(ca_key_bytes, None)
-            f = Fernet(settings.ca.encryption_key.get_secret_value())
-            ca_key_enc = f.encrypt(ca_key_bytes)
-
             with open(settings.ca.import_dir / 'ca.pem', 'rb') as f:
                 ca_cert_bytes = f.read()
             ca_cert = x509.load_pem_x509_certificate(ca_cert_bytes, None)
             serial_number = SerialNumberConverter.int2hex(ca_cert.serial_number)
 
-            async with db.transaction(readonly=True) as sql:
+            async with db.transaction() as sql:
+                # replicas starting at the same time import the CA only once, the others (and restarts) find it already imported
+                await sql.exec("""select pg_advisory_xact_lock($1)""", db.CA_IMPORT_LOCK)
+                stored_cert_pem = await sql.value("""select cert_pem from cas where serial_number = $1 and active = true""", serial_number)
+                if stored_cert_pem and x509.load_pem_x509_certificate(stored_cert_pem.encode()).fingerprint(hashes.SHA256()) == ca_cert.fingerprint(hashes.SHA256()):
+                    logger.info('CA provided in "%s" folder is already imported', settings.ca.import_dir)
+                    return
+
+                with open(settings.ca.import_dir / 'ca.key', 'rb') as f:
+                    ca_key_bytes = f.read()
+                ca_key = serialization.load_pem_private_key(ca_key_bytes, None)
+                f = Fernet(settings.ca.encryption_key.get_secret_value())
+                ca_key_enc = f.encrypt(ca_key_bytes)
+
                 revocations = [record async for record in sql("""select serial_number, revoked_at from certificates where revoked_at is not null""")]
-            _, crl_pem = await asyncio.to_thread(build_crl_sync, ca_key=ca_key, ca_cert=ca_cert, revocations=revocations)
+                _, crl_pem = await asyncio.to_thread(build_crl_sync, ca_key=ca_key, ca_cert=ca_cert, revocations=revocations)
 
-            async with db.transaction() as sql:
                 await sql.exec("""update cas set active = false""")
                 await sql.exec(
                     """
@@ -63,8 +69,12 @@ if settings.ca.enabled:
             if not ok:
                 raise ValueError('internal ca is enabled but no CA certificate is registered and active. Please import one first.')
 
+    async def start_cronjobs():
         await cronjob.start()
 else:
 
     async def init():
         logger.info('Builtin CA is disabled, relying on custom CA implementation')
+
+    async def start_cronjobs():
+        pass
@@ -6,6 +6,7 @@ import asyncio
 from datetime import datetime, timezone
 
 import db
+import metrics
 from acme.certificate.service import SerialNumberConverter
 from config import settings
 from cryptography import x509
@@ -66,6 +67,11 @@ def generate_cert_sync(*, ca_key: PrivateKeyTypes, ca_cert: x509.Certificate, cs
         not_valid_after=datetime.now(timezone.utc) + settings.ca.cert_lifetime,
         public_key=csr.public_key(),
     ).add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+    try:  # the authority key identifier is part of the ARI certificate identifier
+        ca_ski = ca_cert.extensions.get_extension_for_class(x509.SubjectKeyIdentifier).value
+        cert_builder = cert_builder.add_extension(x509.AuthorityKeyIdentifier.from_issuer_subject_key_identifier(ca_ski), critical=False)
+    except x509.ExtensionNotFound:
+        cert_builder = cert_builder.add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_cert.public_key()), critical=False)  # type: ignore[arg-type]
     if settings.ca.cert_cdp_enabled:
         cdp_uri = str(settings.external_url).lower().removesuffix('/') + f'/ca/{ca_id}/crl'
         if cdp_uri.startswith('https://'):
@@ -114,6 +120,7 @@ def generate_cert_sync(*, ca_key: PrivateKeyTypes, ca_cert: x509.Certificate, cs
     return cert, cert_chain_pem
 
 
+@metrics.ca_build_crl_duration.time()
 def build_crl_sync(*, ca_key: PrivateKeyTypes, ca_cert: x509.Certificate, revocations: set[tuple[str, datetime]]):
     now = datetime.now(timezone.utc)
     builder = x509.CertificateRevocationListBuilder(
@@ -126,4 +133,6 @@ def build_crl_sync(*, ca_key: PrivateKeyTypes, ca_cert: x509.Certificate, revoca
         builder = builder.add_revoked_certificate(revoked_cert)
     crl = builder.sign(private_key=ca_key, algorithm=hashes.SHA512())  # type: ignore[arg-type]
     crl_pem = crl.public_bytes(encoding=serialization.Encoding.PEM).decode()
+    metrics.ca_crl_size.set(len(crl_pem))
+    metrics.ca_crl_entries.set(len(revocations))
     return crl, crl_pem
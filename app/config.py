@@ -1,20 +1,49 @@
+import os
+import re
 import sys
 from datetime import timedelta
 from pathlib import Path
-from typing import Any, Literal, Optional, Pattern
+from typing import Annotated, Any, Literal, NamedTuple, Optional, Pattern
 
 from logger import logger
-from pydantic import AnyHttpUrl, EmailStr, PostgresDsn, SecretStr, model_validator
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic import AnyHttpUrl, EmailStr, PostgresDsn, SecretStr, field_validator, model_validator
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
 
 class WebSettings(BaseSettings):
     enabled: bool = True
     enable_public_log: bool = False
+    log_page_size: int = 100
     app_title: str = 'ACME CA Server'
     app_description: str = 'Self-hosted ACME CA Server'
     model_config = SettingsConfigDict(env_prefix='web_', secrets_dir='/run/secrets')
 
+    @model_validator(mode='after')
+    def valid_check(self) -> 'WebSettings':
+        if self.log_page_size < 1:
+            raise ValueError('Web log page size must be positive, not: ' + str(self.log_page_size))
+        return self
+
+
+class AdmissionSettings(BaseSettings):
+    enabled: bool = False
+    wait_budget: timedelta = timedelta(seconds=5)
+    adaptive: bool = True
+    latency_tolerance: float = 2.0
+    database_limit: int = 20  # size of the database pool
+    signing_limit: int = os.cpu_count() or 4
+    challenge_limit: int = 50
+
+    model_config = SettingsConfigDict(env_prefix='admission_', secrets_dir='/run/secrets')
+
+    @model_validator(mode='after')
+    def valid_check(self) -> 'AdmissionSettings':
+        if self.latency_tolerance <= 1:
+            raise ValueError('Admission latency tolerance must be greater than 1, not: ' + str(self.latency_tolerance))
+        if min(self.database_limit, self.signing_limit, self.challenge_limit) < 1:
+            raise ValueError('Admission limits must be positive')
+        return self
+
 
 class CaSettings(BaseSettings):
     enabled: bool = True
@@ -41,6 +70,14 @@ class CaSettings(BaseSettings):
         return self
 
 
+class DebugSettings(BaseSettings):
+    admin_token: Optional[SecretStr] = None  # enables the profiler endpoints
+    profile_dir: Optional[Path] = None
+    loop_lag_threshold: Optional[timedelta] = None
+
+    model_config = SettingsConfigDict(env_prefix='debug_', secrets_dir='/run/secrets')
+
+
 class MailSettings(BaseSettings):
     enabled: bool = False
     host: Optional[str] = None
@@ -79,17 +116,118 @@ class AcmeSettings(BaseSettings):
     mail_target_regex: Pattern = r'[^@]+@[^@]+\.[^@]+'  # type: ignore[assignment]
     mail_required: bool = True
     target_domain_regex: Pattern = r'[^\*]+\.[^\.]+'  # type: ignore[assignment]  # disallow wildcard
+    orders_page_size: int = 100
+    nonce_reservoir_size: int = 100
+    certificate_cache_size: int = 1000
 
     model_config = SettingsConfigDict(env_prefix='acme_', secrets_dir='/run/secrets')
 
+    @model_validator(mode='after')
+    def valid_check(self) -> 'AcmeSettings':
+        if self.orders_page_size < 1:
+            raise ValueError('Orders page size must be positive, not: ' + str(self.orders_page_size))
+        if self.nonce_reservoir_size < 0:
+            raise ValueError('Nonce reservoir size must not be negative, not: ' + str(self.nonce_reservoir_size))
+        if self.certificate_cache_size < 0:
+            raise ValueError('Certificate cache size must not be negative, not: ' + str(self.certificate_cache_size))
+        return self
+
+
+class MetricsSettings(BaseSettings):
+    enabled: bool = False
+    server_timing: bool = False
+    slow_query_threshold: Optional[timedelta] = None
+
+    model_config = SettingsConfigDict(env_prefix='metrics_', secrets_dir='/run/secrets')
+
+
+class RateLimit(NamedTuple):
+    requests: int
+    period: timedelta
+
+
+class RateLimitSettings(BaseSettings):
+    backend: Literal['memory', 'postgres'] = 'memory'
+    per_ip: Optional[RateLimit] = None
+    per_account: Optional[RateLimit] = None
+    per_domain: Optional[RateLimit] = None
+    # multi-label public suffixes (without the public suffix list, registered domains are approximated by the last two labels otherwise)
+    public_suffixes: Annotated[frozenset[str], NoDecode] = frozenset(
+        f'{second_level}.{tld}'
+        for tld, second_levels in {
+            'uk': ('co', 'org', 'me', 'ltd', 'plc', 'net', 'ac', 'gov', 'nhs', 'sch'),
+            'au': ('com', 'net', 'org', 'edu', 'gov', 'id', 'asn'),
+            'nz': ('co', 'org', 'net', 'ac', 'govt', 'school', 'geek', 'gen'),
+            'jp': ('co', 'or', 'ne', 'ac', 'go', 'ed'),
+            'br': ('com', 'net', 'org', 'gov', 'edu'),
+            'cn': ('com', 'net', 'org', 'gov', 'edu'),
+            'in': ('co', 'net', 'org', 'firm', 'gen', 'ind', 'ac', 'gov', 'edu'),
+            'za': ('co', 'org', 'net', 'gov', 'ac', 'web'),
+            'mx': ('com', 'org', 'net', 'gob', 'edu'),
+            'tr': ('com', 'net', 'org', 'gov', 'edu'),
+        }.items()
+        for second_level in second_levels
+    )
+
+    model_config = SettingsConfigDict(env_prefix='ratelimit_', secrets_dir='/run/secrets')
+
+    @field_validator('per_ip', 'per_account', 'per_domain', mode='before')
+    @classmethod
+    def parse_rate_limit(cls, value: Any) -> Any:
+        if not isinstance(value, str):
+            return value
+        if value.strip().lower() in ('', 'false', '0', '-1'):
+            return None
+        match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d*)\s*(s|m|h|d)\s*', value.lower())
+        if not match or int(match[1]) < 1:
+            raise ValueError(f'Rate limit must look like "20/s", "300/5m", "100/h" or "1000/d", not: {value}')
+        unit = {'s': timedelta(seconds=1), 'm': timedelta(minutes=1), 'h': timedelta(hours=1), 'd': timedelta(days=1)}[match[3]]
+        return RateLimit(requests=int(match[1]), period=int(match[2] or 1) * unit)
+
+    @field_validator('public_suffixes', mode='before')
+    @classmethod
+    def parse_public_suffixes(cls, value: Any) -> Any:
+        if isinstance(value, str):  # comma separated, e.g. "co.uk,com.au"
+            return frozenset(suffix.strip().lower().strip('.') for suffix in value.split(',') if suffix.strip())
+        return value
+
+
+class RetentionSettings(BaseSettings):
+    enabled: bool = False
+    period: timedelta = timedelta(days=90)
+    batch_size: int = 1000
+    archive: Literal['none', 'file', 'table'] = 'none'
+    archive_dir: Path = '/archive'  # type: ignore[assignment]
+
+    model_config = SettingsConfigDict(env_prefix='retention_', secrets_dir='/run/secrets')
+
+    @model_validator(mode='after')
+    def valid_check(self) -> 'RetentionSettings':
+        if self.enabled and self.period.days < 1:
+            raise ValueError('Retention period must be at least one day, not: ' + str(self.period))
+        if self.batch_size < 1:
+            raise ValueError('Retention batch size must be positive, not: ' + str(self.batch_size))
+        return self
+
 
 class Settings(BaseSettings):
     external_url: AnyHttpUrl
     db_dsn: PostgresDsn
+    db_pool_size: int = 20  # connections of all workers together
+    workers: int = 1
     log_level: Literal['debug', 'info', 'warning', 'error'] = 'info'
+    log_format: Literal['text', 'json'] = 'text'
+    log_queue_size: int = 10000
+    # category -> fraction of its records which are logged, e.g. "nonce_rejected=0.01,challenge_failed=0.1"
+    log_sample_rates: Annotated[dict[str, float], NoDecode] = {}
     acme: AcmeSettings = AcmeSettings()
+    admission: AdmissionSettings = AdmissionSettings()
     ca: CaSettings = CaSettings()
+    debug: DebugSettings = DebugSettings()
     mail: MailSettings = MailSettings()
+    metrics: MetricsSettings = MetricsSettings()
+    ratelimit: RateLimitSettings = RateLimitSettings()
+    retention: RetentionSettings = RetentionSettings()
     web: WebSettings = WebSettings()
 
     model_config = SettingsConfigDict(secrets_dir='/run/secrets')
@@ -101,10 +239,28 @@ class Settings(BaseSettings):
             data['external_url'] += '/'
         return data
 
+    @field_validator('log_sample_rates', mode='before')
+    @classmethod
+    def parse_log_sample_rates(cls, value: Any) -> Any:
+        if isinstance(value, str):
+            try:
+                return {category.strip(): float(rate) for category, rate in (item.split('=') for item in value.split(',') if item.strip())}
+            except ValueError as e:
+                raise ValueError(f'Log sample rates must look like "nonce_rejected=0.01,challenge_failed=0.1", not: {value}') from e
+        return value
+
     @model_validator(mode='after')
     def valid_check(self) -> 'Settings':
         if self.external_url.scheme != 'https':
             logger.warning('Env Var "external_url" is not HTTPS. This is insecure!')
+        if self.workers < 1:
+            raise ValueError('Workers must be positive, not: ' + str(self.workers))
+        if self.db_pool_size < self.workers:
+            raise ValueError('Database pool size must be at least the number of workers, not: ' + str(self.db_pool_size))
+        if self.log_queue_size < 1:
+            raise ValueError('Log queue size must be positive, not: ' + str(self.log_queue_size))
+        if any(not 0 <= rate <= 1 for rate in self.log_sample_rates.values()):
+            raise ValueError('Log sample rates must be between 0 and 1, not: ' + str(self.log_sample_rates))
         if self.mail.warn_before_cert_expires and self.ca.enabled and self.mail.enabled:
             if self.mail.warn_before_cert_expires >= self.ca.cert_lifetime:
                 raise ValueError('Env var web_warn_before_cert_expires cannot be greater than ca_cert_lifetime')
@@ -116,5 +272,3 @@ class Settings(BaseSettings):
 settings = Settings()  # type: ignore[call-arg]
 
 logger.setLevel(settings.log_level.upper())
-
-logger.debug('Settings: %s', settings.model_dump())
@@ -1,23 +1,57 @@
+import asyncio
 import json
+import time
 from typing import Any
 
+import admission
 import asyncpg
+import metrics
+import timing
 from config import settings
 from logger import logger
 from pydantic import BaseModel
 
 _POOL: asyncpg.pool.Pool = None
 
+# keys of the advisory locks ("acme" + number), unlikely to collide with other apps using the same database
+CRONJOBS_LOCK = 0x61636D65_00000001
+MIGRATIONS_LOCK = 0x61636D65_00000002
+CA_IMPORT_LOCK = 0x61636D65_00000003
+_LOCK_CONNECTIONS: list[asyncpg.Connection] = []
+
 
 async def connect():
     global _POOL  # pylint: disable=global-statement
-    _POOL = await asyncpg.create_pool(min_size=0, max_size=20, dsn=str(settings.db_dsn), init=init_connection, server_settings={'application_name': settings.web.app_title})
+    _POOL = await asyncpg.create_pool(
+        min_size=0,
+        max_size=max(1, settings.db_pool_size // settings.workers),  # the pool size is shared by all workers
+        dsn=str(settings.db_dsn),
+        init=init_connection,
+        server_settings={'application_name': settings.web.app_title},
+    )
+    metrics.db_pool_connections.labels('total').set_function(_POOL.get_size)
+    metrics.db_pool_connections.labels('idle').set_function(_POOL.get_idle_size)
+    metrics.db_pool_connections.labels('max').set_function(_POOL.get_max_size)
 
 
 async def disconnect():
+    for conn in _LOCK_CONNECTIONS:
+        await conn.close()
+    _LOCK_CONNECTIONS.clear()
     await _POOL.close()
 
 
+async def wait_for_lock(key: int, retry_interval: float = 60):
+    """
+    waits until this process holds the (session level) advisory lock, e.g. to run tasks in one worker only. The lock is held on a
+    dedicated connection until disconnect() or the process exits, then another process waiting for it takes over
+    """
+    conn = await asyncpg.connect(dsn=str(settings.db_dsn), server_settings={'application_name': settings.web.app_title})
+    while not await conn.fetchval("""select pg_try_advisory_lock($1)""", key):
+        await asyncio.sleep(retry_interval)
+    _LOCK_CONNECTIONS.append(conn)
+
+
 async def init_connection(conn: asyncpg.Connection):
     await conn.set_type_codec('jsonb', encoder=_encode_json, decoder=json.loads, schema='pg_catalog')
 
@@ -36,38 +70,86 @@ class transaction:  # pylint: disable=invalid-name
         self.readonly = readonly
         self.conn: asyncpg.Connection = None
         self.trans: asyncpg.connection.transaction = None
+        self.started_at = 0.0
 
     async def __aenter__(self, *args, **kwargs):
-        self.conn = await _POOL.acquire()
+        acquire_started_at = time.perf_counter()
+        await admission.database.acquire()
+        try:
+            self.conn = await _POOL.acquire()
+        except BaseException:
+            admission.database.release(None)
+            raise
+        self.started_at = time.perf_counter()
+        metrics.db_acquire_duration.observe(self.started_at - acquire_started_at)
+        timing.record('db-acquire', self.started_at - acquire_started_at)
         self.trans = self.conn.transaction(readonly=self.readonly)
         await self.trans.start()
         return self
 
     async def __call__(self, *args):
         """fetch response for query"""
-        async for rec in self.conn.cursor(*args):
-            yield rec
+        started_at = time.perf_counter()
+        try:
+            async for rec in self.conn.cursor(*args):
+                yield rec
+        finally:
+            _check_slow_query(started_at, *args)
 
     async def record(self, *args):
         """fetch first response row for query"""
-        return await self.conn.fetchrow(*args)
+        started_at = time.perf_counter()
+        try:
+            return await self.conn.fetchrow(*args)
+        finally:
+            _check_slow_query(started_at, *args)
 
     async def value(self, *args):
         """fetch first value from first response row for query"""
-        return await self.conn.fetchval(*args)
+        started_at = time.perf_counter()
+        try:
+            return await self.conn.fetchval(*args)
+        finally:
+            _check_slow_query(started_at, *args)
 
     async def exec(self, *args):  # noqa: A003 (allow shadowing builtin "type")
         """execute command"""
-        return await self.conn.execute(*args)
+        started_at = time.perf_counter()
+        try:
+            return await self.conn.execute(*args)
+        finally:
+            _check_slow_query(started_at, *args)
 
     async def execmany(self, command: str, *args):
         """execute command with many records"""
-        return await self.conn.executemany(command, args)
+        started_at = time.perf_counter()
+        try:
+            return await self.conn.executemany(command, args)
+        finally:
+            _check_slow_query(started_at, command)
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if exc_type:
-            logger.debug('Transaction rollback. Reason: %s %s %s', exc_type, exc_val, exc_tb)
-            await self.trans.rollback()
-        else:
-            await self.trans.commit()
-        await _POOL.release(self.conn)
+        try:
+            if exc_type:
+                logger.debug('Transaction rollback. Reason: %s %s %s', exc_type, exc_val, exc_tb)
+                await self.trans.rollback()
+                metrics.db_transaction_rollbacks.inc()
+            else:
+                await self.trans.commit()
+        finally:
+            await _POOL.release(self.conn)
+            duration = time.perf_counter() - self.started_at
+            admission.database.release(duration)
+        metrics.db_transaction_duration.labels(str(self.readonly).lower()).observe(duration)
+        timing.record('db', duration)
+        threshold = settings.metrics.slow_query_threshold
+        if threshold and duration > threshold.total_seconds():
+            logger.warning('Slow transaction: %.1fms (readonly: %s, rollback: %s)', duration * 1000, self.readonly, bool(exc_type))
+
+
+def _check_slow_query(started_at: float, query: str, *params):
+    threshold = settings.metrics.slow_query_threshold
+    if threshold:
+        duration = time.perf_counter() - started_at
+        if duration > threshold.total_seconds():
+            logger.warning('Slow query: %.1fms %s %s', duration * 1000, timing.fingerprint(query), timing.redact(params))
@@ -0,0 +1,14 @@
+-- speed up joins from orders to their authorizations and the sweep of expired orders
+create index authorizations_order_id on authorizations (order_id);
+create index orders_expires_at on orders (expires_at);
+
+-- only used if RETENTION_ARCHIVE=table
+-- purged orders are stored as a single document including their authorizations and challenges
+create table archived_orders (
+    id random_id not null,
+    account_id random_id not null,
+    archived_at timestamptz not null default now(),
+    data jsonb not null,
+    PRIMARY KEY (id)
+);
+create index archived_orders_account_id on archived_orders (account_id);
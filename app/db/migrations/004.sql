@@ -0,0 +1,61 @@
+-- pg_trgm allows index-backed substring search (ilike '%...%') in the web log.
+-- it is a trusted extension shipped with the official postgres images, but the server still works without it
+do $$
+begin
+    create extension if not exists pg_trgm;
+exception when others then
+    raise notice 'extension pg_trgm is not available, domain search in web log is not index-backed';
+end $$;
+
+create index authorizations_domain on authorizations (domain);
+-- keyset pagination of the web certificate log
+create index certificates_not_valid_after on certificates (not_valid_after desc, serial_number desc);
+
+-- per domain summary of all issued certificates, used by the web domain log
+create table domains (
+    domain domain_name not null,
+    first_requested_at timestamptz not null,
+    expires_at timestamptz not null,
+    valid_until timestamptz default null, -- newest expiration date of a not revoked certificate
+    PRIMARY KEY (domain)
+);
+
+insert into domains (domain, first_requested_at, expires_at, valid_until)
+    select authz.domain, min(cert.not_valid_before), max(cert.not_valid_after), max(cert.not_valid_after) filter (where cert.revoked_at is null)
+    from certificates cert
+    join authorizations authz on authz.order_id = cert.order_id
+    group by authz.domain;
+
+do $$
+begin
+    if exists (select from pg_extension where extname = 'pg_trgm') then
+        create index authorizations_domain_trgm on authorizations using gin (domain gin_trgm_ops);
+        create index domains_domain_trgm on domains using gin (domain gin_trgm_ops);
+    end if;
+end $$;
+
+-- keep the domain summary up to date on certificate issuance and revocation
+create function update_domains() returns trigger as $$
+begin
+    if TG_OP = 'INSERT' then
+        insert into domains (domain, first_requested_at, expires_at, valid_until)
+            select distinct authz.domain, new.not_valid_before, new.not_valid_after, case when new.revoked_at is null then new.not_valid_after end
+            from authorizations authz where authz.order_id = new.order_id
+        on conflict (domain) do update set
+            first_requested_at = least(domains.first_requested_at, excluded.first_requested_at),
+            expires_at = greatest(domains.expires_at, excluded.expires_at),
+            valid_until = greatest(domains.valid_until, excluded.valid_until);
+    elsif new.revoked_at is distinct from old.revoked_at then
+        update domains set valid_until = (
+            select max(cert.not_valid_after) from certificates cert
+            join authorizations authz on authz.order_id = cert.order_id
+            where authz.domain = domains.domain and cert.revoked_at is null
+        )
+        where domain in (select domain from authorizations where order_id = new.order_id);
+    end if;
+    return null;
+end;
+$$ language plpgsql;
+
+create trigger certificates_update_domains after insert or update of revoked_at on certificates
+    for each row execute function update_domains();
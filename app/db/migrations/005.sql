@@ -0,0 +1,19 @@
+-- RFC 7638 JWK thumbprint (base64url encoded SHA-256 of the required key members in lexicographic order),
+-- account keys are looked up by thumbprint instead of comparing whole jsonb documents.
+-- the app computes the thumbprint on account creation, this function is used to fill existing accounts
+create function jwk_thumbprint(jwk jsonb) returns text as $$
+    select rtrim(translate(encode(sha256(convert_to(
+        case jwk->>'kty'
+            when 'EC' then format('{"crv":"%s","kty":"EC","x":"%s","y":"%s"}', jwk->>'crv', jwk->>'x', jwk->>'y')
+            when 'RSA' then format('{"e":"%s","kty":"RSA","n":"%s"}', jwk->>'e', jwk->>'n')
+        end,
+    'UTF8')), 'base64'), '+/', '-_'), '=')
+$$ language sql immutable strict;
+
+alter table accounts add column jwk_thumbprint text;
+update accounts set jwk_thumbprint = jwk_thumbprint(jwk);
+alter table accounts alter column jwk_thumbprint set not null;
+create unique index accounts_jwk_thumbprint on accounts (jwk_thumbprint);
+
+alter table accounts drop constraint accounts_jwk_key;
+drop index accounts_jwk;
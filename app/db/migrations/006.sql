@@ -0,0 +1,6 @@
+-- keyset pagination of the account order list
+-- existing orders have a fixed lifetime of 60 minutes, so their creation time can be derived from the expiration
+alter table orders add column created_at timestamptz;
+update orders set created_at = coalesce(expires_at - interval '60 minutes', now());
+alter table orders alter column created_at set default now(), alter column created_at set not null;
+create index orders_account_id_created_at on orders (account_id, created_at, id);
@@ -0,0 +1,3 @@
+-- ACME Renewal Information (RFC 9773): an order may replace a previously issued certificate
+alter table orders add column replaces serial_number references certificates(serial_number);
+create index orders_replaces on orders (replaces) where replaces is not null;
@@ -0,0 +1,8 @@
+-- token buckets of the shared rate limiter (RATELIMIT_BACKEND=postgres), losing them on a crash only resets the limits
+create unlogged table rate_limits (
+    key text not null,
+    tokens float8 not null,
+    allowed boolean not null,
+    updated_at timestamptz not null default now(),
+    primary key (key)
+);
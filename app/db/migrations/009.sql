@@ -0,0 +1,16 @@
+-- the chain of every issuing CA is stored once, certificates only reference it by the serial number of the issuing cert
+create table issuers (
+    serial_number serial_number not null,
+    chain_pem text not null,
+    PRIMARY KEY (serial_number)
+);
+
+-- certificates are stored as DER (instead of PEM chains containing a copy of the CA cert)
+-- existing rows are converted in batches by the app on startup, until then they keep their PEM columns
+alter table certificates
+    add column cert_der bytea,
+    add column csr_der bytea,
+    add column issuer_serial_number serial_number references issuers(serial_number),
+    alter column chain_pem drop not null,
+    alter column csr_pem drop not null,
+    add constraint certificates_stored check (cert_der is not null or chain_pem is not null);
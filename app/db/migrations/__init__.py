@@ -7,6 +7,8 @@ import db
 
 async def run():
     async with db.transaction() as sql:
+        # replicas starting at the same time wait here until the first one migrated the database, they find it up to date then
+        await sql.exec("""select pg_advisory_xact_lock($1)""", db.MIGRATIONS_LOCK)
         await sql.exec("""
             create table if not exists migrations (
                 dummy_id integer unique default 1 check (dummy_id = 1), -- there should only be one row
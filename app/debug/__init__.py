@@ -0,0 +1,61 @@
+import hmac
+import re
+from typing import Literal
+
+from config import settings
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from pydantic import BaseModel, Field, field_validator
+
+from . import watchdog
+from .profiler import ProfilerMiddleware, profiler
+
+
+async def require_admin(authorization: str = Header('')):
+    token = settings.debug.admin_token
+    if not token or not hmac.compare_digest(authorization.encode(), f'Bearer {token.get_secret_value()}'.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='admin token required', headers={'WWW-Authenticate': 'Bearer'})
+
+
+class ProfilerStart(BaseModel):
+    mode: Literal['sample', 'cprofile'] = 'sample'
+    duration: float = Field(60, gt=0, le=3600)  # seconds
+    path_pattern: str | None = None  # regex, cprofile mode only
+    percentage: float = Field(100, gt=0, le=100)  # share of matching requests to profile, cprofile mode only
+    interval: float = Field(0.005, ge=0.001, le=1)  # seconds between stack samples, sample mode only
+
+    @field_validator('path_pattern')
+    @classmethod
+    def valid_regex(cls, value: str | None) -> str | None:
+        if value is not None:
+            try:
+                re.compile(value)
+            except re.error as exc:
+                raise ValueError(f'invalid regex: {exc}') from exc
+        return value
+
+
+router = APIRouter(prefix='/debug', tags=['debug'], dependencies=[Depends(require_admin)], include_in_schema=False)
+
+
+@router.post('/profiler', status_code=status.HTTP_204_NO_CONTENT)
+async def start_profiler(data: ProfilerStart):
+    if profiler.active:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='profiler is already running')
+    profiler.start(mode=data.mode, duration=data.duration, path_pattern=data.path_pattern, percentage=data.percentage, interval=data.interval)
+
+
+@router.delete('/profiler', status_code=status.HTTP_204_NO_CONTENT)
+async def stop_profiler():
+    profiler.stop()
+    if settings.debug.profile_dir:
+        profiler.dump(settings.debug.profile_dir)
+
+
+@router.get('/profiler', response_class=Response, responses={200: {'content': {'text/plain': {}}}})
+async def get_profile():
+    """aggregated profile of the current or last profiler run: collapsed stacks (sample mode) or pstats (cprofile mode)"""
+    content = profiler.collapsed() if profiler.mode == 'sample' else profiler.pstats_text()
+    return Response(content=content, media_type='text/plain')
+
+
+__all__ = ['ProfilerMiddleware', 'router', 'watchdog']
@@ -0,0 +1,136 @@
+import cProfile
+import io
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Literal
+
+from logger import logger
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class Profiler:  # pylint: disable=too-many-instance-attributes
+    """
+    collects one aggregated profile during a bounded time window, either
+    - "sample": a thread samples the stack of the event loop thread in a fixed interval (collapsed stack format, e.g. for flamegraph.pl or speedscope)
+    - "cprofile": requests matching a path pattern are run with cProfile enabled (pstats format)
+    """
+
+    def __init__(self) -> None:
+        self.mode: Literal['sample', 'cprofile'] | None = None
+        self.until = 0.0
+        self.path_pattern: re.Pattern | None = None
+        self.percentage = 100.0
+        self.samples: Counter[str] = Counter()
+        self.stats: pstats.Stats | None = None
+        self.profiled_requests = 0
+        self._request_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.mode is not None and time.monotonic() < self.until
+
+    def start(self, *, mode: Literal['sample', 'cprofile'], duration: float, path_pattern: str | None, percentage: float, interval: float) -> None:
+        with self._lock:
+            self.mode = mode
+            self.until = time.monotonic() + duration
+            self.path_pattern = re.compile(path_pattern) if path_pattern else None
+            self.percentage = percentage
+            self.samples = Counter()
+            self.stats = None
+            self.profiled_requests = 0
+        if mode == 'sample':
+            threading.Thread(target=self._sample, args=(threading.get_ident(), interval), name='profiler', daemon=True).start()
+        logger.warning('Profiler started (mode: %s, duration: %ss)', mode, duration)
+
+    def stop(self) -> None:
+        self.until = 0.0
+        logger.warning('Profiler stopped (mode: %s, samples: %s, profiled requests: %s)', self.mode, self.samples.total(), self.profiled_requests)
+
+    def _sample(self, thread_id: int, interval: float) -> None:
+        while self.active:
+            frame = sys._current_frames().get(thread_id)  # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_filename}:{frame.f_code.co_name}')
+                frame = frame.f_back
+            if stack:
+                with self._lock:
+                    self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+
+    def should_profile(self, path: str) -> bool:
+        # cProfile hooks into the whole thread, so only one request at a time is profiled to keep the profile attributable
+        if self.mode != 'cprofile' or not self.active or self._request_running:
+            return False
+        if self.path_pattern is not None and not self.path_pattern.search(path):
+            return False
+        return random.uniform(0, 100) < self.percentage  # noqa: S311 (no cryptographic use)
+
+    def add_profile(self, profile: cProfile.Profile) -> None:
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.profiled_requests += 1
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+    def pstats_text(self, limit: int = 100) -> str:
+        with self._lock:
+            if self.stats is None:
+                return ''
+            stream = io.StringIO()
+            self.stats.stream = stream  # type: ignore[attr-defined]
+            self.stats.sort_stats('cumulative').print_stats(limit)
+            return stream.getvalue()
+
+    def dump(self, directory: Path) -> Path | None:
+        """write the collected profile to the directory, returns the written file"""
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f'profile-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}'
+        if self.mode == 'sample' and self.samples:
+            file = directory / f'{name}.collapsed'
+            file.write_text(self.collapsed())
+            return file
+        with self._lock:
+            if self.mode == 'cprofile' and self.stats is not None:
+                file = directory / f'{name}.pstats'
+                self.stats.dump_stats(file)
+                return file
+        return None
+
+
+profiler = Profiler()
+
+
+class ProfilerMiddleware:  # pylint: disable=too-few-public-methods
+    """Run requests with cProfile while the profiler is active in cprofile mode."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or not profiler.should_profile(scope['path']):
+            await self.app(scope, receive, send)
+            return
+
+        profile = cProfile.Profile()
+        profiler._request_running = True  # pylint: disable=protected-access
+        profile.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.disable()
+            profiler._request_running = False  # pylint: disable=protected-access
+            profiler.add_profile(profile)
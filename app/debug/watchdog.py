@@ -0,0 +1,37 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+from logger import logger
+
+
+def start(threshold: float) -> None:
+    """
+    watch the event loop from a separate thread: the loop updates a heartbeat in a fixed interval,
+    if the heartbeat is older than threshold seconds, the code currently blocking the loop is logged with its stack
+    """
+    loop = asyncio.get_running_loop()
+    loop_thread_id = threading.get_ident()
+    interval = threshold / 4
+    heartbeat = time.monotonic()
+
+    def beat():
+        nonlocal heartbeat
+        heartbeat = time.monotonic()
+        loop.call_later(interval, beat)
+
+    def watch():
+        reported = 0.0  # heartbeat of the last reported stall, to log every stall only once
+        while not loop.is_closed():
+            time.sleep(interval)
+            lag = time.monotonic() - heartbeat
+            if lag > threshold and reported != heartbeat:
+                reported = heartbeat
+                frame = sys._current_frames().get(loop_thread_id)  # pylint: disable=protected-access
+                stack = ''.join(traceback.format_stack(frame)) if frame else 'unknown'
+                logger.warning('Event loop blocked for %.0fms, stack:\n%s', lag * 1000, stack)
+
+    beat()
+    threading.Thread(target=watch, name='loop-watchdog', daemon=True).start()
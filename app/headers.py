@@ -0,0 +1,24 @@
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """whether an If-None-Match header matches the ETag, the tags are compared weakly (RFC 9110 13.1.2), e.g. after a proxy re-encoded the body"""
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.removeprefix('W/') == etag.removeprefix('W/'):
+            return True
+    return False
+
+
+def accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    """whether an Accept-Encoding header allows the content coding, i.e. the coding (or "*" if it is not listed) has a q-value above 0 (RFC 9110 12.5.3)"""
+    qvalues = {}
+    for element in accept_encoding.split(','):
+        name, *params = (part.strip() for part in element.split(';'))
+        qvalue = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[name.lower().removeprefix('x-')] = qvalue  # x-gzip is an alias of gzip
+    return qvalues.get(coding, qvalues.get('*', 0.0)) > 0
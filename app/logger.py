@@ -1,3 +1,142 @@
 import logging
+import logging.handlers
+import queue
+import random
+import re
+import secrets
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+import metrics
+import orjson
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 logger = logging.getLogger('uvicorn')
+
+# the id of the current request (shown in JSON logs), None outside of a request
+request_id: ContextVar[str | None] = ContextVar('request_id', default=None)
+
+_REQUEST_ID_PATTERN = re.compile(r'[\w.:-]{1,64}')  # ids passed by a reverse proxy are only taken over if they look harmless
+
+# category (passed via extra={'category': ...}) -> fraction of its records which are logged
+_sample_rates: dict[str, float] = {}
+
+# the loggers whose handlers were moved behind the queue -> their original handlers, to restore them on stop
+_moved_handlers: dict[logging.Logger, list[logging.Handler]] = {}
+_listeners: list[logging.handlers.QueueListener] = []
+
+
+class JsonFormatter(logging.Formatter):
+    """one JSON object per line, for log collectors"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if rid := getattr(record, 'request_id', None):
+            entry['request_id'] = rid
+        if category := getattr(record, 'category', None):
+            entry['category'] = category
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+def _sample(record: logging.LogRecord) -> bool:
+    rate = _sample_rates.get(getattr(record, 'category', None) or '', 1.0)
+    return rate >= 1 or random.random() < rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    hands the records over to the listener thread, which formats and writes them, so the event loop never waits for the output.
+    If the queue is full (log storm, stalled output) records are dropped and counted instead of blocking
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id.get()  # the context var is only visible on the event loop
+        return record  # formatting happens in the listener thread
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_records_dropped.inc()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def __init__(self, log_queue: queue.Queue, *handlers: logging.Handler) -> None:
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.log_queue = log_queue
+
+    def enqueue_sentinel(self) -> None:
+        self.log_queue.put(None)  # on stop, wait for room in a full queue instead of failing
+
+
+def start(*, log_format: str, queue_size: int, sample_rates: dict[str, float]) -> None:
+    """route the records of the app and uvicorn loggers through a bounded queue to their handlers, which run in a listener thread"""
+    stop()
+    _sample_rates.update(sample_rates)
+    for name in ('uvicorn', 'uvicorn.access'):
+        target = logging.getLogger(name)
+        handlers = list(target.handlers)
+        if not handlers and name == 'uvicorn':  # not started by uvicorn, e.g. in tests
+            fallback = logging.StreamHandler(sys.stderr)
+            fallback.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+            handlers = [fallback]
+        if not handlers:
+            continue
+        if log_format == 'json':
+            for handler in handlers:
+                handler.setFormatter(JsonFormatter())
+        log_queue: queue.Queue = queue.Queue(queue_size)
+        queue_handler = DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(_sample)
+        _moved_handlers[target] = list(target.handlers)
+        target.handlers = [queue_handler]
+        listener = _Listener(log_queue, *handlers)
+        listener.start()
+        _listeners.append(listener)
+
+
+def stop() -> None:
+    """write the queued records and give the loggers their handlers back"""
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
+    for target, handlers in _moved_handlers.items():
+        target.handlers = handlers
+    _moved_handlers.clear()
+    _sample_rates.clear()
+
+
+class RequestIdMiddleware:  # pylint: disable=too-few-public-methods
+    """Assign every request an id for the logs, taken from the X-Request-ID header of a reverse proxy if present, and return it as X-Request-ID."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        rid = next((value.decode('latin-1') for name, value in scope['headers'] if name == b'x-request-id'), '')
+        if not _REQUEST_ID_PATTERN.fullmatch(rid):
+            rid = secrets.token_hex(8)
+        token = request_id.set(rid)
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message)['X-Request-ID'] = rid
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id.reset(token)
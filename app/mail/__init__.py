@@ -1,14 +1,22 @@
+import time
 from datetime import datetime, timezone
 from email.mime.text import MIMEText
+from functools import cache
 from pathlib import Path
 from typing import Literal
 
-from aiosmtplib import SMTP
+import metrics
 from config import settings
-from jinja2 import Environment, FileSystemLoader
 from logger import logger
 
-template_engine = Environment(loader=FileSystemLoader(Path(__file__).parent / 'templates'), enable_async=True, autoescape=True)  # pylint: disable=duplicate-code
+
+@cache
+def template_engine():
+    from jinja2 import Environment, FileSystemLoader  # pylint: disable=import-outside-toplevel  # imported on first use to start faster
+
+    return Environment(loader=FileSystemLoader(Path(__file__).parent / 'templates'), enable_async=True, autoescape=True)  # pylint: disable=duplicate-code
+
+
 default_params = {  # pylint: disable=duplicate-code
     'app_title': settings.web.app_title,
     'app_desc': settings.web.app_description,
@@ -20,17 +28,29 @@ Templates = Literal['cert-expired-info', 'cert-expires-warning', 'new-account-in
 
 
 async def send_mail(receiver: str, template: Templates, subject_vars: dict | None = None, body_vars: dict | None = None):
+    started_at = time.perf_counter()
+    try:
+        await _send_mail(receiver, template, subject_vars, body_vars)
+    except Exception:
+        metrics.mail_send_duration.labels(template, 'error').observe(time.perf_counter() - started_at)
+        raise
+    metrics.mail_send_duration.labels(template, 'ok' if settings.mail.enabled else 'disabled').observe(time.perf_counter() - started_at)
+
+
+async def _send_mail(receiver: str, template: Templates, subject_vars: dict | None = None, body_vars: dict | None = None):
     subject_vars = subject_vars or {}
     subject_vars.update(**default_params)
     body_vars = body_vars or {}
     body_vars.update(**default_params)
-    subject_job = template_engine.get_template(template + '/subject.txt').render_async(subject_vars)
-    body_job = template_engine.get_template(template + '/body.html').render_async(body_vars)
+    subject_job = template_engine().get_template(template + '/subject.txt').render_async(subject_vars)
+    body_job = template_engine().get_template(template + '/body.html').render_async(body_vars)
     message = MIMEText(await body_job, 'html', 'utf-8')
     message['From'] = settings.mail.sender or ''
     message['To'] = receiver
     message['Subject'] = await subject_job
     if settings.mail.enabled:
+        from aiosmtplib import SMTP  # pylint: disable=import-outside-toplevel  # imported on first use to start faster
+
         auth = {}
         if settings.mail.username and settings.mail.password:
             auth = {'username': settings.mail.username, 'password': settings.mail.password.get_secret_value()}
@@ -1,32 +1,63 @@
 __version__ = '0.0.0'  # replaced during build, do not change
 
+import asyncio
+import os
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 import acme
+import admission
 import ca
 import db
 import db.migrations
+import debug
+import logger
+import metrics
+import timing
 import web
+from acme.certificate.service import convert_pem_certificates
 from acme.exceptions import ACMEException
 from config import settings
 from fastapi import FastAPI, HTTPException, Request, status
-from fastapi.exception_handlers import http_exception_handler
+from fastapi.exception_handlers import http_exception_handler, request_validation_exception_handler
 from fastapi.exceptions import RequestValidationError
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import ValidationError
 
+# set by serve.py for the workers when it already ran the setup
+SETUP_DONE_ENV = 'ACME_CA_SERVER_SETUP_DONE'
 
-@asynccontextmanager
-async def lifespan(_: FastAPI):
-    await db.connect()
+
+async def setup():
+    """the one-time setup of the database and the CA, runs once before the workers are started"""
     await db.migrations.run()
+    await convert_pem_certificates()
     await ca.init()
+
+
+async def start_cronjobs():
+    """the cronjobs working on the database run in one worker only, another worker takes over if it exits"""
+    if settings.workers > 1:
+        await db.wait_for_lock(db.CRONJOBS_LOCK)
+    await ca.start_cronjobs()
     await acme.start_cronjobs()
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    logger.start(log_format=settings.log_format, queue_size=settings.log_queue_size, sample_rates=settings.log_sample_rates)
+    await db.connect()
+    if os.environ.get(SETUP_DONE_ENV) != 'true':
+        await setup()
+    await acme.start_worker_cronjobs()
+    asyncio.create_task(start_cronjobs())
+    if settings.debug.loop_lag_threshold:
+        debug.watchdog.start(settings.debug.loop_lag_threshold.total_seconds())
     yield
     await db.disconnect()
+    logger.stop()
 
 
 app = FastAPI(
@@ -46,6 +77,17 @@ app.add_middleware(
     },
 )
 
+if settings.metrics.enabled:
+    app.add_middleware(metrics.MetricsMiddleware)  # type: ignore[arg-type]
+
+if settings.metrics.server_timing:
+    app.add_middleware(timing.ServerTimingMiddleware)  # type: ignore[arg-type]
+
+if settings.debug.admin_token:
+    app.add_middleware(debug.ProfilerMiddleware)  # type: ignore[arg-type]
+
+app.add_middleware(logger.RequestIdMiddleware)  # type: ignore[arg-type]
+
 if settings.web.enabled:
 
     @app.get('/endpoints', tags=['web'])
@@ -62,12 +104,17 @@ if settings.web.enabled:
 @app.exception_handler(RequestValidationError)
 @app.exception_handler(HTTPException)
 @app.exception_handler(ACMEException)
+@app.exception_handler(admission.Overloaded)
 @app.exception_handler(Exception)
-async def acme_exception_handler(request: Request, exc: Exception):
+async def acme_exception_handler(request: Request, exc: Exception):  # pylint: disable=too-many-return-statements
     # custom exception handler for acme specific response format
     if request.url.path.startswith('/acme/') or isinstance(exc, ACMEException):
         if isinstance(exc, ACMEException):
             return await exc.as_response()
+        elif isinstance(exc, admission.Overloaded):
+            return await ACMEException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, exctype='serverInternal', detail=str(exc), headers={'Retry-After': str(exc.retry_after)}
+            ).as_response()
         elif isinstance(exc, ValidationError):
             return await ACMEException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, exctype='malformed', detail=exc.json()).as_response()
         elif isinstance(exc, HTTPException):
@@ -77,6 +124,10 @@ async def acme_exception_handler(request: Request, exc: Exception):
     else:
         if isinstance(exc, HTTPException):
             return await http_exception_handler(request, exc)
+        elif isinstance(exc, RequestValidationError):
+            return await request_validation_exception_handler(request, exc)
+        elif isinstance(exc, admission.Overloaded):
+            return JSONResponse({'detail': str(exc)}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(exc.retry_after)})
         else:
             return JSONResponse({'detail': str(exc)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -85,6 +136,12 @@ app.include_router(acme.router)
 app.include_router(acme.directory_router.api)  # serve acme directory under /acme/directory and /directory
 app.include_router(ca.router)
 
+if settings.metrics.enabled:
+    app.include_router(metrics.router)
+
+if settings.debug.admin_token:
+    app.include_router(debug.router)
+
 if settings.web.enabled:
     app.include_router(web.router)
 
@@ -0,0 +1,76 @@
+import time
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# buckets for fast operations like database queries or signature checks (seconds)
+_FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+http_requests = Counter('acme_http_requests', 'HTTP requests by route handler', ['method', 'handler', 'status'])
+http_request_duration = Histogram('acme_http_request_duration_seconds', 'HTTP request duration by route handler', ['method', 'handler'])
+
+jws_verification_duration = Histogram('acme_jws_verification_duration_seconds', 'JWS signature verification duration', buckets=_FAST_BUCKETS)
+nonces = Counter('acme_nonces', 'Replay nonces by event', ['event'])  # event: issued, consumed, rejected
+nonce_reservoir_refilled = Counter('acme_nonce_reservoir_refilled', 'Nonces minted in batches into the in-process reservoir')
+nonce_reservoir_size = Gauge('acme_nonce_reservoir_size', 'Stored nonces waiting in the in-process reservoir')
+coalesced_requests = Counter('acme_coalesced_requests', 'Requests which shared the execution of a concurrent identical request', ['handler'])  # handler: finalize, challenge
+certificate_cache = Counter('acme_certificate_cache', 'Certificate chain lookups by whether they were served from the in-process cache', ['result'])  # result: hit, miss
+rate_limited = Counter('acme_rate_limited', 'Requests rejected by the rate limiter', ['scope'])  # scope: ip, account, domain
+challenge_validation_duration = Histogram('acme_challenge_validation_duration_seconds', 'HTTP-01 challenge validation duration by outcome', ['outcome'])
+
+db_acquire_duration = Histogram('db_pool_acquire_duration_seconds', 'Wait time to acquire a database connection from the pool', buckets=_FAST_BUCKETS)
+db_transaction_duration = Histogram('db_transaction_duration_seconds', 'Database transaction duration', ['readonly'], buckets=_FAST_BUCKETS)
+db_transaction_rollbacks = Counter('db_transaction_rollbacks', 'Rolled back database transactions')
+db_pool_connections = Gauge('db_pool_connections', 'Database pool connections by state', ['state'])  # state: total, idle, max
+
+admission_limit = Gauge('admission_limit', 'Current concurrency limit by stage', ['stage'])  # stage: database, signing, challenge
+admission_in_flight = Gauge('admission_in_flight', 'Admitted requests by stage', ['stage'])
+admission_wait_duration = Histogram('admission_wait_duration_seconds', 'Queue wait for a free slot by stage', ['stage'], buckets=_FAST_BUCKETS)
+admission_rejected = Counter('admission_rejected', 'Requests rejected because the wait budget was exceeded by stage', ['stage'])
+
+ca_sign_csr_duration = Histogram('ca_sign_csr_duration_seconds', 'Certificate signing duration')
+ca_build_crl_duration = Histogram('ca_build_crl_duration_seconds', 'Certificate revocation list build duration')
+ca_crl_size = Gauge('ca_crl_size_bytes', 'Size of the most recently built certificate revocation list (PEM)')
+ca_crl_entries = Gauge('ca_crl_entries', 'Number of revoked certificates in the most recently built certificate revocation list')
+
+mail_send_duration = Histogram('mail_send_duration_seconds', 'Mail rendering and delivery duration by template and outcome', ['template', 'outcome'])
+
+log_records_dropped = Counter('log_records_dropped', 'Log records dropped because the log queue was full')
+
+
+class MetricsMiddleware:  # pylint: disable=too-few-public-methods
+    """Count and time all HTTP requests by their route handler name (not by the requested path to keep the label cardinality low)."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            handler = getattr(scope.get('route'), 'name', None) or 'unmatched'
+            http_request_duration.labels(scope['method'], handler).observe(time.perf_counter() - start)
+            http_requests.labels(scope['method'], handler, str(status_code)).inc()
+
+
+router = APIRouter(tags=['metrics'])
+
+
+@router.get('/metrics', response_class=Response, responses={200: {'content': {CONTENT_TYPE_LATEST: {}}}})
+async def get_metrics():
+    """Prometheus metrics"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
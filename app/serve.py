@@ -0,0 +1,26 @@
+"""
+Starts the server with WORKERS processes sharing the port (pre-fork). The one-time setup (database migrations, CA import)
+runs here before the workers are started, so it does not run in every worker.
+"""
+
+import asyncio
+import os
+
+import main
+import uvicorn
+from config import settings
+
+
+async def run_setup():
+    await main.db.connect()
+    try:
+        await main.setup()
+    finally:
+        await main.db.disconnect()
+
+
+if __name__ == '__main__':
+    if settings.workers > 1:
+        asyncio.run(run_setup())
+        os.environ[main.SETUP_DONE_ENV] = 'true'
+    uvicorn.run('main:app', host='0.0.0.0', port=8080, workers=settings.workers, server_header=False)
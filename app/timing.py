@@ -0,0 +1,74 @@
+import hashlib
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# section name -> [total duration in seconds, count], None outside of a request or if Server-Timing is disabled
+_timings: ContextVar[dict[str, list] | None] = ContextVar('timings', default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w$])\d+(?:\.\d+)?\b")  # string and number literals, but not placeholders like $1
+_WHITESPACE = re.compile(r'\s+')
+
+
+def record(name: str, duration: float) -> None:
+    """add the duration (seconds) to the named section of the current request"""
+    timings = _timings.get()
+    if timings is not None:
+        entry = timings.setdefault(name, [0.0, 0])
+        entry[0] += duration
+        entry[1] += 1
+
+
+@contextmanager
+def measure(name: str) -> Iterator[None]:
+    """time the enclosed code as section of the current request"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started_at)
+
+
+def fingerprint(query: str) -> str:
+    """normalize a statement for logging: literals are replaced by "?", whitespace is collapsed and a short hash is prepended for grouping"""
+    normalized = _WHITESPACE.sub(' ', _LITERALS.sub('?', query)).strip()
+    digest = hashlib.blake2b(normalized.encode(), digest_size=4).hexdigest()
+    return f'{digest} {normalized[:200]}'
+
+
+def redact(params: tuple) -> str:
+    """describe query parameters by type only, so no secrets or personal data end up in logs"""
+    return '(' + ', '.join(f'${i}={type(param).__name__}' for i, param in enumerate(params, start=1)) + ')'
+
+
+class ServerTimingMiddleware:  # pylint: disable=too-few-public-methods
+    """Collect the timed sections of each request and report them in a Server-Timing response header."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings: dict[str, list] = {}
+        token = _timings.set(timings)
+        started_at = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                metrics = [f'{name};dur={duration * 1000:.1f};desc="{count}x"' for name, (duration, count) in timings.items()]
+                metrics.append(f'total;dur={(time.perf_counter() - started_at) * 1000:.1f}')
+                MutableHeaders(scope=message).append('Server-Timing', ', '.join(metrics))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
@@ -1,47 +1,72 @@
-from fastapi import FastAPI, Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from typing import TypeAlias
 
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):  # pylint: disable=too-few-public-methods
+_COMMON_HEADERS = {
+    'Cross-Origin-Opener-Policy': 'same-origin',
+    'Referrer-Policy': 'strict-origin-when-cross-origin',
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+    'Strict-Transport-Security': 'max-age=31536000',
+}
+
+# the names of the headers (to replace them if already set) and the headers, both encoded
+HeaderBlock: TypeAlias = tuple[frozenset[bytes], list[tuple[bytes, bytes]]]
+
+
+def _longest_prefix(policies: dict[str, str], path: str) -> str | None:
+    matches = [prefix for prefix in policies if path.startswith(prefix)]
+    return policies[max(matches, key=len)] if matches else None
+
+
+class SecurityHeadersMiddleware:  # pylint: disable=too-few-public-methods
     """Add security headers to all responses."""
 
     def __init__(
         self,
-        app: FastAPI,
+        app: ASGIApp,
         *,
         content_security_policy: dict[str, str] | None = None,
         permissions_policy: dict[str, str] | None = None,
     ) -> None:
-        super().__init__(app)
-        self.csp = content_security_policy
-        self.pp = permissions_policy
-
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        """Dispatch of the middleware.
-
-        :param request: Incoming request
-        :param call_next: Function to process the request
-        :return: Return response coming from processed request
-        """
-        headers = {
-            'Cross-Origin-Opener-Policy': 'same-origin',
-            'Referrer-Policy': 'strict-origin-when-cross-origin',
-            'X-Content-Type-Options': 'nosniff',
-            'X-Frame-Options': 'DENY',
-            'X-XSS-Protection': '1; mode=block',
-            'Strict-Transport-Security': 'max-age=31536000',
-        }
-        if self.csp:
-            matches = [path for path in self.csp.keys() if request.url.path.startswith(path)]
-            if matches:
-                best_match = sorted(matches, key=len, reverse=True)[0]
-                headers['Content-Security-Policy'] = self.csp[best_match]
-        if self.pp:
-            matches = [path for path in self.pp.keys() if request.url.path.startswith(path)]
-            if matches:
-                best_match = sorted(matches, key=len, reverse=True)[0]
-                headers['Permissions-Policy'] = self.pp[best_match]
-        response = await call_next(request)
-        response.headers.update(headers)
-
-        return response
+        self.app = app
+        csp = content_security_policy or {}
+        pp = permissions_policy or {}
+        # the encoded header block of every path prefix, the best match for a path is the one of its longest matching prefix
+        # (the longest policy prefixes of a path are also the longest policy prefixes of its longest matching prefix)
+        self.blocks: dict[str, HeaderBlock] = {prefix: self._encode(csp, pp, prefix) for prefix in csp.keys() | pp.keys()}
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.blocks}, reverse=True)
+        self.default_block = self._encode(csp, pp, None)
+
+    @staticmethod
+    def _encode(csp: dict[str, str], pp: dict[str, str], prefix: str | None) -> HeaderBlock:
+        headers = dict(_COMMON_HEADERS)
+        if prefix is not None and (policy := _longest_prefix(csp, prefix)):
+            headers['Content-Security-Policy'] = policy
+        if prefix is not None and (policy := _longest_prefix(pp, prefix)):
+            headers['Permissions-Policy'] = policy
+        encoded = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+        return frozenset(name for name, _ in encoded), encoded
+
+    def lookup(self, path: str) -> HeaderBlock:
+        """the header block of the longest prefix matching the path"""
+        for length in self.prefix_lengths:
+            if (block := self.blocks.get(path[:length])) is not None:
+                return block
+        return self.default_block
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        names, headers = self.lookup(scope['path'])
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                # replace headers already set by the app
+                message['headers'] = [header for header in message.get('headers', ()) if header[0].lower() not in names] + headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,14 +1,26 @@
+import csv
+import io
+import json
+from datetime import datetime
+from functools import cache
 from pathlib import Path
-from typing import Literal
+from typing import AsyncIterator, Literal
 
 import db
+from acme.certificate.service import load_chain
 from config import settings
-from fastapi import APIRouter, HTTPException, Response, status
-from fastapi.responses import HTMLResponse
-from jinja2 import Environment, FileSystemLoader
+from fastapi import APIRouter, HTTPException, Request, Response, status
+from fastapi.responses import HTMLResponse, StreamingResponse
+from headers import accepts_encoding, etag_matches
 from pydantic import constr
 
-template_engine = Environment(loader=FileSystemLoader(Path(__file__).parent / 'templates'), enable_async=True, autoescape=True)
+
+@cache
+def template_engine():
+    from jinja2 import Environment, FileSystemLoader  # pylint: disable=import-outside-toplevel  # imported on first use to start faster
+
+    return Environment(loader=FileSystemLoader(Path(__file__).parent / 'templates'), enable_async=True, autoescape=True)
+
 
 default_params = {  # pylint: disable=duplicate-code
     'app_title': settings.web.app_title,
@@ -17,83 +29,202 @@ default_params = {  # pylint: disable=duplicate-code
     'acme_url': str(settings.external_url).removesuffix('/') + '/acme/directory',
 }
 
+EXPORT_BATCH_SIZE = 1000  # certificates per transaction of the inventory export
+
+
+async def fetch_log_page(key: str, query: str, *args) -> tuple[list, str | None]:
+    """
+    Rows of a web log page and the value of the key column to pass as `after` for the next page (None on the last page).
+    The transaction is closed before the page is rendered, so slow clients do not hold a database connection.
+    """
+    async with db.transaction(readonly=True) as sql:
+        records = [record async for record in sql(query, *args, settings.web.log_page_size + 1)]  # one more row to know whether there is a next page
+    if len(records) > settings.web.log_page_size:
+        return records[: settings.web.log_page_size], records[settings.web.log_page_size - 1][key]
+    return records, None
+
+
+async def render_stream(template_name: str, **params) -> AsyncIterator[str]:
+    buffer: list[str] = []
+    size = 0
+    async for chunk in template_engine().get_template(template_name).generate_async(**default_params, **params):
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= 16 * 1024:  # jinja yields many tiny chunks, send them in bigger blocks
+            yield ''.join(buffer)
+            buffer.clear()
+            size = 0
+    yield ''.join(buffer)
+
 
 api = APIRouter(tags=['web'])
 
 
 @api.get('/', response_class=HTMLResponse)
 async def index():
-    return await template_engine.get_template('index.html').render_async(**default_params)
+    return await template_engine().get_template('index.html').render_async(**default_params)
 
 
 if settings.web.enable_public_log:
 
     @api.get('/certificates', response_class=HTMLResponse)
-    async def certificate_log(domainfilter: str = '', certstatus: Literal['all', 'valid', 'invalid'] = 'all'):
-        async with db.transaction(readonly=True) as sql:
-            certs = [
-                record
-                async for record in sql(
-                    """
-                    with data as (
-                        select
-                            serial_number, not_valid_before, not_valid_after, revoked_at,
-                            (not_valid_after > now() and revoked_at is null) as is_valid,
-                            (not_valid_after - not_valid_before) as lifetime,
-                            (now() - not_valid_before) as age,
-                            array_agg(domain order by domain) as domains
-                        from certificates cert
-                        join authorizations authz on authz.order_id = cert.order_id
-                        where ($1::text = '' or authz.domain ilike '%' || $1::text || '%')
-                        group by serial_number
-                    )
-                    select * from data
-                    where ($2 = 'all' or ($2 = 'valid' and is_valid) or ($2 = 'invalid' and not is_valid))
-                    order by not_valid_after desc
-                    limit 1000
-                    """,
-                    domainfilter.replace('*', '%'),
-                    certstatus,
+    async def certificate_log(
+        domainfilter: str = '',
+        certstatus: Literal['all', 'valid', 'invalid'] = 'all',
+        after: constr(pattern='^[0-9A-F]+$') | None = None,  # type: ignore[valid-type]
+    ):
+        certs, next_after = await fetch_log_page(
+            'serial_number',
+            """
+            select
+                serial_number, not_valid_before, not_valid_after, revoked_at,
+                (not_valid_after > now() and revoked_at is null) as is_valid,
+                (not_valid_after - not_valid_before) as lifetime,
+                (now() - not_valid_before) as age,
+                (select array_agg(domain order by domain) from authorizations authz where authz.order_id = cert.order_id) as domains
+            from certificates cert
+            where ($1::text = '' or exists (
+                    select from authorizations authz where authz.order_id = cert.order_id and authz.domain ilike '%' || $1::text || '%'
+                ))
+                and (
+                    $2 = 'all'
+                    or ($2 = 'valid' and not_valid_after > now() and revoked_at is null)
+                    or ($2 = 'invalid' and (not_valid_after <= now() or revoked_at is not null))
                 )
-            ]
-        return await template_engine.get_template('cert-log.html').render_async(**default_params, certs=certs, certstatus=certstatus, domainfilter=domainfilter)
+                and ($3::text is null or (not_valid_after, serial_number) < (select not_valid_after, serial_number from certificates where serial_number = $3::text))
+            order by not_valid_after desc, serial_number desc
+            limit $4
+            """,
+            domainfilter.replace('*', '%'),
+            certstatus,
+            after,
+        )
+        return StreamingResponse(
+            render_stream('cert-log.html', certs=certs, certstatus=certstatus, domainfilter=domainfilter, next_after=next_after),
+            media_type='text/html',
+        )
+
+    @api.get(
+        '/certificates/export',
+        response_class=StreamingResponse,
+        responses={200: {'content': {'application/x-ndjson': {}, 'text/csv': {}}}},
+    )
+    async def export_certificates(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        format: Literal['ndjson', 'csv'] = 'ndjson',  # noqa: A002 (allow shadowing builtin "format")  # pylint: disable=redefined-builtin
+        domainfilter: str = '',
+        certstatus: Literal['all', 'valid', 'revoked', 'expired'] = 'all',
+        valid_from: datetime | None = None,
+        valid_to: datetime | None = None,
+    ):
+        """
+        Export all issued certificates matching the filters. `valid_from` and `valid_to` select certificates being valid at any time within this window.
+        Rows are fetched in batches ordered by serial number, each in its own short transaction, so memory usage is constant
+        regardless of the number of certificates and slow clients do not hold a database connection.
+        """
+        columns = ['serial_number', 'status', 'not_valid_before', 'not_valid_after', 'revoked_at', 'domains']
+
+        async def rows():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if format == 'csv':
+                writer.writerow(columns)
+            after = None
+            while True:
+                async with db.transaction(readonly=True) as sql:
+                    records = [
+                        record
+                        async for record in sql(
+                            """
+                            select
+                                serial_number,
+                                case when revoked_at is not null then 'revoked' when not_valid_after <= now() then 'expired' else 'valid' end as status,
+                                not_valid_before, not_valid_after, revoked_at,
+                                (select array_agg(domain order by domain) from authorizations authz where authz.order_id = cert.order_id) as domains
+                            from certificates cert
+                            where ($1::text = '' or exists (
+                                    select from authorizations authz where authz.order_id = cert.order_id and authz.domain ilike '%' || $1::text || '%'
+                                ))
+                                and (
+                                    $2 = 'all'
+                                    or ($2 = 'valid' and not_valid_after > now() and revoked_at is null)
+                                    or ($2 = 'revoked' and revoked_at is not null)
+                                    or ($2 = 'expired' and not_valid_after <= now() and revoked_at is null)
+                                )
+                                and ($3::timestamptz is null or not_valid_after >= $3::timestamptz)
+                                and ($4::timestamptz is null or not_valid_before <= $4::timestamptz)
+                                and ($5::text is null or serial_number > $5::text)
+                            order by serial_number
+                            limit $6
+                            """,
+                            domainfilter.replace('*', '%'),
+                            certstatus,
+                            valid_from,
+                            valid_to,
+                            after,
+                            EXPORT_BATCH_SIZE,
+                        )
+                    ]
+                for record in records:
+                    values = [v.isoformat() if isinstance(v, datetime) else v for v in record.values()]
+                    if format == 'csv':
+                        writer.writerow(values[:-1] + [' '.join(values[-1])])
+                    else:
+                        buffer.write(json.dumps(dict(zip(columns, values))) + '\n')
+                    if buffer.tell() >= 64 * 1024:  # flush in chunks instead of per row
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                if len(records) < EXPORT_BATCH_SIZE:
+                    break
+                after = records[-1]['serial_number']
+            yield buffer.getvalue()
+
+        return StreamingResponse(
+            rows(),
+            media_type='text/csv' if format == 'csv' else 'application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename="certificates.{format}"'},
+        )
 
     @api.get('/certificates/{serial_number}', response_class=Response, responses={200: {'content': {'application/pem-certificate-chain': {}}}})
-    async def download_certificate(serial_number: constr(pattern='^[0-9A-F]+$')):  # type: ignore[valid-type]
-        async with db.transaction(readonly=True) as sql:
-            pem_chain = await sql.value("""select chain_pem from certificates where serial_number = $1""", serial_number)
-        if not pem_chain:
+    async def download_certificate(request: Request, serial_number: constr(pattern='^[0-9A-F]+$')):  # type: ignore[valid-type]
+        """certificates never change, so clients and proxies may cache them forever (the ETag is unique per serial number and encoding)"""
+        chain = await load_chain(serial_number)
+        if not chain:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='unknown certificate')
-        return Response(content=pem_chain, media_type='application/pem-certificate-chain')
+        compressed = accepts_encoding(request.headers.get('Accept-Encoding', ''), 'gzip')
+        headers = {
+            'ETag': f'"{serial_number}.gz"' if compressed else f'"{serial_number}"',
+            'Cache-Control': 'public, max-age=31536000, immutable',
+            'Vary': 'Accept-Encoding',
+        }
+        if etag_matches(request.headers.get('If-None-Match', ''), headers['ETag']):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        if compressed:
+            headers['Content-Encoding'] = 'gzip'
+            return Response(content=chain.pem_gzip, headers=headers, media_type='application/pem-certificate-chain')
+        return Response(content=chain.pem, headers=headers, media_type='application/pem-certificate-chain')
 
     @api.get('/domains', response_class=HTMLResponse)
-    async def domain_log(domainfilter: str = '', domainstatus: Literal['all', 'valid', 'invalid'] = 'all'):
-        async with db.transaction(readonly=True) as sql:
-            domains = [
-                record
-                async for record in sql(
-                    """
-                    with data as (
-                        select
-                            authz.domain as domain_name,
-                            min(cert.not_valid_before) as first_requested_at,
-                            max(cert.not_valid_after) as expires_at,
-                            (max(cert.not_valid_after) FILTER (WHERE revoked_at is null)) > now() AS is_valid
-                        from orders ord
-                        join authorizations authz on authz.order_id = ord.id
-                        join certificates cert on cert.order_id = ord.id
-                        where ($1::text = '' or authz.domain ilike '%' || $1::text || '%')
-                        group by authz.domain
-                    )
-                    select * from data
-                    where ($2 = 'all' or ($2 = 'valid' and is_valid) or ($2 = 'invalid' and not is_valid))
-                    order by domain_name
-                    """,
-                    domainfilter.replace('*', '%'),
-                    domainstatus,
-                )
-            ]
-        return await template_engine.get_template('domain-log.html').render_async(**default_params, domains=domains, domainstatus=domainstatus, domainfilter=domainfilter)
+    async def domain_log(domainfilter: str = '', domainstatus: Literal['all', 'valid', 'invalid'] = 'all', after: str | None = None):
+        domains, next_after = await fetch_log_page(
+            'domain_name',
+            """
+            select domain as domain_name, first_requested_at, expires_at, coalesce(valid_until > now(), false) as is_valid
+            from domains
+            where ($1::text = '' or domain ilike '%' || $1::text || '%')
+                and ($2 = 'all' or ($2 = 'valid' and valid_until > now()) or ($2 = 'invalid' and (valid_until is null or valid_until <= now())))
+                and ($3::text is null or domain > $3::text)
+            order by domain
+            limit $4
+            """,
+            domainfilter.replace('*', '%'),
+            domainstatus,
+            after,
+        )
+        return StreamingResponse(
+            render_stream('domain-log.html', domains=domains, domainstatus=domainstatus, domainfilter=domainfilter, next_after=next_after),
+            media_type='text/html',
+        )
 else:
 
     @api.get('/certificates')
@@ -0,0 +1,220 @@
+"""
+End-to-end load test: simulated ACME clients run the full issuance flow
+(new-nonce, new-account, new-order, authorization, challenge, finalize, certificate download, revoke-cert)
+concurrently against a running server and report throughput and latency percentiles per endpoint.
+
+The HTTP-01 challenges are answered by a built-in responder, so the challenged domains must resolve to the host running this script
+(see run.sh, which uses docker network aliases for that).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+import jwcrypto.jwk
+import jwcrypto.jws
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from jwcrypto.common import base64url_encode
+
+KEY_TYPES = {
+    'rsa2048': ({'kty': 'RSA', 'size': 2048}, 'RS256'),
+    'rsa4096': ({'kty': 'RSA', 'size': 4096}, 'RS256'),
+    'ec256': ({'kty': 'EC', 'crv': 'P-256'}, 'ES256'),
+}
+
+
+class Responder:  # pylint: disable=too-few-public-methods
+    """minimal HTTP-01 responder: serves /.well-known/acme-challenge/<token> from a dict"""
+
+    def __init__(self) -> None:
+        self.key_authorizations: dict[str, str] = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():  # skip headers
+                pass
+            parts = request_line.decode().split(' ')
+            token = parts[1].removeprefix('/.well-known/acme-challenge/') if len(parts) > 1 else ''
+            body = self.key_authorizations.get(token)
+            if body is None:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            else:
+                writer.write(f'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n{body}'.encode())
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+class Stats:  # pylint: disable=too-few-public-methods
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.certificates = 0  # successfully downloaded certificates
+
+    def report(self, duration: float) -> dict:
+        result = {}
+        for endpoint in sorted(self.latencies.keys() | self.errors.keys()):
+            latencies = self.latencies[endpoint]
+            if not latencies:
+                result[endpoint] = {'requests': 0, 'errors': self.errors[endpoint], 'throughput': 0, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+                continue
+            quantiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+            result[endpoint] = {
+                'requests': len(latencies),
+                'errors': self.errors[endpoint],
+                'throughput': len(latencies) / duration,
+                'p50_ms': quantiles[49] * 1000,
+                'p95_ms': quantiles[94] * 1000,
+                'p99_ms': quantiles[98] * 1000,
+            }
+        return result
+
+
+class Client:  # pylint: disable=too-many-instance-attributes
+    def __init__(self, http: httpx.AsyncClient, directory: dict, stats: Stats, responder: Responder, key_type: str) -> None:
+        self.http = http
+        self.directory = directory
+        self.stats = stats
+        self.responder = responder
+        key_params, self.alg = KEY_TYPES[key_type]
+        self.jwk = jwcrypto.jwk.JWK.generate(**key_params)
+        self.kid: str | None = None
+        self.nonce: str | None = None
+
+    async def _timed(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started_at = time.perf_counter()
+        response = await self.http.request(method, url, **kwargs)
+        if response.status_code >= 400:  # failed requests (e.g. 429 or 503 under load) do not count as throughput
+            self.stats.errors[endpoint] += 1
+            raise RuntimeError(f'{endpoint}: {response.status_code} {response.text}')
+        self.stats.latencies[endpoint].append(time.perf_counter() - started_at)
+        if 'Replay-Nonce' in response.headers:
+            self.nonce = response.headers['Replay-Nonce']
+        return response
+
+    async def post(self, endpoint: str, url: str, payload: dict | str) -> httpx.Response:
+        if self.nonce is None:
+            await self._timed('new-nonce', 'HEAD', self.directory['newNonce'])
+        protected: dict = {'alg': self.alg, 'nonce': self.nonce, 'url': url}
+        if self.kid:
+            protected['kid'] = self.kid
+        else:
+            protected['jwk'] = self.jwk.export_public(as_dict=True)
+        jws = jwcrypto.jws.JWS('' if payload == '' else json.dumps(payload))
+        jws.add_signature(self.jwk, protected=protected)
+        self.nonce = None
+        return await self._timed(endpoint, 'POST', url, content=jws.serialize(), headers={'Content-Type': 'application/jose+json'})
+
+    async def register(self, mail: str):
+        response = await self.post('new-account', self.directory['newAccount'], {'contact': [f'mailto:{mail}'], 'termsOfServiceAgreed': True})
+        self.kid = response.headers['Location']
+
+    async def issue_and_revoke(self, domain: str):
+        response = await self.post('new-order', self.directory['newOrder'], {'identifiers': [{'type': 'dns', 'value': domain}]})
+        order_url = response.headers['Location']
+        order = response.json()
+
+        for authz_url in order['authorizations']:
+            authz = (await self.post('authorization', authz_url, '')).json()
+            challenge = next(chal for chal in authz['challenges'] if chal['type'] == 'http-01')
+            self.responder.key_authorizations[challenge['token']] = f'{challenge["token"]}.{self.jwk.thumbprint()}'
+            try:
+                await self.post('challenge', challenge['url'], {})
+            finally:
+                self.responder.key_authorizations.pop(challenge['token'], None)
+
+        csr_key = ec.generate_private_key(ec.SECP256R1())
+        csr = (
+            x509.CertificateSigningRequestBuilder()
+            .subject_name(x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, domain)]))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName(domain)]), critical=False)
+            .sign(csr_key, hashes.SHA256())
+        )
+        order = (await self.post('finalize', order['finalize'], {'csr': base64url_encode(csr.public_bytes(serialization.Encoding.DER))})).json()
+        while order['status'] == 'processing':
+            await asyncio.sleep(0.1)
+            order = (await self.post('order', order_url, '')).json()
+
+        chain_pem = (await self.post('certificate', order['certificate'], '')).content
+        cert = x509.load_pem_x509_certificate(chain_pem)
+        self.stats.certificates += 1
+        await self.post('revoke-cert', self.directory['revokeCert'], {'certificate': base64url_encode(cert.public_bytes(serialization.Encoding.DER))})
+
+
+def parse_key_mix(value: str) -> dict[str, float]:
+    """e.g. "ec256=3,rsa2048=1" -> 75% EC P-256 and 25% RSA 2048 keys"""
+    mix = {}
+    for part in value.split(','):
+        key_type, _, weight = part.partition('=')
+        if key_type not in KEY_TYPES:
+            raise argparse.ArgumentTypeError(f'unknown key type {key_type}, use one of: {", ".join(KEY_TYPES)}')
+        mix[key_type] = float(weight or 1)
+    return mix
+
+
+async def run(args: argparse.Namespace) -> dict:
+    responder = Responder()
+    server = await asyncio.start_server(responder.handle, host='0.0.0.0', port=args.responder_port)  # must be reachable by the acme server
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.clients)
+    async with server, httpx.AsyncClient(timeout=60, limits=limits) as http:
+        directory = (await http.get(args.url)).json()
+        key_types = random.choices(list(args.key_mix), weights=list(args.key_mix.values()), k=args.clients)
+        clients = [Client(http, directory, stats, responder, key_type) for key_type in key_types]
+
+        async def simulate(client_no: int, client: Client):
+            try:
+                await client.register(f'client{client_no}@example.org')
+                for iteration in range(args.iterations):
+                    await client.issue_and_revoke(args.domain.format(client=client_no, iteration=iteration))
+            except (RuntimeError, httpx.HTTPError) as exc:
+                print(f'client {client_no} aborted: {exc}', file=sys.stderr)
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(simulate(client_no, client) for client_no, client in enumerate(clients)))
+        duration = time.perf_counter() - started_at
+
+    return {
+        'duration_s': duration,
+        'clients': args.clients,
+        'iterations': args.iterations,
+        'certificates': stats.certificates,
+        'certificates_per_s': stats.certificates / duration,
+        'endpoints': stats.report(duration),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8080/acme/directory', help='ACME directory url')
+    parser.add_argument('--clients', type=int, default=20, help='number of concurrent clients (each with its own account)')
+    parser.add_argument('--iterations', type=int, default=5, help='certificates issued and revoked per client')
+    parser.add_argument('--key-mix', type=parse_key_mix, default='ec256=3,rsa2048=1', help='weighted account key types: ' + ', '.join(KEY_TYPES))
+    parser.add_argument('--domain', default='responder.example.org', help='challenged domain, resolving to this host, may contain {client} and {iteration}')
+    parser.add_argument('--responder-port', type=int, default=80, help='port of the HTTP-01 responder')
+    parser.add_argument('--json', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    print(f'{result["certificates_per_s"]:.2f} certificates/s ({args.clients} clients x {args.iterations} iterations in {result["duration_s"]:.1f}s)')
+    print(f'{"endpoint":<15}{"requests":>10}{"errors":>8}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for endpoint, row in result['endpoints'].items():
+        latencies = ''.join(f'{"-" if row[p] is None else f"{row[p]:.1f}":>10}' for p in ('p50_ms', 'p95_ms', 'p99_ms'))
+        print(f'{endpoint:<15}{row["requests"]:>10}{row["errors"]:>8}{row["throughput"]:>10.1f}{latencies}')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
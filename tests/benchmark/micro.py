@@ -0,0 +1,245 @@
+"""
+Micro benchmarks of the crypto hot paths: certificate signing, CRL building, CSR checks, CA loading and JWS verification
+for different CA and account key types, and of the per-request overhead of the security headers middleware and the ACME response rendering.
+
+Results are printed and can be written as JSON (--json). Given a baseline JSON file of an earlier run (--baseline),
+every benchmark that got slower than the tolerance is reported and the exit code is 1.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+# the app settings are read on import, no database connection is made
+os.environ.setdefault('external_url', 'http://localhost:8000/')
+os.environ.setdefault('db_dsn', 'postgresql://postgres@localhost/postgres')
+os.environ.setdefault('ca_encryption_key', 'M8L6RSYPiHHr6GogXmkQIs7gVia_K5fDDJiNK7zUt0k=')
+sys.path.insert(0, str(Path(__file__).parents[2] / 'app'))
+
+# pylint: disable=wrong-import-position
+import jwcrypto.jwk  # noqa: E402
+import jwcrypto.jws  # noqa: E402
+from acme import ACMEResponse, middleware  # noqa: E402
+from acme.certificate.service import check_csr  # noqa: E402
+from acme.order.router import NewOrderPayload, order_response  # noqa: E402
+from ca.service import build_crl_sync, generate_cert_sync, load_ca_sync  # noqa: E402
+from config import settings  # noqa: E402
+from cryptography import x509  # noqa: E402
+from cryptography.fernet import Fernet  # noqa: E402
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ec, rsa  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from web.middleware import SecurityHeadersMiddleware  # noqa: E402
+
+CA_KEY_TYPES = {
+    'rsa2048': lambda: rsa.generate_private_key(65537, 2048),
+    'rsa4096': lambda: rsa.generate_private_key(65537, 4096),
+    'ec256': lambda: ec.generate_private_key(ec.SECP256R1()),
+    'ec384': lambda: ec.generate_private_key(ec.SECP384R1()),
+}
+
+ACCOUNT_KEY_TYPES = {  # the key types accepted by SignedRequest
+    'rsa2048': ({'kty': 'RSA', 'size': 2048}, 'RS256'),
+    'rsa4096': ({'kty': 'RSA', 'size': 4096}, 'RS256'),
+    'ec256': ({'kty': 'EC', 'crv': 'P-256'}, 'ES256'),
+}
+
+
+def measure(func: Callable[[], object], *, min_time: float, repeat: int) -> dict:
+    """call func in batches which take at least min_time seconds, returns the seconds per call of all batches"""
+    func()  # warmup
+    number = 1
+    while True:
+        started_at = time.perf_counter()
+        for _ in range(number):
+            func()
+        duration = time.perf_counter() - started_at
+        if duration >= min_time:
+            break
+        number *= 10 if duration < min_time / 10 else 2
+    timings = [duration / number]
+    for _ in range(repeat - 1 if duration < 10 else 0):  # do not repeat benchmarks running for ages
+        started_at = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - started_at) / number)
+    return {'calls': number * len(timings), 'min_s': min(timings), 'median_s': statistics.median(timings)}
+
+
+def build_ca(key_type: str) -> tuple[x509.Certificate, object]:
+    ca_key = CA_KEY_TYPES[key_type]()
+    name = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, f'Benchmark CA {key_type}')])
+    now = datetime.now(timezone.utc)
+    ca_cert = (
+        x509.CertificateBuilder(issuer_name=name, subject_name=name, serial_number=x509.random_serial_number(), not_valid_before=now, not_valid_after=now + timedelta(days=1))
+        .public_key(ca_key.public_key())
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(ca_key, hashes.SHA256())
+    )
+    return ca_cert, ca_key
+
+
+def build_csr(domains: list[str]) -> x509.CertificateSigningRequest:
+    return (
+        x509.CertificateSigningRequestBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, domains[0])]))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(domain) for domain in domains]), critical=False)
+        .sign(ec.generate_private_key(ec.SECP256R1()), hashes.SHA256())
+    )
+
+
+async def new_nonce_app(scope, receive, send):  # pylint: disable=unused-argument
+    """an ASGI app responding like /acme/new-nonce, without the database roundtrip"""
+    headers = [(b'replay-nonce', b'x' * 43), (b'cache-control', b'no-store'), (b'link', b'<http://localhost:8000/acme/directory>;rel="index"')]
+    await send({'type': 'http.response.start', 'status': 204, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def order_poll_app() -> FastAPI:
+    """an app responding like a polled order of the ACME router, without the signature check and database roundtrip"""
+    app = FastAPI()
+    now = datetime.now(timezone.utc)
+
+    @app.post('/acme/orders/{order_id}', response_class=ACMEResponse)
+    async def view_order(order_id: str) -> dict[str, Any]:
+        return order_response(
+            status='valid',
+            expires_at=now,
+            domains=['host1.example.org', 'host2.example.org'],
+            authz_ids=['a' * 22, 'b' * 22],
+            order_id=order_id,
+            not_valid_before=now,
+            not_valid_after=now,
+            cert_serial_number='1A2B3C4D',
+        )
+
+    return app
+
+
+def asgi_request(loop: asyncio.AbstractEventLoop, app, path: str, method: str = 'GET') -> None:
+    scope = {'type': 'http', 'method': method, 'path': path, 'headers': [], 'query_string': b''}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(_):
+        pass
+
+    loop.run_until_complete(app(scope, receive, send))
+
+
+NEW_ORDER_REQUEST = middleware.SignedRequest(NewOrderPayload)
+
+
+def decode_and_verify(body: str, key: jwcrypto.jwk.JWK) -> object:
+    """the same decoding and verification steps as in SignedRequest (the body is parsed by FastAPI there)"""
+    # pylint: disable=protected-access
+    jws = middleware.FlattenedJws.model_validate_json(body)
+    protected = middleware.Protected.model_validate_json(middleware._decode(jws.protected, 'protected header'))
+    middleware._SIGNING_ALGS[protected.alg].verify(key, f'{jws.protected}.{jws.payload}'.encode(), middleware._decode(jws.signature, 'signature'))
+    return NEW_ORDER_REQUEST.payload_adapter.validate_json(middleware._decode(jws.payload, 'payload'))  # type: ignore[union-attr]
+
+
+def benchmarks(crl_sizes: list[int]):  # pylint: disable=too-many-locals
+    """yields (name, func) of all benchmarks"""
+    csr = build_csr(['host1.example.org', 'host2.example.org'])
+    revoked_at = datetime.now(timezone.utc)
+
+    for ca_key_type in CA_KEY_TYPES:
+        ca_cert, ca_key = build_ca(ca_key_type)
+
+        yield (
+            f'generate_cert_sync[{ca_key_type}]',
+            lambda ca_cert=ca_cert, ca_key=ca_key: generate_cert_sync(
+                ca_key=ca_key, ca_cert=ca_cert, csr=csr, subject_domain='host1.example.org', san_domains=['host1.example.org', 'host2.example.org']
+            ),
+        )
+
+        for crl_size in crl_sizes:
+            revocations = {(f'{serial:X}', revoked_at) for serial in range(1, crl_size + 1)}
+            yield (
+                f'build_crl_sync[{ca_key_type}-{crl_size}]',
+                lambda ca_cert=ca_cert, ca_key=ca_key, revocations=revocations: build_crl_sync(ca_key=ca_key, ca_cert=ca_cert, revocations=revocations),
+            )
+
+        cert_pem = ca_cert.public_bytes(serialization.Encoding.PEM).decode()
+        key_pem_enc = Fernet(settings.ca.encryption_key.get_secret_value()).encrypt(
+            ca_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+        )
+        yield f'load_ca_sync[{ca_key_type}]', lambda cert_pem=cert_pem, key_pem_enc=key_pem_enc: load_ca_sync(cert_pem=cert_pem, key_pem_enc=key_pem_enc)
+
+    loop = asyncio.new_event_loop()
+    for domain_count in (1, 100):
+        domains = [f'host{i}.example.org' for i in range(domain_count)]
+        csr_der = build_csr(domains).public_bytes(serialization.Encoding.DER)
+        yield f'check_csr[{domain_count}-domains]', lambda csr_der=csr_der, domains=domains: loop.run_until_complete(check_csr(csr_der, ordered_domains=domains))
+
+    # the same policies as in main.py, compare both results for the overhead per request
+    security_headers = SecurityHeadersMiddleware(
+        new_nonce_app,
+        content_security_policy={'/acme/': "default-src 'none';", '/endpoints': "default-src 'self';", '/': "default-src 'self';"},
+    )
+    yield 'asgi_new_nonce[bare]', lambda: asgi_request(loop, new_nonce_app, '/acme/new-nonce')
+    yield 'asgi_new_nonce[security_headers]', lambda: asgi_request(loop, security_headers, '/acme/new-nonce')
+    order_poll = order_poll_app()
+    yield 'asgi_order_poll', lambda: asgi_request(loop, order_poll, '/acme/orders/' + 'o' * 22, method='POST')
+
+    for account_key_type, (key_params, alg) in ACCOUNT_KEY_TYPES.items():
+        key = jwcrypto.jwk.JWK.generate(**key_params)  # pylint: disable=not-a-mapping
+        public_key = jwcrypto.jwk.JWK(**key.export_public(as_dict=True))
+        jws = jwcrypto.jws.JWS(json.dumps({'identifiers': [{'type': 'dns', 'value': 'host1.example.org'}]}))
+        jws.add_signature(key, protected={'alg': alg, 'nonce': 'x' * 43, 'url': 'http://localhost:8000/acme/new-order', 'kid': 'http://localhost:8000/acme/accounts/x'})
+        body = jws.serialize()
+        yield f'jws_verify[{account_key_type}]', lambda body=body, public_key=public_key: decode_and_verify(body, public_key)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result['median_s'] / baseline[name]['median_s']
+            if ratio > 1 + tolerance:
+                regressions.append(f'{name}: {ratio:.2f}x slower ({baseline[name]["median_s"] * 1000:.3f}ms -> {result["median_s"] * 1000:.3f}ms)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--crl-sizes', type=lambda value: [int(size) for size in value.split(',')], default=[10, 10_000], help='revocations per CRL, e.g. 10,10000,1000000')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per measurement')
+    parser.add_argument('--repeat', type=int, default=5, help='measurements per benchmark')
+    parser.add_argument('--json', help='write the results as JSON to this file (can be used as baseline)')
+    parser.add_argument('--baseline', help='compare against the results JSON of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown compared to the baseline, e.g. 0.2 for 20%%')
+    args = parser.parse_args()
+
+    results = {}
+    for name, func in benchmarks(args.crl_sizes):
+        if args.filter in name:
+            results[name] = measure(func, min_time=args.min_time, repeat=args.repeat)
+            print(f'{name:<40}{results[name]["median_s"] * 1000:>12.3f}ms  (min {results[name]["min_s"] * 1000:.3f}ms, {results[name]["calls"]} calls)', flush=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
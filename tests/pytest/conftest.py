@@ -7,6 +7,7 @@ from pathlib import Path
 from typing import Generator
 
 import jwcrypto.jwk
+import jwcrypto.jws
 import pytest
 from fastapi.testclient import TestClient
 
@@ -17,6 +18,10 @@ def testclient() -> Generator[TestClient, None, None]:
     os.environ['external_url'] = 'http://localhost:8000/'
     os.environ['acme_mail_required'] = 'False'
     os.environ['WEB_ENABLE_PUBLIC_LOG'] = 'True'
+    os.environ['METRICS_ENABLED'] = 'True'
+    os.environ['METRICS_SERVER_TIMING'] = 'True'
+    os.environ['DEBUG_ADMIN_TOKEN'] = 'admin-secret'
+    os.environ['DEBUG_LOOP_LAG_THRESHOLD'] = 'PT1S'
 
     ca_dir = Path(__file__).parent / 'import-ca'
     os.environ['ca_import_dir'] = str(ca_dir)
@@ -33,6 +38,7 @@ def testclient() -> Generator[TestClient, None, None]:
     # cronjobs are disabled because they would keep the test run going even if all tests are done
     main.ca.cronjob.start = noop
     main.acme.start_cronjobs = noop
+    main.acme.start_worker_cronjobs = noop
 
     with TestClient(main.app) as tc:
         yield tc
@@ -93,4 +99,16 @@ def db():
 
             return asyncio.run(do())
 
+        @staticmethod
+        def execute(*args):
+            import config
+
+            async def do():
+                connection = await asyncpg.connect(str(config.settings.db_dsn))
+                result = await connection.execute(*args)
+                await connection.close()
+                return result
+
+            return asyncio.run(do())
+
     return DbConnector()
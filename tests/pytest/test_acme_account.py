@@ -157,3 +157,71 @@ def test_should_show_account_orders(signed_request, directory):
     assert response.status_code == 200
     assert len(response.json()['orders']) == 1
     assert response.json()['orders'][0].startswith('http://localhost:8000/acme/orders/'), response.json()
+
+
+@pytest.mark.parametrize('key_params', [{'kty': 'EC', 'crv': 'P-256'}, {'kty': 'RSA', 'size': 2048}])
+def test_should_store_jwk_thumbprint(testclient, directory, db, key_params):
+    import json
+
+    import jwcrypto.jwk
+    import jwcrypto.jws
+
+    jwk = jwcrypto.jwk.JWK.generate(**key_params)
+    nonce = testclient.head(directory['newNonce']).headers['Replay-Nonce']
+    jws = jwcrypto.jws.JWS(json.dumps({'contact': [_mail_address]}))
+    jws.add_signature(
+        jwk, protected={'alg': 'ES256' if key_params['kty'] == 'EC' else 'RS256', 'nonce': nonce, 'url': directory['newAccount'], 'jwk': jwk.export_public(as_dict=True)}
+    )
+    response = testclient.post(directory['newAccount'], content=jws.serialize(), headers={'Content-Type': 'application/jose+json'})
+    assert response.status_code == 201, response.text
+
+    account_id = response.headers['Location'].split('/')[-1]
+    stored = db.fetch_row('select jwk_thumbprint, jwk_thumbprint(jwk) as migrated_thumbprint from accounts where id = $1', account_id)
+    assert stored['jwk_thumbprint'] == jwk.thumbprint()
+    assert stored['migrated_thumbprint'] == jwk.thumbprint()  # the migration of existing accounts computes the same thumbprint
+
+
+def test_should_paginate_orders(signed_request, directory, monkeypatch):
+    import config
+
+    monkeypatch.setattr(config.settings.acme, 'orders_page_size', 2)
+
+    response = signed_request(directory['newAccount'], signed_request.nonce, {'contact': [_mail_address]})
+    account_url = response.headers['Location']
+    nonce = response.headers['Replay-Nonce']
+    order_urls = []
+    for i in range(3):
+        response = signed_request(directory['newOrder'], nonce, {'identifiers': [{'type': 'dns', 'value': f'host{i}.example.org'}]}, account_url)
+        order_urls.append(response.headers['Location'])
+        nonce = response.headers['Replay-Nonce']
+
+    response = signed_request(account_url + '/orders', nonce, '', account_url)
+    assert response.status_code == 200, response.text
+    assert response.json()['orders'] == order_urls[:2]
+    next_links = [link for link in response.headers.get_list('Link') if link.endswith('rel="next"')]
+    assert next_links == [f'<{account_url}/orders?cursor={order_urls[1].split("/")[-1]}>;rel="next"']
+
+    response = signed_request(next_links[0][1:].split('>')[0], response.headers['Replay-Nonce'], '', account_url)
+    assert response.status_code == 200, response.text
+    assert response.json()['orders'] == order_urls[2:]
+    assert not [link for link in response.headers.get_list('Link') if link.endswith('rel="next"')]
+
+    response = signed_request(account_url + '/orders?cursor=unknown-order-cursor-000', response.headers['Replay-Nonce'], '', account_url)
+    assert response.status_code == 400, response.text
+    assert response.json()['type'] == 'urn:ietf:params:acme:error:malformed'
+
+
+def test_should_reject_unknown_critical_header(testclient, directory, account_jwk):
+    import json
+
+    import jwcrypto.jwa
+    from jwcrypto.common import base64url_encode
+
+    nonce = testclient.head(directory['newNonce']).headers['Replay-Nonce']
+    protected = {'alg': 'ES256', 'nonce': nonce, 'url': directory['newAccount'], 'jwk': account_jwk.export_public(as_dict=True), 'crit': ['exp'], 'exp': 1}
+    protected_b64, payload_b64 = base64url_encode(json.dumps(protected)), base64url_encode('{}')
+    signature = jwcrypto.jwa.JWA.signing_alg('ES256').sign(account_jwk, f'{protected_b64}.{payload_b64}'.encode())  # jwcrypto refuses unknown crit headers
+    content = json.dumps({'protected': protected_b64, 'payload': payload_b64, 'signature': base64url_encode(signature)})
+    response = testclient.post(directory['newAccount'], content=content, headers={'Content-Type': 'application/jose+json'})
+    assert response.status_code == 400, response.text
+    assert response.json()['type'] == 'urn:ietf:params:acme:error:malformed'
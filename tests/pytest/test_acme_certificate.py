@@ -1,3 +1,4 @@
+from datetime import datetime
 from unittest import mock
 
 import httpx
@@ -11,7 +12,7 @@ _mail_address = 'mailto:dummy@example.com'
 _host = 'example.com'
 
 
-def test_should_revoke_certificate(signed_request, directory):
+def test_should_revoke_certificate(signed_request, directory, db):
     response = signed_request(directory['newAccount'], signed_request.nonce, {'contact': [_mail_address]})
     account_id = response.headers['Location']
 
@@ -44,6 +45,9 @@ def test_should_revoke_certificate(signed_request, directory):
     assert signed_cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value == _host
     assert signed_cert.public_key() == csr.public_key()
 
+    domain_summary = db.fetch_row('select expires_at, valid_until from domains where domain = $1', _host)
+    assert domain_summary['expires_at'] == domain_summary['valid_until'] == signed_cert.not_valid_after_utc
+
     response = signed_request(
         directory['revokeCert'], response.headers['Replay-Nonce'], {'certificate': jwcrypto.common.base64url_encode(signed_cert.public_bytes(Encoding.DER))}, account_id
     )
@@ -56,3 +60,182 @@ def test_should_revoke_certificate(signed_request, directory):
     assert response.status_code == 400
     assert response.headers['Content-Type'] == 'application/problem+json'
     assert response.json()['type'] == 'urn:ietf:params:acme:error:alreadyRevoked'
+
+    domain_summary = db.fetch_row('select expires_at, valid_until from domains where domain = $1', _host)
+    assert domain_summary['expires_at'] == signed_cert.not_valid_after_utc
+    assert domain_summary['valid_until'] is None
+
+
+def test_should_suggest_renewal_window(signed_request, directory, testclient):
+    response = signed_request(directory['newAccount'], signed_request.nonce, {'contact': [_mail_address]})
+    account_id = response.headers['Location']
+
+    response = signed_request(directory['newOrder'], response.headers['Replay-Nonce'], {'identifiers': [{'type': 'dns', 'value': _host}]}, account_id)
+    authz_url = response.json()['authorizations'][0]
+    finalize_order_url = response.json()['finalize']
+
+    response = signed_request(authz_url, response.headers['Replay-Nonce'], '', account_id)
+    challenge_token = response.json()['challenges'][0]['token']
+    challenge_url = response.json()['challenges'][0]['url']
+
+    with mock.patch(
+        'app.acme.challenge.service.httpx.AsyncClient.get',
+        return_value=httpx.Response(200, text=f'{challenge_token}.{signed_request.account_jwk.thumbprint()}'),
+    ):
+        response = signed_request(challenge_url, response.headers['Replay-Nonce'], '', account_id)
+
+    csr = build_csr([_host])
+    response = signed_request(finalize_order_url, response.headers['Replay-Nonce'], {'csr': jwcrypto.common.base64url_encode(csr.public_bytes(Encoding.DER))}, account_id)
+    response = signed_request(response.json()['certificate'], response.headers['Replay-Nonce'], {}, account_id)
+    signed_cert = x509.load_pem_x509_certificate(response.content)
+    nonce = response.headers['Replay-Nonce']
+
+    aki = signed_cert.extensions.get_extension_for_class(x509.AuthorityKeyIdentifier).value.key_identifier
+    serial = signed_cert.serial_number.to_bytes(signed_cert.serial_number.bit_length() // 8 + 1, 'big')
+    cert_id = f'{jwcrypto.common.base64url_encode(aki)}.{jwcrypto.common.base64url_encode(serial)}'
+
+    response = testclient.get(f'{directory["renewalInfo"]}/{cert_id}')
+    assert response.status_code == 200
+    assert int(response.headers['Retry-After']) > 0
+    window = response.json()['suggestedWindow']
+    start, end = datetime.fromisoformat(window['start']), datetime.fromisoformat(window['end'])
+    lifetime = signed_cert.not_valid_after_utc - signed_cert.not_valid_before_utc
+    assert signed_cert.not_valid_before_utc + lifetime / 2 <= start < end < signed_cert.not_valid_after_utc
+    assert testclient.get(f'{directory["renewalInfo"]}/{cert_id}').json()['suggestedWindow'] == window  # deterministic
+
+    assert testclient.get(f'{directory["renewalInfo"]}/{cert_id[:-2]}AQ').status_code == 404
+    foreign_issuer_cert_id = f'{jwcrypto.common.base64url_encode(bytes(20))}.{jwcrypto.common.base64url_encode(serial)}'
+    assert testclient.get(f'{directory["renewalInfo"]}/{foreign_issuer_cert_id}').status_code == 404
+    assert testclient.get(f'{directory["renewalInfo"]}/not-a-cert-id').status_code == 400
+
+    response = signed_request(directory['newOrder'], nonce, {'identifiers': [{'type': 'dns', 'value': 'other.example.com'}], 'replaces': cert_id}, account_id)
+    assert response.status_code == 400
+    assert response.json()['type'] == 'urn:ietf:params:acme:error:malformed'
+
+    response = signed_request(
+        directory['newOrder'], response.headers['Replay-Nonce'], {'identifiers': [{'type': 'dns', 'value': _host}], 'replaces': foreign_issuer_cert_id}, account_id
+    )
+    assert response.status_code == 400
+    assert response.json()['type'] == 'urn:ietf:params:acme:error:malformed'
+
+    response = signed_request(directory['newOrder'], response.headers['Replay-Nonce'], {'identifiers': [{'type': 'dns', 'value': _host}], 'replaces': cert_id}, account_id)
+    assert response.status_code == 201
+
+
+def test_should_convert_pem_certificates(signed_request, directory, testclient, db):
+    response = signed_request(directory['newAccount'], signed_request.nonce, {'contact': [_mail_address]})
+    account_id = response.headers['Location']
+
+    response = signed_request(directory['newOrder'], response.headers['Replay-Nonce'], {'identifiers': [{'type': 'dns', 'value': _host}]}, account_id)
+    authz_url = response.json()['authorizations'][0]
+    finalize_order_url = response.json()['finalize']
+
+    response = signed_request(authz_url, response.headers['Replay-Nonce'], '', account_id)
+    challenge_token = response.json()['challenges'][0]['token']
+    challenge_url = response.json()['challenges'][0]['url']
+
+    with mock.patch(
+        'app.acme.challenge.service.httpx.AsyncClient.get',
+        return_value=httpx.Response(200, text=f'{challenge_token}.{signed_request.account_jwk.thumbprint()}'),
+    ):
+        response = signed_request(challenge_url, response.headers['Replay-Nonce'], '', account_id)
+
+    csr = build_csr([_host])
+    response = signed_request(finalize_order_url, response.headers['Replay-Nonce'], {'csr': jwcrypto.common.base64url_encode(csr.public_bytes(Encoding.DER))}, account_id)
+    cert_url = response.json()['certificate']
+    response = signed_request(cert_url, response.headers['Replay-Nonce'], {}, account_id)
+    chain_pem = response.text
+    serial_number = cert_url.rsplit('/', 1)[-1]
+
+    stored = db.fetch_row('select cert_der, issuer_serial_number, csr_der, chain_pem from certificates where serial_number = $1', serial_number)
+    assert stored['cert_der'] == x509.load_pem_x509_certificate(chain_pem.encode()).public_bytes(Encoding.DER)
+    assert stored['csr_der'] == csr.public_bytes(Encoding.DER)
+    assert stored['chain_pem'] is None
+    issuer_chain_pem = db.fetch_row('select chain_pem from issuers where serial_number = $1', stored['issuer_serial_number'])['chain_pem']
+    assert chain_pem.endswith(issuer_chain_pem)
+
+    from acme.certificate import service
+
+    assert service._issuer_chains[stored['issuer_serial_number']] == issuer_chain_pem  # later certificates skip storing the issuer
+
+    # the storage format before migration 009
+    service._chain_cache.clear()
+    db.execute(
+        'update certificates set chain_pem = $2, csr_pem = $3, cert_der = null, issuer_serial_number = null, csr_der = null where serial_number = $1',
+        serial_number,
+        chain_pem,
+        csr.public_bytes(Encoding.PEM).decode(),
+    )
+    response = signed_request(cert_url, response.headers['Replay-Nonce'], {}, account_id)
+    assert response.text == chain_pem
+
+    assert testclient.portal.call(service.convert_pem_certificates) >= 1
+    assert db.fetch_row('select cert_der, issuer_serial_number, csr_der, chain_pem, csr_pem from certificates where serial_number = $1', serial_number) == (
+        stored['cert_der'],
+        stored['issuer_serial_number'],
+        stored['csr_der'],
+        None,
+        None,
+    )
+    service._chain_cache.clear()
+    response = signed_request(cert_url, response.headers['Replay-Nonce'], {}, account_id)
+    assert response.text == chain_pem
+    assert testclient.get(f'/certificates/{serial_number}').text == chain_pem
+
+
+def test_should_skip_unchanged_ca_import(testclient, db):
+    import ca
+
+    imported = db.fetch_row('select serial_number, key_pem_enc, crl_pem from cas where active = true')
+    testclient.portal.call(ca.init)
+    # the key is encrypted with a random IV, a repeated import would store a different ciphertext
+    assert db.fetch_row('select serial_number, key_pem_enc, crl_pem from cas where active = true') == imported
+
+
+def test_should_coalesce_concurrent_finalize_requests(signed_request, directory, monkeypatch):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    from ca import service as ca_service
+
+    response = signed_request(directory['newAccount'], signed_request.nonce, {'contact': [_mail_address]})
+    account_id = response.headers['Location']
+
+    response = signed_request(directory['newOrder'], response.headers['Replay-Nonce'], {'identifiers': [{'type': 'dns', 'value': _host}]}, account_id)
+    authz_url = response.json()['authorizations'][0]
+    finalize_order_url = response.json()['finalize']
+
+    response = signed_request(authz_url, response.headers['Replay-Nonce'], '', account_id)
+    challenge_token = response.json()['challenges'][0]['token']
+    challenge_url = response.json()['challenges'][0]['url']
+
+    with mock.patch(
+        'app.acme.challenge.service.httpx.AsyncClient.get',
+        return_value=httpx.Response(200, text=f'{challenge_token}.{signed_request.account_jwk.thumbprint()}'),
+    ):
+        signed_request(challenge_url, response.headers['Replay-Nonce'], '', account_id)
+
+    sign_csr = ca_service.sign_csr
+    signed = []
+
+    async def slow_sign_csr(*args):
+        signed.append(args)
+        await asyncio.sleep(0.5)  # the retry arrives while the csr is signed
+        return await sign_csr(*args)
+
+    monkeypatch.setattr(ca_service, 'sign_csr', slow_sign_csr)
+
+    payload = {'csr': jwcrypto.common.base64url_encode(build_csr([_host]).public_bytes(Encoding.DER))}
+    nonces = [signed_request.nonce, signed_request.nonce]
+    with ThreadPoolExecutor(2) as pool:
+        responses = list(pool.map(lambda nonce: signed_request(finalize_order_url, nonce, payload, account_id), nonces))
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert responses[0].json() == responses[1].json()
+    assert responses[0].json()['status'] == 'valid'
+    assert responses[0].headers['Replay-Nonce'] != responses[1].headers['Replay-Nonce']
+    assert len(signed) == 1
+
+    response = signed_request(finalize_order_url, signed_request.nonce, payload, account_id)
+    assert response.status_code == 403
+    assert response.json()['type'] == 'urn:ietf:params:acme:error:orderNotReady'
@@ -11,6 +11,7 @@ def test_show_directory(testclient: TestClient):
         'newOrder': 'http://localhost:8000/acme/new-order',
         'revokeCert': 'http://localhost:8000/acme/revoke-cert',
         'keyChange': 'http://localhost:8000/acme/key-change',
+        'renewalInfo': 'http://localhost:8000/acme/renewal-info',
         'meta': {'website': 'http://localhost:8000/'},
     }
 
@@ -27,5 +28,17 @@ def test_directory_shows_terms(testclient: TestClient, monkeypatch):
         'newOrder': 'http://localhost:8000/acme/new-order',
         'revokeCert': 'http://localhost:8000/acme/revoke-cert',
         'keyChange': 'http://localhost:8000/acme/key-change',
+        'renewalInfo': 'http://localhost:8000/acme/renewal-info',
         'meta': {'termsOfService': 'https://example.com/terms.html', 'website': 'http://localhost:8000/'},
     }
+
+
+def test_directory_not_modified(testclient: TestClient):
+    response = testclient.get('/acme/directory')
+    etag = response.headers['ETag']
+    response = testclient.get('/acme/directory', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert not response.content
+    assert testclient.get('/acme/directory', headers={'If-None-Match': f'"other",W/{etag}'}).status_code == 304
+    assert testclient.get('/acme/directory', headers={'If-None-Match': '"other"'}).status_code == 200
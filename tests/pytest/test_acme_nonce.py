@@ -32,3 +32,25 @@ def test_should_persist_new_nonce_with_expiration(testclient: TestClient, direct
 
     age, *_ = db.fetch_row('select expires_at - now() from nonces where id=$1', nonce)
     assert datetime.timedelta(minutes=29, seconds=59) < age < datetime.timedelta(minutes=30, milliseconds=50)
+
+
+def test_should_issue_nonces_from_reservoir(testclient: TestClient, directory, db, monkeypatch) -> None:
+    from collections import deque
+
+    import config
+    from acme.nonce import service
+
+    monkeypatch.setattr(service, '_reservoir', deque())
+    monkeypatch.setattr(config.settings.acme, 'nonce_reservoir_size', 3)
+    assert testclient.portal.call(service.refill) == 3
+    reserved = [nonce for nonce, _ in service._reservoir]
+    count, *_ = db.fetch_row('select count(*) from nonces where id = any($1)', reserved)
+    assert count == 3, 'reserved nonces are already stored'
+
+    assert testclient.get(directory['newNonce']).headers['Replay-Nonce'] == reserved[0]
+    assert testclient.portal.call(service.refill) == 1
+
+    monkeypatch.setattr(service, 'RESERVOIR_MAX_AGE', 0)  # too old to be handed out, falls back to storing a new nonce
+    nonce = testclient.get(directory['newNonce']).headers['Replay-Nonce']
+    assert nonce not in reserved
+    assert not service._reservoir
@@ -73,3 +73,49 @@ def test_should_handle_unknown_orders(signed_request, directory):
     response = signed_request(order_url + '123/finalize', response.headers['Replay-Nonce'], {'csr': 'DEADBEEF'}, account_id)
     assert response.status_code == 404
     assert response.json() == view_order_err
+
+
+def test_should_expire_and_purge_old_orders(testclient, signed_request, directory, db):
+    from datetime import timedelta
+    from functools import partial
+    from pathlib import Path
+
+    from acme.order import service
+
+    response = signed_request(directory['newAccount'], signed_request.nonce, {})
+    account_id = response.headers['Location']
+
+    response = signed_request(directory['newOrder'], response.headers['Replay-Nonce'], {'identifiers': [{'type': 'dns', 'value': 'host1.example.org'}]}, account_id)
+    order_url = response.headers['Location']
+    order_id = order_url.split('/')[-1]
+
+    db.execute("update orders set expires_at = now() - interval '1 minute' where id = $1", order_id)
+    assert testclient.portal.call(partial(service.expire_orders, batch_size=1)) >= 1
+
+    response = signed_request(order_url, response.headers['Replay-Nonce'], '', account_id)
+    assert response.json()['status'] == 'invalid'
+    assert response.json()['error']['detail'] == 'order expired'
+
+    db.execute("update orders set expires_at = now() - interval '100 days' where id = $1", order_id)
+    purge = partial(service.purge_orders, older_than=timedelta(days=90), batch_size=1, archive='table', archive_dir=Path('/nonexistent'))
+    assert testclient.portal.call(purge) >= 1
+
+    assert db.fetch_row('select id from orders where id = $1', order_id) is None
+    archived = db.fetch_row('select data from archived_orders where id = $1', order_id)
+    assert archived is not None
+    assert '"host1.example.org"' in archived['data']
+
+
+def test_should_deactivate_authorization(signed_request, directory):
+    response = signed_request(directory['newAccount'], signed_request.nonce, {})
+    account_id = response.headers['Location']
+    response = signed_request(directory['newOrder'], response.headers['Replay-Nonce'], {'identifiers': [{'type': 'dns', 'value': 'host1.example.org'}]}, account_id)
+    authz_url = response.json()['authorizations'][0]
+    order_url = response.headers['Location']
+
+    response = signed_request(authz_url, response.headers['Replay-Nonce'], {'status': 'deactivated'}, account_id)
+    assert response.status_code == 200, response.text
+    assert response.json()['status'] == 'deactivated'
+
+    response = signed_request(order_url, response.headers['Replay-Nonce'], '', account_id)
+    assert response.json()['status'] == 'invalid'
@@ -0,0 +1,76 @@
+import json
+from datetime import timedelta
+
+import jwcrypto.jwk
+import jwcrypto.jws
+import pytest
+
+from .conftest import TestClient
+
+
+@pytest.fixture
+def ratelimit(monkeypatch):
+    import config
+    from acme.ratelimit import service
+
+    monkeypatch.setattr(service, '_buckets', {})
+    return config.RateLimit, config.settings.ratelimit
+
+
+def test_should_limit_requests_per_ip(testclient: TestClient, directory, monkeypatch, ratelimit):
+    RateLimit, settings = ratelimit
+    monkeypatch.setattr(settings, 'per_ip', RateLimit(requests=2, period=timedelta(hours=1)))
+
+    assert testclient.head(directory['newNonce']).status_code == 200
+    assert testclient.head(directory['newNonce']).status_code == 200
+    response = testclient.get(directory['newNonce'])
+    assert response.status_code == 429
+    assert response.json()['type'] == 'urn:ietf:params:acme:error:rateLimited'
+    assert 1700 < int(response.headers['Retry-After']) <= 1800
+    assert 'Replay-Nonce' not in response.headers
+
+
+def test_should_limit_orders_per_domain(signed_request, directory, monkeypatch, ratelimit):
+    RateLimit, settings = ratelimit
+    monkeypatch.setattr(settings, 'per_domain', RateLimit(requests=1, period=timedelta(days=1)))
+
+    response = signed_request(directory['newAccount'], signed_request.nonce, {'contact': ['mailto:dummy@example.com']})
+    account_id = response.headers['Location']
+    response = signed_request(directory['newOrder'], response.headers['Replay-Nonce'], {'identifiers': [{'type': 'dns', 'value': 'host1.example.org'}]}, account_id)
+    assert response.status_code == 201
+    response = signed_request(directory['newOrder'], response.headers['Replay-Nonce'], {'identifiers': [{'type': 'dns', 'value': 'host2.example.org'}]}, account_id)
+    assert response.status_code == 429
+    assert response.json()['type'] == 'urn:ietf:params:acme:error:rateLimited'
+    response = signed_request(directory['newOrder'], response.headers['Replay-Nonce'], {'identifiers': [{'type': 'dns', 'value': 'host.example.net'}]}, account_id)
+    assert response.status_code == 201
+
+
+def test_should_limit_requests_per_verified_account(testclient: TestClient, signed_request, directory, monkeypatch, ratelimit):
+    RateLimit, settings = ratelimit
+    monkeypatch.setattr(settings, 'per_account', RateLimit(requests=1, period=timedelta(hours=1)))
+
+    response = signed_request(directory['newAccount'], signed_request.nonce, {'contact': ['mailto:dummy@example.com']})
+    account_id = response.headers['Location']
+
+    attacker_jwk = jwcrypto.jwk.JWK.generate(kty='EC', crv='P-256')
+    for _ in range(3):  # requests with a foreign kid but an invalid signature must not drain the account bucket
+        jws = jwcrypto.jws.JWS(json.dumps({}))
+        jws.add_signature(attacker_jwk, protected={'alg': 'ES256', 'nonce': signed_request.nonce, 'url': account_id, 'kid': account_id})
+        response = testclient.post(account_id, content=jws.serialize(), headers={'Content-Type': 'application/jose+json'})
+        assert response.status_code == 403
+
+    response = signed_request(account_id, signed_request.nonce, {}, account_id)
+    assert response.status_code == 200
+    response = signed_request(account_id, response.headers['Replay-Nonce'], {}, account_id)
+    assert response.status_code == 429
+    assert response.json()['type'] == 'urn:ietf:params:acme:error:rateLimited'
+
+
+@pytest.mark.usefixtures('testclient')  # loads the settings
+def test_should_group_domains_by_registered_domain():
+    from acme.ratelimit.service import registered_domain
+
+    assert registered_domain('host.sub.example.org') == 'example.org'
+    assert registered_domain('host.example.co.uk') == 'example.co.uk'
+    assert registered_domain('host.other.co.uk') == 'other.co.uk'
+    assert registered_domain('example.com.au.') == 'example.com.au'
@@ -0,0 +1,81 @@
+import asyncio
+import contextvars
+
+import pytest
+
+from .conftest import TestClient
+
+
+def _limiter(max_limit: int, wait_budget: float = 0.05):
+    import admission
+
+    return admission.AdaptiveLimiter('test', max_limit=max_limit, wait_budget=wait_budget, adaptive=True, tolerance=2.0)
+
+
+@pytest.mark.usefixtures('testclient')  # loads the settings
+def test_should_shed_when_wait_budget_is_exceeded():
+    import admission
+
+    async def run():
+        limiter = _limiter(1)
+        await limiter.acquire()
+        with pytest.raises(admission.Overloaded):
+            await contextvars.Context().run(asyncio.create_task, limiter.acquire())  # other request
+        waiting = contextvars.Context().run(asyncio.create_task, limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release(0.01)  # hands the slot over to the waiting request
+        await waiting
+        assert limiter.in_flight == 1
+
+    asyncio.run(run())
+
+
+@pytest.mark.usefixtures('testclient')
+def test_should_pass_on_slot_of_cancelled_waiter():
+    async def run():
+        limiter = _limiter(1, wait_budget=5)
+        await limiter.acquire()
+        cancelled = contextvars.Context().run(asyncio.create_task, limiter.acquire())
+        waiting = contextvars.Context().run(asyncio.create_task, limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release(None)  # hands the slot over to the first waiting request ...
+        cancelled.cancel()  # ... which is cancelled before it could take it
+        if (await asyncio.gather(cancelled, return_exceptions=True))[0] is None:  # wait_for before Python 3.12 keeps the slot instead
+            limiter.release(None)
+        await asyncio.wait_for(waiting, 1)  # the slot went to the next waiting request
+        assert limiter.in_flight == 1
+        limiter.release(None)
+        assert limiter.in_flight == 0
+
+    asyncio.run(run())
+
+
+@pytest.mark.usefixtures('testclient')
+def test_should_adapt_limit_to_latency():
+    async def run():
+        limiter = _limiter(10)
+        for _ in range(10):
+            async with limiter.slot():
+                await asyncio.sleep(0.001)
+        await limiter.acquire()
+        limiter.release(1.0)  # far above the baseline latency
+        assert limiter.limit == 9
+        for _ in range(100):
+            await limiter.acquire()
+            limiter.release(0.0001)
+        assert limiter.limit == 9  # no saturation, no increase
+
+    asyncio.run(run())
+
+
+def test_should_answer_503_when_overloaded(testclient: TestClient, directory, monkeypatch):
+    import admission
+
+    limiter = _limiter(1, wait_budget=0.01)
+    limiter.in_flight = 1  # database slots are exhausted
+    monkeypatch.setattr(admission, 'database', limiter)
+
+    response = testclient.head(directory['newNonce'])
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert 'Replay-Nonce' not in response.headers
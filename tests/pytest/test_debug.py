@@ -0,0 +1,40 @@
+import time
+
+from .conftest import TestClient
+
+_admin = {'Authorization': 'Bearer admin-secret'}
+
+
+def test_profiler_requires_admin_token(testclient: TestClient):
+    assert testclient.get('/debug/profiler').status_code == 401
+    assert testclient.get('/debug/profiler', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+
+def test_profiler_rejects_invalid_path_pattern(testclient: TestClient):
+    response = testclient.post('/debug/profiler', headers=_admin, json={'mode': 'cprofile', 'path_pattern': '(unclosed'})
+    assert response.status_code == 422, response.text
+
+
+def test_cprofile_matching_requests(testclient: TestClient, directory):
+    response = testclient.post('/debug/profiler', headers=_admin, json={'mode': 'cprofile', 'path_pattern': '/new-nonce$'})
+    assert response.status_code == 204, response.text
+    assert testclient.post('/debug/profiler', headers=_admin, json={}).status_code == 409
+
+    testclient.head(directory['newNonce'])
+    testclient.delete('/debug/profiler', headers=_admin)
+
+    response = testclient.get('/debug/profiler', headers=_admin)
+    assert response.status_code == 200
+    assert 'get_nonce' in response.text
+
+
+def test_sample_event_loop(testclient: TestClient):
+    response = testclient.post('/debug/profiler', headers=_admin, json={'mode': 'sample', 'duration': 0.2, 'interval': 0.001})
+    assert response.status_code == 204, response.text
+    time.sleep(0.3)
+
+    response = testclient.get('/debug/profiler', headers=_admin)
+    assert response.status_code == 200
+    stack, count = response.text.splitlines()[0].rsplit(' ', 1)
+    assert ';' in stack
+    assert int(count) > 0
@@ -0,0 +1,78 @@
+from .conftest import TestClient
+
+
+def test_get_metrics(testclient: TestClient, directory):
+    testclient.head(directory['newNonce'])
+
+    response = testclient.get('/metrics')
+    assert response.status_code == 200, response.text
+    assert response.headers['Content-Type'].startswith('text/plain')
+    assert 'acme_nonces_total{event="issued"}' in response.text
+    assert 'acme_http_requests_total{handler="get_nonce",method="HEAD",status="200"}' in response.text
+    assert 'db_transaction_duration_seconds_count{readonly="false"}' in response.text
+    assert 'db_pool_connections{state="max"} 20.0' in response.text
+
+
+def test_server_timing_header(signed_request, directory):
+    response = signed_request(directory['newAccount'], signed_request.nonce, {'contact': ['mailto:dummy@example.com']})
+    assert response.status_code == 201, response.text
+    sections = {metric.split(';')[0] for metric in response.headers['Server-Timing'].split(', ')}
+    assert {'jws', 'nonce', 'db', 'db-acquire', 'total'} <= sections
+
+
+def test_slow_query_log_is_redacted(testclient: TestClient):
+    import timing
+
+    assert timing.fingerprint("select *  from accounts\n where id = $1 and mail = 'dummy@example.com' limit 10").endswith(
+        ' select * from accounts where id = $1 and mail = ? limit ?'
+    )
+    assert timing.redact(('secret', 42)) == '($1=str, $2=int)'
+
+
+def test_request_id_header(testclient: TestClient):
+    assert testclient.get('/acme/directory', headers={'X-Request-ID': 'proxy-1234'}).headers['X-Request-ID'] == 'proxy-1234'
+    generated = testclient.get('/acme/directory', headers={'X-Request-ID': 'no spaces <allowed>'}).headers['X-Request-ID']
+    assert generated != 'no spaces <allowed>' and len(generated) == 16
+
+
+def test_structured_logging_samples_and_drops(testclient: TestClient):
+    import io
+    import json
+    import logging
+    import threading
+
+    import logger
+    from config import settings
+    from prometheus_client import REGISTRY
+
+    released = threading.Event()
+
+    class BlockingHandler(logging.StreamHandler):
+        def emit(self, record):
+            released.wait(5)
+            super().emit(record)
+
+    output = io.StringIO()
+    handler = BlockingHandler(output)
+    logger.stop()
+    logger.logger.addHandler(handler)
+    dropped_before = REGISTRY.get_sample_value('log_records_dropped_total')
+    try:
+        logger.start(log_format='json', queue_size=1, sample_rates={'noisy': 0})
+        token = logger.request_id.set('abc123')
+        logger.logger.warning('first %s', 'record', extra={'category': 'important'})
+        logger.logger.warning('never logged', extra={'category': 'noisy'})
+        logger.logger.warning('second')
+        logger.logger.warning('third')  # the listener holds at most one record and the queue another one
+        logger.request_id.reset(token)
+        released.set()
+        logger.stop()
+    finally:
+        logger.logger.removeHandler(handler)
+        logger.start(log_format=settings.log_format, queue_size=settings.log_queue_size, sample_rates=settings.log_sample_rates)
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert records[0] | {'time': None} == {'time': None, 'level': 'warning', 'logger': 'uvicorn', 'message': 'first record', 'request_id': 'abc123', 'category': 'important'}
+    assert 'never logged' not in output.getvalue()
+    assert REGISTRY.get_sample_value('log_records_dropped_total') - dropped_before >= 1
+    assert len(records) + REGISTRY.get_sample_value('log_records_dropped_total') - dropped_before == 3
@@ -1,3 +1,7 @@
+import json
+
+import pytest
+
 from .conftest import TestClient
 
 
@@ -14,3 +18,124 @@ def test_get_domains_page(testclient: TestClient):
 def test_download_non_existent_cert(testclient: TestClient):
     response = testclient.get('/certificates/DEADBEEF')
     assert response.status_code == 404, response.text
+
+
+@pytest.fixture(scope='module')
+def two_certificates(db):
+    db.execute(
+        """
+        insert into accounts (id, mail, jwk, jwk_thumbprint) values ('pagination-account-0000000', 'page@example.org', '{"kty": "EC", "x": "page"}', 'pagination-thumbprint');
+        insert into orders (id, account_id, status) values
+            ('pagination-order-1-0000000', 'pagination-account-0000000', 'valid'), ('pagination-order-2-0000000', 'pagination-account-0000000', 'valid');
+        insert into authorizations (id, order_id, status, domain) values
+            ('pagination-authz-1-0000000', 'pagination-order-1-0000000', 'valid', 'page1.example.com'),
+            ('pagination-authz-2-0000000', 'pagination-order-2-0000000', 'valid', 'page2.example.com');
+        insert into certificates (serial_number, cert_der, order_id, not_valid_before, not_valid_after) values
+            ('A1A1', '', 'pagination-order-1-0000000', now(), now() + interval '20 days'),
+            ('A2A2', '', 'pagination-order-2-0000000', now(), now() + interval '10 days');
+        """
+    )
+
+
+@pytest.mark.usefixtures('two_certificates')
+def test_get_next_certificates_page(testclient: TestClient, monkeypatch):
+    import config
+
+    monkeypatch.setattr(config.settings.web, 'log_page_size', 1)
+
+    # ordered by expiration, latest first
+    response = testclient.get('/certificates', params={'certstatus': 'valid', 'domainfilter': 'page*.example.com'})
+    assert response.status_code == 200, response.text
+    assert 'page1.example.com' in response.text
+    assert 'page2.example.com' not in response.text
+    assert 'after=A1A1' in response.text
+
+    response = testclient.get('/certificates', params={'certstatus': 'valid', 'domainfilter': 'page*.example.com', 'after': 'A1A1'})
+    assert response.status_code == 200, response.text
+    assert 'page2.example.com' in response.text
+    assert 'page1.example.com' not in response.text
+    assert 'next page' not in response.text
+
+
+@pytest.mark.usefixtures('two_certificates')
+def test_export_certificates_in_batches(testclient: TestClient, monkeypatch):
+    from web import router_module
+
+    monkeypatch.setattr(router_module, 'EXPORT_BATCH_SIZE', 1)
+    response = testclient.get('/certificates/export', params={'domainfilter': 'page*.example.com'})
+    assert response.status_code == 200, response.text
+    assert [json.loads(line)['serial_number'] for line in response.text.splitlines()] == ['A1A1', 'A2A2']
+
+
+def test_get_next_domains_page(testclient: TestClient):
+    response = testclient.get('/domains', params={'domainstatus': 'invalid', 'after': 'example.com'})
+    assert response.status_code == 200, response.text
+
+
+def test_export_certificates(testclient: TestClient):
+    response = testclient.get('/certificates/export', params={'format': 'csv', 'certstatus': 'valid', 'valid_from': '2020-01-01T00:00:00Z'})
+    assert response.status_code == 200, response.text
+    assert response.headers['Content-Type'].startswith('text/csv')
+    assert response.text.splitlines()[0] == 'serial_number,status,not_valid_before,not_valid_after,revoked_at,domains'
+
+    response = testclient.get('/certificates/export')
+    assert response.status_code == 200, response.text
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+    for line in response.text.splitlines():
+        assert json.loads(line)['status'] in ('valid', 'revoked', 'expired')
+
+
+def test_paginate_domains_page(testclient: TestClient, monkeypatch, db):
+    import config
+
+    db.execute("""insert into domains (domain, first_requested_at, expires_at) values ('page1.example.net', now(), now()), ('page2.example.net', now(), now())""")
+    monkeypatch.setattr(config.settings.web, 'log_page_size', 1)
+
+    response = testclient.get('/domains', params={'domainfilter': 'example.net'})
+    assert response.status_code == 200, response.text
+    assert 'page1.example.net' in response.text
+    assert 'page2.example.net' not in response.text
+    assert 'after=page1.example.net' in response.text
+
+    response = testclient.get('/domains', params={'domainfilter': 'example.net', 'after': 'page1.example.net'})
+    assert response.status_code == 200, response.text
+    assert 'page2.example.net' in response.text
+    assert 'next page' not in response.text
+
+
+@pytest.mark.parametrize(
+    ('path', 'csp'),
+    [('/acme/directory', "base-uri 'self'; default-src 'none';"), ('/endpoints', "script-src 'self' 'unsafe-inline';"), ('/certificates', "script-src 'self';")],
+)
+def test_security_headers(testclient: TestClient, path: str, csp: str):
+    response = testclient.get(path)
+    assert response.headers['X-Frame-Options'] == 'DENY'
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
+    assert csp in response.headers['Content-Security-Policy']
+    assert len(response.headers.get_list('X-Frame-Options')) == 1
+
+
+@pytest.mark.usefixtures('two_certificates')
+def test_download_certificate_cacheable(testclient: TestClient):
+    response = testclient.get('/certificates/A1A1')
+    assert response.status_code == 200, response.text
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == '"A1A1.gz"'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert response.text.startswith('-----BEGIN CERTIFICATE-----')
+
+    response = testclient.get('/certificates/A1A1', headers={'Accept-Encoding': 'identity', 'If-None-Match': '"A1A1.gz"'})
+    assert response.status_code == 200, response.text
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['ETag'] == '"A1A1"'
+
+    response = testclient.get('/certificates/A1A1', headers={'If-None-Match': '"A1A1.gz"'})
+    assert response.status_code == 304
+    assert not response.content
+
+    response = testclient.get('/certificates/A1A1', headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+    assert response.status_code == 200, response.text
+    assert 'Content-Encoding' not in response.headers
+
+    for if_none_match in ('"other","A1A1.gz"', 'W/"A1A1.gz"', '*'):
+        assert testclient.get('/certificates/A1A1', headers={'If-None-Match': if_none_match}).status_code == 304, if_none_match